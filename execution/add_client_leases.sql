@@ -0,0 +1,73 @@
+-- Run this in your Supabase SQL Editor to enable worker mode
+-- (python sync_meta_metrics.py --worker) on more than one host.
+-- Each worker claims a client through a time-limited lease before syncing it;
+-- a crashed worker stops renewing and its leases expire after the TTL.
+-- All timestamps come from the database clock (now()), not from the workers.
+-- Workers started together share a round id (--round-id); a client completed
+-- in a round is not claimed again by any worker of that round.
+
+-- 1. Lease columns
+ALTER TABLE public.clients
+ADD COLUMN IF NOT EXISTS lease_owner TEXT,
+ADD COLUMN IF NOT EXISTS lease_expires_at TIMESTAMPTZ,
+ADD COLUMN IF NOT EXISTS sync_completed_at TIMESTAMPTZ,
+ADD COLUMN IF NOT EXISTS sync_completed_round TEXT;
+
+-- Earlier versions took the worker's own start time instead of a shared round id
+DROP FUNCTION IF EXISTS public.claim_client_lease(TEXT, TEXT, INTEGER, TIMESTAMPTZ);
+DROP FUNCTION IF EXISTS public.release_client_lease(TEXT, TEXT, BOOLEAN);
+
+-- 2. Claim: conditional update, succeeds only if the client is free (no owner
+--    or expired lease) or already ours, and was not completed in this round.
+--    Returns true when the lease was taken.
+CREATE OR REPLACE FUNCTION public.claim_client_lease(
+    p_client_id TEXT,
+    p_owner TEXT,
+    p_ttl_seconds INTEGER,
+    p_round_id TEXT
+) RETURNS BOOLEAN
+LANGUAGE sql AS $$
+    UPDATE public.clients
+       SET lease_owner = p_owner,
+           lease_expires_at = now() + make_interval(secs => p_ttl_seconds)
+     WHERE id::text = p_client_id
+       AND (lease_owner IS NULL OR lease_owner = p_owner OR lease_expires_at < now())
+       AND sync_completed_round IS DISTINCT FROM p_round_id
+    RETURNING true;
+$$;
+
+-- 3. Heartbeat: extends every lease still held by the worker; returns their ids
+CREATE OR REPLACE FUNCTION public.renew_client_leases(
+    p_owner TEXT,
+    p_ttl_seconds INTEGER
+) RETURNS SETOF TEXT
+LANGUAGE sql AS $$
+    UPDATE public.clients
+       SET lease_expires_at = now() + make_interval(secs => p_ttl_seconds)
+     WHERE lease_owner = p_owner
+    RETURNING id::text;
+$$;
+
+-- 4. Release (p_completed marks the client as synced in the round p_round_id)
+CREATE OR REPLACE FUNCTION public.release_client_lease(
+    p_client_id TEXT,
+    p_owner TEXT,
+    p_completed BOOLEAN,
+    p_round_id TEXT
+) RETURNS BOOLEAN
+LANGUAGE sql AS $$
+    UPDATE public.clients
+       SET lease_owner = NULL,
+           lease_expires_at = NULL,
+           sync_completed_at = CASE WHEN p_completed THEN now() ELSE sync_completed_at END,
+           sync_completed_round = CASE WHEN p_completed THEN p_round_id ELSE sync_completed_round END
+     WHERE id::text = p_client_id
+       AND lease_owner = p_owner
+    RETURNING true;
+$$;
+
+-- 5. Check: current leases
+SELECT cliente, lease_owner, lease_expires_at, sync_completed_round, sync_completed_at
+FROM public.clients
+WHERE ativo = true
+ORDER BY lease_expires_at NULLS LAST;
@@ -0,0 +1,31 @@
+-- Run this in your Supabase SQL Editor to enable native upserts
+-- (INSERT ... ON CONFLICT) in sync_meta_metrics.py.
+-- Without this constraint the script falls back to reading existing ids
+-- before every write.
+
+-- 1. Remove duplicated rows, keeping the most recently written physical row
+DELETE FROM public.dashboard_campaign_metrics a
+USING public.dashboard_campaign_metrics b
+WHERE a.client_id = b.client_id
+  AND a.campaign_id = b.campaign_id
+  AND a.data_referencia = b.data_referencia
+  AND a.ctid < b.ctid;
+
+-- 2. Create the unique key used by upsert(on_conflict=...)
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_constraint
+        WHERE conname = 'dashboard_campaign_metrics_client_campaign_date_key'
+    ) THEN
+        ALTER TABLE public.dashboard_campaign_metrics
+        ADD CONSTRAINT dashboard_campaign_metrics_client_campaign_date_key
+        UNIQUE (client_id, campaign_id, data_referencia);
+    END IF;
+END $$;
+
+-- 3. Check: should return one row
+SELECT conname, pg_get_constraintdef(oid)
+FROM pg_constraint
+WHERE conrelid = 'public.dashboard_campaign_metrics'::regclass
+  AND contype = 'u';
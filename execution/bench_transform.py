@@ -0,0 +1,217 @@
+"""
+Micro-benchmark da transformação de insights em linhas de dashboard_campaign_metrics.
+
+Compara o caminho linha a linha (baseline_metric_row + baseline_process_actions,
+cópia congelada da implementação original da sincronização) com a transformação
+colunar (insight_transform) em um conjunto sintético de 37 meses x 500 campanhas
+com objetivos e nomes variados, conferindo que as duas geram as mesmas linhas.
+Se as regras de process_actions mudarem, a divergência aparece aqui.
+Não precisa de credenciais nem de rede.
+
+Uso: python bench_transform.py [--months 37] [--campaigns 500]
+"""
+import argparse
+import gc
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+from typing import Dict, List, Optional
+
+from insight_transform import metric_rows_from_columns, transform_insights
+
+ACTION_TYPES = [
+    'link_click', 'post_engagement', 'page_engagement', 'video_view', 'landing_page_view',
+    'lead', 'leads', 'onsite_conversion.messaging_conversation_started_7d',
+    'onsite_conversion.messaging_conversation_started_1d', 'omnichannel_messaging_conversation_started',
+    'onsite_conversion.messaging_first_reply', 'omnichannel_messaging_conversation_started_7d',
+    'purchase', 'offsite_conversion.fb_pixel_lead', 'add_to_cart',
+]
+
+OBJECTIVES = [
+    'OUTCOME_LEADS', 'OUTCOME_ENGAGEMENT', 'OUTCOME_ENGAGEMENT ', 'OUTCOME_SALES', 'OUTCOME_TRAFFIC',
+    'OUTCOME_AWARENESS', 'MESSAGES', 'LEAD_GENERATION', 'CONVERSIONS', None,
+]
+
+CAMPAIGN_NAMES = [
+    'Campanha', '[LEAD] Formulario', '[MSG] WhatsApp', 'Venda Direta', 'Reconhecimento de marca',
+    'Trafego - Site', '', 'Sem nome',
+]
+
+
+def synthetic_campaigns(campaigns: int, seed: int = 42) -> dict:
+    """{campaign_id: (nome, objetivo)} variados, para exercitar as regras por objetivo e nome"""
+    rng = random.Random(seed)
+    return {str(120000000000 + c): (rng.choice(CAMPAIGN_NAMES), rng.choice(OBJECTIVES)) for c in range(campaigns)}
+
+
+def synthetic_insights(months: int, campaigns: int, seed: int = 42) -> dict:
+    """{campaign_id: [insight diário]} parecido com o que o Graph API devolve"""
+    rng = random.Random(seed)
+    start = date.today() - timedelta(days=months * 30)
+    days = [(start + timedelta(days=i)).isoformat() for i in range(months * 30)]
+
+    data = {}
+    for c in range(campaigns):
+        rows = []
+        for day in days:
+            actions = [
+                {"action_type": action_type, "value": str(rng.randint(1, 200))}
+                for action_type in rng.sample(ACTION_TYPES, rng.randint(0, 7))
+            ]
+            # Às vezes o mesmo action_type repetido (vale o último, como no action_map)
+            if actions and rng.random() < 0.05:
+                actions.append({"action_type": actions[0]["action_type"], "value": str(rng.randint(1, 200))})
+            rows.append({
+                "date_start": day,
+                "date_stop": day,
+                "spend": f"{rng.uniform(0, 500):.2f}",
+                "impressions": str(rng.randint(0, 50000)),
+                "clicks": str(rng.randint(0, 900)),
+                "reach": str(rng.randint(0, 30000)),
+                "actions": actions,
+            })
+        data[str(120000000000 + c)] = rows
+    return data
+
+
+# ----------------------------------------------------------------
+# Cópia congelada do caminho original (sync_meta_metrics.py antes da
+# transformação colunar): não editar junto com as regras de produção
+# ----------------------------------------------------------------
+
+def baseline_process_actions(actions: List[Dict], objective: str = None, campaign_name: str = "", insight_data: Dict = None) -> tuple:
+    """
+    Processa array de ações e retorna (resultado_valor, resultado_nome)
+    
+    NOVA LÓGICA GERAL:
+    Independente do objetivo, procuramos as métricas reais que o cliente considera como "Lead".
+    - Conversas de mensagem
+    - Formulários de lead / site lead
+    - Compras (purchases)
+    """
+    if not actions:
+        return (0.0, None)
+    
+    action_map = {a.get('action_type'): float(a.get('value', 0)) for a in actions}
+    
+    # 1. Cadastros/Formulários (Super Prioridade)
+    if 'lead' in action_map:
+        return (action_map['lead'], 'lead')
+    if 'leads' in action_map:
+        return (action_map['leads'], 'leads')
+        
+    # 2. Início de Conversa (Mensagens)
+    # Procuramos variáveis consolidadas no Meta:
+    msg_keys = [
+        'onsite_conversion.messaging_conversation_started_7d',
+        'onsite_conversion.messaging_conversation_started_1d',
+        'omnichannel_messaging_conversation_started_7d',
+        'omnichannel_messaging_conversation_started',
+        'onsite_conversion.messaging_first_reply'
+    ]
+    for key in msg_keys:
+        if key in action_map:
+            return (action_map[key], key)
+            
+    # 3. Compras
+    if 'purchase' in action_map:
+        return (action_map['purchase'], 'purchase')
+        
+    # Para qualquer outra métrica de engajamento, tráfego e conscientização, 
+    # retornamos 0 para não poluir o painel "Leads" com cliques de link vazios.
+    return (0.0, None)
+
+
+def baseline_metric_row(client_id: str, campaign: Dict, insight: Dict) -> Optional[Dict]:
+    """Um dia de insight do Meta -> linha de dashboard_campaign_metrics, como no loop original"""
+    campaign_id = campaign.get('id')
+    campaign_name = campaign.get('name', 'Sem nome')
+
+    # Usar date_start como data de referência
+    date_str = insight.get('date_start')
+    if not date_str:
+        return None
+    
+    # Processar ações
+    actions = insight.get('actions', [])
+    resultado_valor, resultado_nome = baseline_process_actions(actions, campaign.get('objective'), campaign_name, insight)
+    
+    # Preparar dados para inserção
+    return {
+        "client_id": client_id,
+        "campaign_id": campaign_id,
+        "campaign_name": campaign_name,
+        "data_referencia": date_str,
+        "investimento": float(insight.get('spend', 0)) if insight.get('spend') else 0.0,
+        "impressoes": int(insight.get('impressions', 0)) if insight.get('impressions') else 0,
+        "cliques_link": int(insight.get('clicks', 0)) if insight.get('clicks') else 0,
+        "alcance": int(insight.get('reach', 0)) if insight.get('reach') else 0,
+        "resultado_valor": resultado_valor, # Já garantido ser float (0.0 se vazio)
+        "resultado_nome": resultado_nome
+    }
+
+
+def row_path(campaign: Dict, insights: list) -> list:
+    rows = [baseline_metric_row("client", campaign, insight) for insight in insights]
+    return [row for row in rows if row]
+
+
+def columnar_path(campaign: Dict, insights: list) -> list:
+    campaign_name = campaign.get('name', 'Sem nome')
+    columns = transform_insights(insights, campaign.get('objective'), campaign_name)
+    return metric_rows_from_columns(columns, "client", campaign.get('id'), campaign_name)
+
+
+def run(path, campaigns: dict, data: dict) -> int:
+    """Transforma campanha a campanha (como na sincronização), sem acumular as linhas"""
+    count = 0
+    for campaign_id, insights in data.items():
+        count += len(path(campaigns[campaign_id], insights))
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark da transformação de insights.')
+    parser.add_argument('--months', type=int, default=37, help='Meses de dados diários por campanha.')
+    parser.add_argument('--campaigns', type=int, default=500, help='Quantidade de campanhas.')
+    parser.add_argument('--repeat', type=int, default=3, help='Repetições de cada caminho (vale a melhor).')
+    args = parser.parse_args()
+
+    print(f"Gerando {args.months} meses x {args.campaigns} campanhas...")
+    data = synthetic_insights(args.months, args.campaigns)
+    campaigns = {campaign_id: {"id": campaign_id, "name": name, "objective": objective}
+                 for campaign_id, (name, objective) in synthetic_campaigns(args.campaigns).items()}
+    # Campanha sem nome na listagem: os dois caminhos usam 'Sem nome'
+    next(iter(campaigns.values())).pop("name")
+    total = sum(len(rows) for rows in data.values())
+    print(f"OK: {total} insight(s) diario(s)")
+
+    diverging = [cid for cid, insights in data.items()
+                 if row_path(campaigns[cid], insights) != columnar_path(campaigns[cid], insights)]
+    if diverging:
+        print(f"ERRO: as transformacoes divergem em {len(diverging)} campanha(s)")
+        sys.exit(1)
+    else:
+        print("OK: as duas transformacoes geram as mesmas linhas")
+
+    speeds = {}
+    for name, path in (("linha a linha", row_path), ("colunar", columnar_path)):
+        timings = []
+        for _ in range(args.repeat):
+            gc.collect()
+            gc.disable()
+            started = time.perf_counter()
+            run(path, campaigns, data)
+            timings.append(time.perf_counter() - started)
+            gc.enable()
+        elapsed = min(timings)
+        speeds[name] = total / elapsed
+        print(f"{name:>14}: {elapsed:.2f}s ({speeds[name]:,.0f} linhas/s)")
+
+    print(f"Colunar: {speeds['colunar'] / speeds['linha a linha']:.2f}x o caminho linha a linha")
+
+
+if __name__ == "__main__":
+    main()
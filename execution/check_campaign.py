@@ -1,7 +1,7 @@
 import os
 import sys
 import json
-import requests
+from http_pool import http_get
 from dotenv import load_dotenv
 
 load_dotenv(dotenv_path=r'c:\Users\Christian\Desktop\DASHBOARD CURSOR\.env')
@@ -21,7 +21,7 @@ headers = {
 
 endpoint = f"{supabase_url}/rest/v1/dashboard_campaign_metrics?campaign_name=eq.CA%5BMENSAGEM%5D%5BVIC%20SERRANO%5D%5BVictor%5D%2012.02&select=data_referencia,investimento,resultado_valor,resultado_nome"
 
-resp = requests.get(endpoint, headers=headers)
+resp = http_get(endpoint, headers=headers)
 data = resp.json()
 
 if not isinstance(data, list):
@@ -1,22 +1,32 @@
 import os
-from datetime import datetime, timedelta, timezone
 from dotenv import load_dotenv
 from supabase import create_client
 
 load_dotenv()
 supabase = create_client(os.getenv('SUPABASE_URL'), os.getenv('SUPABASE_KEY'))
 
-since = (datetime.now(timezone.utc) - timedelta(minutes=20)).isoformat()
-logs = supabase.table("logs").select("mensagem,created_at").eq("status", "success").gte("created_at", since).execute()
-processed = set()
-for log in logs.data:
-    if "Sincronização concluída para" in log['mensagem']:
-        name = log['mensagem'].replace("Sincronização concluída para ", "")
-        processed.add(name)
+from sync_state import SyncState
 
-clients = supabase.table("clients").select("cliente").eq("ativo", True).execute()
-total_clients = [c['cliente'] for c in clients.data]
+# Progresso da execução mais recente, a partir dos checkpoints locais (sync_state.db)
+state = SyncState()
+run = state.latest_run()
+if run is None:
+    print("Nenhuma execucao registrada em sync_state.db")
+    raise SystemExit(0)
 
-print(f"Total de clientes ativos: {len(total_clients)}")
-print(f"Clientes processados nos últimos 20 min: {len(processed)}")
-print(f"Faltam: {set(total_clients) - processed}")
+progress = state.run_progress(run['run_id'])
+clients_done, last_client = progress.get('client', (0, None))
+campaigns_done, last_campaign = progress.get('campaign', (0, None))
+
+print(f"Execucao: {run['run_id']} (iniciada em {run['started_at']})")
+print(f"Situacao: {'concluida em ' + run['finished_at'] if run['finished_at'] else 'em andamento ou interrompida'}")
+print(f"Clientes concluidos: {clients_done}/{run['clients']}")
+print(f"Campanhas concluidas: {campaigns_done}")
+print(f"Ultimo registro: {max(filter(None, [last_client, last_campaign]), default='-')}")
+
+done = state.get_completed_units(run['run_id'], 'client')
+clients = supabase.table("clients").select("id,cliente").eq("ativo", True).execute()
+missing = [c['cliente'] for c in clients.data if c['id'] not in done]
+if run['options'].get('client'):
+    missing = [name for name in missing if run['options']['client'].lower() in name.lower()]
+print(f"Faltam: {set(missing)}")
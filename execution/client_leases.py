@@ -0,0 +1,134 @@
+"""
+Leases de clientes para rodar a sincronização em vários processos/hosts.
+
+No modo worker cada processo só sincroniza um cliente depois de tomar o lease
+dele na tabela clients (funções de add_client_leases.sql, chamadas por RPC).
+O lease vale por ttl segundos e é renovado por uma thread de heartbeat
+enquanto o processo trabalha; se o processo cair, o lease expira e outro
+worker pode assumir o cliente. Ao terminar, o lease é liberado e, se o
+cliente foi concluído, sync_completed_round impede que outro worker da mesma
+rodada o sincronize de novo. A rodada é o round_id passado a todos os workers
+(--round-id), não o horário de início de cada processo: um worker que começa
+depois de outro já ter concluído um cliente não o sincroniza de novo.
+
+shard_of() é a divisão estática (--shard i/N): cada cliente pertence a um
+único shard, pelo hash do id.
+"""
+import hashlib
+import os
+import socket
+import threading
+from typing import Optional, Set
+
+LEASE_TTL_SECONDS = 300
+LEASE_HEARTBEAT_SECONDS = 60
+
+
+def default_owner() -> str:
+    """Identificação do worker: host:pid"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def shard_of(client_id: str, shards: int) -> int:
+    """Shard (0..shards-1) do cliente; estável entre processos e execuções"""
+    return int(hashlib.md5(str(client_id).encode("utf-8")).hexdigest(), 16) % shards
+
+
+def parse_shard(value: str) -> tuple:
+    """"i/N" (i de 1 a N) -> (índice 0..N-1, N)"""
+    index, sep, total = value.partition("/")
+    try:
+        index, total = int(index), int(total)
+    except ValueError:
+        raise ValueError(f"shard invalido '{value}' (use i/N, ex: 1/3)")
+    if not sep or total < 1 or not 1 <= index <= total:
+        raise ValueError(f"shard invalido '{value}' (use i/N com 1 <= i <= N)")
+    return index - 1, total
+
+
+class ClientLeases:
+    def __init__(self, supabase, round_id: str, owner: Optional[str] = None, ttl: int = LEASE_TTL_SECONDS,
+                 heartbeat: float = LEASE_HEARTBEAT_SECONDS):
+        self.supabase = supabase
+        # Rodada compartilhada pelos workers: cliente concluído nela não é sincronizado de novo
+        self.round_id = round_id
+        self.owner = owner or default_owner()
+        self.ttl = ttl
+        self.heartbeat = heartbeat
+
+        self._lock = threading.Lock()
+        self._held: Set[str] = set()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        # Estatísticas
+        self.claimed = 0
+        self.skipped = 0
+        self.lost = 0
+
+    def claim(self, client_id: str) -> bool:
+        """Tenta tomar o lease do cliente; False se outro worker está com ele ou já o concluiu"""
+        response = self.supabase.rpc("claim_client_lease", {
+            "p_client_id": str(client_id),
+            "p_owner": self.owner,
+            "p_ttl_seconds": self.ttl,
+            "p_round_id": self.round_id,
+        }).execute()
+        if not response.data:
+            self.skipped += 1
+            return False
+
+        with self._lock:
+            self._held.add(str(client_id))
+            self.claimed += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="lease-heartbeat", daemon=True)
+                self._thread.start()
+        return True
+
+    def release(self, client_id: str, completed: bool):
+        with self._lock:
+            self._held.discard(str(client_id))
+        try:
+            self.supabase.rpc("release_client_lease", {
+                "p_client_id": str(client_id),
+                "p_owner": self.owner,
+                "p_completed": completed,
+                "p_round_id": self.round_id,
+            }).execute()
+        except Exception as e:
+            # O lease expira sozinho depois do TTL
+            print(f"   AVISO: Falha ao liberar lease do cliente {client_id}: {str(e)}")
+
+    def renew(self):
+        """Estende os leases deste worker; avisa se algum foi perdido (expirou e outro worker assumiu)"""
+        with self._lock:
+            held = set(self._held)
+        response = self.supabase.rpc("renew_client_leases", {
+            "p_owner": self.owner,
+            "p_ttl_seconds": self.ttl,
+        }).execute()
+        renewed = {str(row) if not isinstance(row, dict) else str(next(iter(row.values())))
+                   for row in (response.data or [])}
+        with self._lock:
+            # Só conta como perdido o que já era nosso antes da renovação e ainda não foi liberado
+            lost = (held - renewed) & self._held
+            self._held -= lost
+            self.lost += len(lost)
+        for client_id in lost:
+            print(f"   AVISO: Lease do cliente {client_id} perdido (expirou); outro worker pode assumi-lo")
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def _run(self):
+        while not self._stop.wait(self.heartbeat):
+            with self._lock:
+                if not self._held:
+                    continue
+            try:
+                self.renew()
+            except Exception as e:
+                print(f"   AVISO: Falha ao renovar leases ({self.owner}): {str(e)}")
@@ -1,5 +1,5 @@
 import os
-import requests
+from http_pool import http_get, supabase_client_options
 import json
 from dotenv import load_dotenv
 from supabase import create_client
@@ -7,7 +7,7 @@ from supabase import create_client
 load_dotenv()
 
 # Setup Supabase (Service Role to read DB)
-supabase = create_client(os.getenv('SUPABASE_URL'), os.getenv('SUPABASE_KEY'))
+supabase = create_client(os.getenv('SUPABASE_URL'), os.getenv('SUPABASE_KEY'), options=supabase_client_options())
 
 # Meta Setup
 ACCESS_TOKEN = os.getenv('META_ACCESS_TOKEN')
@@ -39,7 +39,7 @@ def debug_pedro():
     }
     
     print("\nFetching Campaigns from Meta...")
-    resp = requests.get(url_camp, params=params_camp).json()
+    resp = http_get(url_camp, params=params_camp).json()
     
     campaigns = resp.get('data', [])
     print(f"Found {len(campaigns)} campaigns.")
@@ -57,7 +57,7 @@ def debug_pedro():
             'date_preset': 'last_30d',
             'fields': 'spend,impressions,actions'
         }
-        res_ins = requests.get(url_ins, params=params_ins).json()
+        res_ins = http_get(url_ins, params=params_ins).json()
         data_ins = res_ins.get('data', [])
         
         if data_ins:
@@ -1,7 +1,7 @@
 
 import os
 import sys
-import requests
+from http_pool import http_get
 from dotenv import load_dotenv
 
 if sys.platform == 'win32':
@@ -28,7 +28,7 @@ def deep_inspect(campaign_id):
         "date_preset": "last_30d"
     }
     
-    resp = requests.get(url, params=params)
+    resp = http_get(url, params=params)
     data = resp.json().get('data', [])
     
     if not data:
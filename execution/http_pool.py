@@ -0,0 +1,226 @@
+"""
+Sessões HTTP compartilhadas (keep-alive + pool de conexões) para o Meta e o Supabase.
+
+Cada requests.get solto abre uma conexão TLS nova com graph.facebook.com.
+Aqui todas as chamadas reaproveitam as mesmas conexões, com gzip, timeouts
+padrão e tamanho de pool configuráveis pelo .env:
+
+- HTTP_POOL_SIZE: conexões mantidas por host (padrão 10)
+- HTTP_CONNECT_TIMEOUT: timeout de conexão em segundos (padrão 5)
+- HTTP_READ_TIMEOUT: timeout de leitura em segundos (padrão 30)
+
+connection_stats() informa, por host, quantas requisições foram feitas,
+quantas conexões foram abertas (inclusive reconexões de sockets keep-alive
+que caíram) e quantas vezes uma conexão já aberta do pool
+foi reaproveitada (requisições que falharam antes de conseguir conexão não
+entram em nenhum dos dois).
+"""
+import os
+import threading
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', '10'))
+HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', '5'))
+HTTP_READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', '30'))
+
+DEFAULT_HEADERS = {"Accept-Encoding": "gzip", "Connection": "keep-alive"}
+
+_stats_lock = threading.Lock()
+_stats: Dict[str, Dict[str, int]] = {}
+
+
+def _count(host: Optional[str], key: str):
+    with _stats_lock:
+        entry = _stats.setdefault(host or "?", {"requests": 0, "opened": 0, "reused": 0})
+        entry[key] += 1
+
+
+def connection_stats() -> Dict[str, Dict[str, int]]:
+    """{host: {"requests", "opened", "reused"}} desde o início do processo"""
+    with _stats_lock:
+        return {host: dict(entry) for host, entry in _stats.items()}
+
+
+def print_connection_stats():
+    for host, entry in sorted(connection_stats().items()):
+        print(f"Conexoes {host}: {entry['requests']} requisicao(oes), "
+              f"{entry['opened']} aberta(s), {entry['reused']} reaproveitada(s)")
+
+
+# ----------------------------------------------------------------
+# requests (Meta Graph API)
+# ----------------------------------------------------------------
+
+# Conexões abertas contadas no connect(): o urllib3 também reconecta, sem criar
+# outra conexão, quando o socket keep-alive de uma conexão do pool caiu
+
+class _CountingHTTPConnection(HTTPConnection):
+    def connect(self):
+        _count(self.host, "opened")
+        super().connect()
+
+
+class _CountingHTTPSConnection(HTTPSConnection):
+    def connect(self):
+        _count(self.host, "opened")
+        super().connect()
+
+
+def _count_pooled(host: Optional[str], conn):
+    # Conexão do pool com socket aberto: reaproveitada (o _get_conn já fechou as que caíram)
+    if getattr(conn, "sock", None) is not None:
+        _count(host, "reused")
+
+
+class _CountingHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _CountingHTTPConnection
+
+    def _get_conn(self, timeout=None):
+        conn = super()._get_conn(timeout)
+        _count_pooled(self.host, conn)
+        return conn
+
+
+class _CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _CountingHTTPSConnection
+
+    def _get_conn(self, timeout=None):
+        conn = super()._get_conn(timeout)
+        _count_pooled(self.host, conn)
+        return conn
+
+
+class _PooledAdapter(HTTPAdapter):
+    """HTTPAdapter que conta conexões novas e aplica timeout padrão"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _CountingHTTPConnectionPool,
+            "https": _CountingHTTPSConnectionPool,
+        }
+
+    def send(self, request, timeout=None, **kwargs):
+        if timeout is None:
+            timeout = (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+        response = super().send(request, timeout=timeout, **kwargs)
+        _count(urlsplit(request.url).hostname, "requests")
+        return response
+
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """Sessão requests compartilhada pelo processo"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = _PooledAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE, max_retries=0)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            session.headers.update(DEFAULT_HEADERS)
+            _session = session
+        return _session
+
+
+def http_get(url: str, params: Optional[Dict] = None, **kwargs) -> requests.Response:
+    """Atalho para GET na sessão compartilhada (substitui requests.get nos scripts)"""
+    return get_session().get(url, params=params, **kwargs)
+
+
+def http_post(url: str, data: Optional[Dict] = None, **kwargs) -> requests.Response:
+    """Atalho para POST na sessão compartilhada"""
+    return get_session().post(url, data=data, **kwargs)
+
+
+# ----------------------------------------------------------------
+# httpx (Supabase / motor assíncrono)
+# ----------------------------------------------------------------
+
+def _trace_counter(host: str):
+    """
+    Conta a conexão da requisição pelos eventos de trace do httpcore: aberta se
+    houve connect_tcp, reaproveitada se os headers foram enviados sem connect_tcp
+    """
+    opened = False
+
+    def on_event(event_name: str):
+        nonlocal opened
+        if event_name == "connection.connect_tcp.complete":
+            opened = True
+            _count(host, "opened")
+        elif event_name.endswith("send_request_headers.started") and not opened:
+            _count(host, "reused")
+
+    return on_event
+
+
+def _on_request(request: httpx.Request):
+    on_event = _trace_counter(request.url.host)
+
+    def trace(event_name: str, info: Dict):
+        on_event(event_name)
+
+    request.extensions["trace"] = trace
+    _count(request.url.host, "requests")
+
+
+async def _on_request_async(request: httpx.Request):
+    on_event = _trace_counter(request.url.host)
+
+    async def trace(event_name: str, info: Dict):
+        on_event(event_name)
+
+    request.extensions["trace"] = trace
+    _count(request.url.host, "requests")
+
+
+def httpx_timeout() -> httpx.Timeout:
+    return httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT)
+
+
+def make_httpx_client(pool_size: int = HTTP_POOL_SIZE) -> httpx.Client:
+    """httpx.Client com pool/keep-alive e contadores de conexão"""
+    return httpx.Client(
+        limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+        timeout=httpx_timeout(),
+        headers=DEFAULT_HEADERS,
+        event_hooks={"request": [_on_request]},
+    )
+
+
+def make_async_httpx_client(pool_size: int = HTTP_POOL_SIZE) -> httpx.AsyncClient:
+    """httpx.AsyncClient com pool/keep-alive e contadores de conexão"""
+    return httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+        timeout=httpx_timeout(),
+        headers=DEFAULT_HEADERS,
+        event_hooks={"request": [_on_request_async]},
+    )
+
+
+def supabase_client_options():
+    """
+    Opções do supabase-py usando o httpx.Client compartilhado (pool + contadores).
+    Versões antigas do supabase-py não aceitam httpx_client; nesse caso retorna
+    None e o cliente usa o pool interno padrão.
+    """
+    try:
+        from supabase.lib.client_options import SyncClientOptions as SupabaseOptions
+    except ImportError:
+        from supabase.lib.client_options import ClientOptions as SupabaseOptions
+
+    try:
+        return SupabaseOptions(httpx_client=make_httpx_client(), postgrest_client_timeout=httpx_timeout())
+    except TypeError:
+        return None
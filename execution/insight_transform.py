@@ -0,0 +1,118 @@
+"""
+Transformação colunar dos insights diários do Meta.
+
+Em vez de montar um dict por insight e reler spend/impressions/clicks/reach com
+vários insight.get (o caminho original), uma página de insights vira colunas
+tipadas (array.array), cada uma montada por uma list comprehension.
+
+O resultado de cada dia continua vindo de process_actions, que recebe o
+objetivo e o nome da campanha e é a fonte das regras de resultado (também
+usada pelo --reclassify). bench_transform.py guarda uma cópia congelada do
+caminho linha a linha original e confere que as linhas geradas são as mesmas.
+"""
+from array import array
+from typing import Dict, List, Optional
+
+
+def process_actions(actions: List[Dict], objective: str = None, campaign_name: str = "", insight_data: Dict = None) -> tuple:
+    """
+    Processa array de ações e retorna (resultado_valor, resultado_nome)
+    
+    NOVA LÓGICA GERAL:
+    Independente do objetivo, procuramos as métricas reais que o cliente considera como "Lead".
+    - Conversas de mensagem
+    - Formulários de lead / site lead
+    - Compras (purchases)
+    """
+    if not actions:
+        return (0.0, None)
+    
+    action_map = {a.get('action_type'): float(a.get('value', 0)) for a in actions}
+    
+    # 1. Cadastros/Formulários (Super Prioridade)
+    if 'lead' in action_map:
+        return (action_map['lead'], 'lead')
+    if 'leads' in action_map:
+        return (action_map['leads'], 'leads')
+        
+    # 2. Início de Conversa (Mensagens)
+    # Procuramos variáveis consolidadas no Meta:
+    msg_keys = [
+        'onsite_conversion.messaging_conversation_started_7d',
+        'onsite_conversion.messaging_conversation_started_1d',
+        'omnichannel_messaging_conversation_started_7d',
+        'omnichannel_messaging_conversation_started',
+        'onsite_conversion.messaging_first_reply'
+    ]
+    for key in msg_keys:
+        if key in action_map:
+            return (action_map[key], key)
+            
+    # 3. Compras
+    if 'purchase' in action_map:
+        return (action_map['purchase'], 'purchase')
+        
+    # Para qualquer outra métrica de engajamento, tráfego e conscientização, 
+    # retornamos 0 para não poluir o painel "Leads" com cliques de link vazios.
+    return (0.0, None)
+
+
+class InsightColumns:
+    """Uma página de insights em colunas; dias sem date_start são descartados"""
+
+    __slots__ = ("dates", "spend", "impressions", "clicks", "reach", "result_value", "result_name")
+
+    def __init__(self):
+        self.dates: List[str] = []
+        self.spend = array('d')
+        self.impressions = array('q')
+        self.clicks = array('q')
+        self.reach = array('q')
+        self.result_value = array('d')
+        self.result_name: List[Optional[str]] = []
+
+    def __len__(self) -> int:
+        return len(self.dates)
+
+
+def transform_insights(insights: List[Dict], objective: str = None, campaign_name: str = "") -> InsightColumns:
+    """
+    Converte uma lista de insights diários em colunas tipadas, uma coluna por vez.
+    O resultado de cada dia é o de process_actions para o objetivo e o nome da campanha.
+    """
+    insights = [insight for insight in insights if insight.get('date_start')]
+    columns = InsightColumns()
+
+    columns.dates = [insight['date_start'] for insight in insights]
+    columns.spend = array('d', [float(v) if v else 0.0 for v in [i.get('spend') for i in insights]])
+    columns.impressions = array('q', [int(v) if v else 0 for v in [i.get('impressions') for i in insights]])
+    columns.clicks = array('q', [int(v) if v else 0 for v in [i.get('clicks') for i in insights]])
+    columns.reach = array('q', [int(v) if v else 0 for v in [i.get('reach') for i in insights]])
+
+    results = [process_actions(insight.get('actions', []), objective, campaign_name, insight) for insight in insights]
+    columns.result_value = array('d', [value for value, _ in results])
+    columns.result_name = [name for _, name in results]
+
+    return columns
+
+
+def metric_rows_from_columns(columns: InsightColumns, client_id: str, campaign_id: str,
+                             campaign_name: str) -> List[Dict]:
+    """Monta as linhas de dashboard_campaign_metrics a partir das colunas"""
+    return [
+        {
+            "client_id": client_id,
+            "campaign_id": campaign_id,
+            "campaign_name": campaign_name,
+            "data_referencia": day,
+            "investimento": spend,
+            "impressoes": impressions,
+            "cliques_link": clicks,
+            "alcance": reach,
+            "resultado_valor": value,
+            "resultado_nome": name,
+        }
+        for day, spend, impressions, clicks, reach, value, name in zip(
+            columns.dates, columns.spend, columns.impressions, columns.clicks, columns.reach,
+            columns.result_value, columns.result_name)
+    ]
@@ -2,7 +2,7 @@ import os
 import json
 from datetime import datetime
 from dotenv import load_dotenv
-import requests
+from http_pool import http_get
 
 load_dotenv()
 
@@ -16,7 +16,7 @@ def inspect_actions():
     url = f"https://graph.facebook.com/{API_VER}/{AD_ACCOUNT_ID}/campaigns"
     params = {'access_token': ACCESS_TOKEN, 'fields': 'id,name', 'limit': 100}
     
-    resp = requests.get(url, params=params).json()
+    resp = http_get(url, params=params).json()
     campaigns = resp.get('data', [])
     
     print(f"Encontradas {len(campaigns)} campanhas. Verificando ações dos últimos 30 dias...")
@@ -36,7 +36,7 @@ def inspect_actions():
             'date_preset': 'last_30d'
         }
         
-        i_resp = requests.get(url_insights, params=i_params).json()
+        i_resp = http_get(url_insights, params=i_params).json()
         data = i_resp.get('data', [])
         
         if not data: continue
@@ -2,7 +2,7 @@
 import os
 import sys
 import json
-import requests
+from http_pool import http_get
 from dotenv import load_dotenv
 
 # Configurar encoding para Windows
@@ -33,7 +33,7 @@ def get_raw_campaign_data(campaign_name_part):
     }
     
     found_campaign = None
-    response = requests.get(url, params=params)
+    response = http_get(url, params=params)
     data = response.json().get('data', [])
     
     for c in data:
@@ -55,7 +55,7 @@ def get_raw_campaign_data(campaign_name_part):
         "date_preset": "last_30d"
     }
     
-    ins_resp = requests.get(insights_url, params=ins_params)
+    ins_resp = http_get(insights_url, params=ins_params)
     ins_data = ins_resp.json().get('data', [])
     
     if not ins_data:
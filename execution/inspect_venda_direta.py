@@ -1,7 +1,7 @@
 
 import os
 import sys
-import requests
+from http_pool import http_get
 from dotenv import load_dotenv
 
 # ... (setup code same as before) ...
@@ -27,7 +27,7 @@ def get_campaign_by_name(name_part):
         "fields": "id,name,objective",
         "limit": 500
     }
-    resp = requests.get(url, params=params)
+    resp = http_get(url, params=params)
     data = resp.json().get('data', [])
     for c in data:
         if name_part.lower() in c['name'].lower():
@@ -42,7 +42,7 @@ def inspect_actions(campaign_id):
         "fields": "actions,action_values",
         "date_preset": "last_30d"
     }
-    resp = requests.get(url, params=params)
+    resp = http_get(url, params=params)
     data = resp.json().get('data', [])
     for d in data:
         for a in d.get('actions', []):
@@ -0,0 +1,134 @@
+"""
+Gravação em lote, em segundo plano, dos registros da tabela logs.
+
+emit() só coloca o registro em uma fila em memória e retorna; uma thread
+junta os registros e faz um insert em lote quando acumula max_entries
+registros ou quando o mais antigo espera há max_age segundos. Assim um dia
+com muitos erros de campanha não dobra as requisições ao Supabase nem atrasa
+a sincronização.
+
+Se o insert falhar (Supabase fora do ar, por exemplo), os registros vão para
+um arquivo JSONL local (LOG_FALLBACK_FILE no .env, padrão
+execution/logs_fallback.jsonl). O que estiver na fila é gravado no fim do
+processo (close, também registrado em atexit).
+"""
+import atexit
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+LOG_FALLBACK_FILE = os.getenv('LOG_FALLBACK_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logs_fallback.jsonl'))
+
+_STOP = object()
+
+
+class _Flush:
+    def __init__(self):
+        self.done = threading.Event()
+
+
+class LogSink:
+    def __init__(self, insert_fn: Callable[[List[Dict]], None], max_entries: int = 100,
+                 max_age: float = 5.0, fallback_path: str = LOG_FALLBACK_FILE, max_pending: int = 10000):
+        self.insert_fn = insert_fn
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.fallback_path = fallback_path
+
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_pending)
+        self._lock = threading.Lock()
+        self._file_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+        # Estatísticas
+        self.sent = 0
+        self.inserts = 0
+        self.fallback = 0
+
+        atexit.register(self.close)
+
+    def emit(self, entry: Dict):
+        """Enfileira o registro sem esperar a gravação"""
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            # Fila cheia (Supabase muito lento): o registro vai direto para o arquivo
+            self._write_fallback([entry], "fila cheia")
+
+    def flush(self, timeout: float = 30.0):
+        """Grava o que está na fila e espera terminar"""
+        if self._thread is None:
+            return
+        marker = _Flush()
+        self._queue.put(marker)
+        marker.done.wait(timeout)
+
+    def close(self, timeout: float = 30.0):
+        """Grava o que está na fila e encerra a thread"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        self._queue.put(_STOP)
+        thread.join(timeout)
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="log-sink", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        batch: List[Dict] = []
+        deadline = 0.0
+        while True:
+            timeout = max(0.0, deadline - time.monotonic()) if batch else None
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if item is _STOP or isinstance(item, _Flush):
+                self._send(batch)
+                batch = []
+                if item is _STOP:
+                    return
+                item.done.set()
+                continue
+
+            if item is not None:
+                if not batch:
+                    deadline = time.monotonic() + self.max_age
+                batch.append(item)
+
+            if batch and (len(batch) >= self.max_entries or time.monotonic() >= deadline):
+                self._send(batch)
+                batch = []
+
+    def _send(self, batch: List[Dict]):
+        if not batch:
+            return
+        try:
+            self.insert_fn(batch)
+            self.sent += len(batch)
+            self.inserts += 1
+        except Exception as e:
+            print(f"Erro ao registrar {len(batch)} log(s): {str(e)} (gravados em {self.fallback_path})")
+            self._write_fallback(batch, str(e))
+
+    def _write_fallback(self, entries: List[Dict], reason: str):
+        ts = datetime.now().isoformat()
+        with self._file_lock:
+            self.fallback += len(entries)
+            try:
+                with open(self.fallback_path, "a", encoding="utf-8") as f:
+                    for entry in entries:
+                        f.write(json.dumps({"ts": ts, "motivo": reason, "log": entry},
+                                           ensure_ascii=False, default=str) + "\n")
+            except OSError as e:
+                print(f"AVISO: Falha ao gravar logs em {self.fallback_path}: {e}")
@@ -0,0 +1,169 @@
+"""
+Governador de taxa para a API do Meta.
+
+Token bucket global compartilhado por todas as requisições, ajustado pelos
+headers de uso que o Meta devolve em cada resposta:
+
+- X-App-Usage: uso do app inteiro (afeta o ritmo global)
+- X-Ad-Account-Usage: uso da conta de anúncios da requisição
+- X-Business-Use-Case-Usage: uso por business/caso de uso (ads_insights etc.)
+
+Com folga alta as requisições saem na velocidade máxima. Conforme o uso de
+uma conta se aproxima do limite, as requisições dessa conta são espaçadas;
+acima do limite de pausa, só a conta afetada fica parada até o tempo de
+recuperação informado pelo Meta, sem travar as demais.
+"""
+import asyncio
+import json
+import threading
+import time
+from typing import Dict, Optional
+
+
+def _max_pct(values) -> float:
+    pcts = [float(v) for v in values if isinstance(v, (int, float))]
+    return max(pcts) if pcts else 0.0
+
+
+def parse_usage_headers(headers) -> Dict:
+    """
+    Extrai dos headers de resposta o percentual de uso do app e da conta,
+    além do tempo estimado (segundos) até recuperar o acesso.
+
+    Retorna {"app_pct", "account_pct", "regain_seconds"}; percentuais ficam
+    None quando o header correspondente não veio na resposta.
+    """
+    usage = {"app_pct": None, "account_pct": None, "regain_seconds": 0.0}
+    if not headers:
+        return usage
+
+    def load(name):
+        raw = headers.get(name)
+        if not raw:
+            return None
+        try:
+            return json.loads(raw)
+        except ValueError:
+            return None
+
+    app = load('X-App-Usage')
+    if isinstance(app, dict):
+        usage["app_pct"] = _max_pct([app.get('call_count'), app.get('total_time'), app.get('total_cputime')])
+
+    account = load('X-Ad-Account-Usage')
+    if isinstance(account, dict):
+        usage["account_pct"] = _max_pct([account.get('acc_id_util_pct')])
+        usage["regain_seconds"] = float(account.get('reset_time_duration') or 0)
+
+    business = load('X-Business-Use-Case-Usage')
+    if isinstance(business, dict):
+        for entries in business.values():
+            for entry in entries if isinstance(entries, list) else []:
+                pct = _max_pct([entry.get('call_count'), entry.get('total_time'), entry.get('total_cputime')])
+                usage["account_pct"] = max(usage["account_pct"] or 0.0, pct)
+                # estimated_time_to_regain_access vem em minutos
+                regain = float(entry.get('estimated_time_to_regain_access') or 0) * 60
+                usage["regain_seconds"] = max(usage["regain_seconds"], regain)
+
+    return usage
+
+
+class RateGovernor:
+    """
+    Token bucket global + espaçamento/pausa por conta de anúncios.
+
+    reserve() reserva a vez de uma requisição e devolve quantos segundos o
+    chamador deve esperar antes de enviá-la; wait()/wait_async() fazem a espera.
+    observe() deve ser chamado com os headers de cada resposta.
+    """
+
+    def __init__(self, max_rps: float = 20.0, burst: int = 20, slow_pct: float = 75.0,
+                 pause_pct: float = 95.0, max_spacing: float = 5.0, default_pause: float = 60.0):
+        self.max_rps = max_rps
+        self.burst = burst
+        self.slow_pct = slow_pct
+        self.pause_pct = pause_pct
+        self.max_spacing = max_spacing
+        self.default_pause = default_pause
+
+        self._lock = threading.Lock()
+        self._tokens = float(burst)
+        self._rate = max_rps
+        self._updated = time.monotonic()
+        # Por conta: percentual de uso, próximo horário liberado e pausa
+        self._account_pct: Dict[str, float] = {}
+        self._next_slot: Dict[str, float] = {}
+        self._paused_until: Dict[str, float] = {}
+        self.total_wait = 0.0
+
+    def set_max_rps(self, max_rps: float):
+        with self._lock:
+            self.max_rps = max_rps
+            self._rate = max_rps
+
+    def _scale(self, pct: float) -> float:
+        """0.0 com folga, 1.0 no limite de pausa"""
+        if pct <= self.slow_pct:
+            return 0.0
+        return min(1.0, (pct - self.slow_pct) / (self.pause_pct - self.slow_pct))
+
+    def reserve(self, account_id: Optional[str] = None) -> float:
+        with self._lock:
+            now = time.monotonic()
+
+            # Reabastece o bucket global
+            self._tokens = min(float(self.burst), self._tokens + (now - self._updated) * self._rate)
+            self._updated = now
+            self._tokens -= 1
+            start = now if self._tokens >= 0 else now - self._tokens / self._rate
+
+            if account_id:
+                start = max(start, self._paused_until.get(account_id, 0.0), self._next_slot.get(account_id, 0.0))
+                spacing = self.max_spacing * self._scale(self._account_pct.get(account_id, 0.0))
+                self._next_slot[account_id] = start + spacing
+
+            wait = max(0.0, start - now)
+            self.total_wait += wait
+            return wait
+
+    def wait(self, account_id: Optional[str] = None):
+        delay = self.reserve(account_id)
+        if delay > 0:
+            time.sleep(delay)
+
+    async def wait_async(self, account_id: Optional[str] = None):
+        delay = self.reserve(account_id)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def pause(self, account_id: Optional[str], seconds: float):
+        """Pausa só a conta informada (ou o app inteiro, se account_id for None)"""
+        with self._lock:
+            until = time.monotonic() + seconds
+            if account_id:
+                self._paused_until[account_id] = max(self._paused_until.get(account_id, 0.0), until)
+            else:
+                self._tokens = min(self._tokens, -seconds * self._rate)
+
+    def observe(self, headers, account_id: Optional[str] = None) -> Dict:
+        usage = parse_usage_headers(headers)
+
+        app_pct = usage["app_pct"]
+        account_pct = usage["account_pct"]
+
+        with self._lock:
+            # Uso do app reduz o ritmo global proporcionalmente
+            if app_pct is not None:
+                self._rate = max(self.max_rps * (1.0 - self._scale(app_pct)), 0.2)
+            if account_id and account_pct is not None:
+                self._account_pct[account_id] = account_pct
+
+        if app_pct is not None and app_pct >= self.pause_pct:
+            print(f"Uso do app em {app_pct:.0f}%. Pausando todas as requisicoes por {self.default_pause:.0f} segundos...")
+            self.pause(None, self.default_pause)
+        elif account_id and account_pct is not None and account_pct >= self.pause_pct:
+            seconds = usage["regain_seconds"] or self.default_pause
+            print(f"Uso da conta {account_id} em {account_pct:.0f}%. Pausando a conta por {seconds:.0f} segundos...")
+            self.pause(account_id, seconds)
+
+        return usage
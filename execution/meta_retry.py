@@ -0,0 +1,146 @@
+"""
+Classificação de erros do Graph API e política de retry.
+
+Cada erro vira uma decisão:
+- retry: throttling (códigos 4, 17, 32, 613, 800xx...), erros transitórios
+  (is_transient, códigos 1/2, HTTP 5xx) e falhas de rede
+- skip: erro da requisição em si (parâmetro inválido, sem permissão na
+  conta, objeto inexistente); perde-se só aquela campanha/conta
+- abort: token inválido ou expirado; não adianta continuar a execução
+
+Os retries usam backoff com "decorrelated jitter" e consomem um orçamento
+global da execução (quantidade de retries e segundos de espera), para que
+uma hora ruim do Meta degrade a execução em vez de travá-la por horas.
+"""
+import random
+import threading
+from typing import Dict, Optional
+
+RETRY = "retry"
+SKIP = "skip"
+ABORT = "abort"
+
+# Limites de chamadas (app, usuário, conta, caso de uso de negócio)
+THROTTLE_CODES = {4, 17, 32, 613} | set(range(80000, 80015))
+THROTTLE_SUBCODES = {1487742, 2446079}
+
+# Erros temporários do lado do Meta
+TRANSIENT_CODES = {1, 2}
+
+# Token inválido/expirado ou sessão encerrada
+AUTH_CODES = {102, 190}
+
+
+class MetaAPIError(Exception):
+    """Erro do Graph API já classificado (decision: retry/skip/abort)"""
+
+    def __init__(self, message: str, decision: str, status: Optional[int] = None,
+                 code: Optional[int] = None, subcode: Optional[int] = None, retry_after: float = 0.0):
+        super().__init__(message)
+        self.decision = decision
+        self.status = status
+        self.code = code
+        self.subcode = subcode
+        self.retry_after = retry_after
+
+    @property
+    def throttled(self) -> bool:
+        return self.status == 429 or self.code in THROTTLE_CODES or self.subcode in THROTTLE_SUBCODES
+
+
+class MetaAbortError(MetaAPIError):
+    """Erro que deve interromper toda a execução (ex: token inválido)"""
+
+
+def classify_error(status: Optional[int], error: Dict) -> str:
+    """
+    Decide o que fazer com um erro a partir do status HTTP e do objeto error do Graph API
+    """
+    code = error.get('code')
+    subcode = error.get('error_subcode')
+
+    if status == 401 or code in AUTH_CODES:
+        return ABORT
+    if status == 429 or code in THROTTLE_CODES or subcode in THROTTLE_SUBCODES:
+        return RETRY
+    if error.get('is_transient') or code in TRANSIENT_CODES:
+        return RETRY
+    if status is not None and status >= 500:
+        return RETRY
+    return SKIP
+
+
+def error_from_response(status: int, payload: Dict, headers=None) -> MetaAPIError:
+    """
+    Monta o MetaAPIError de uma resposta HTTP diferente de 200
+    """
+    error = payload.get('error', {}) if isinstance(payload, dict) else {}
+    decision = classify_error(status, error)
+    message = error.get('message', 'Erro desconhecido')
+
+    if decision == ABORT:
+        message = f"Token inválido: {message}"
+    else:
+        message = f"Erro HTTP {status}: {message}"
+
+    retry_after = 0.0
+    if headers is not None and headers.get('Retry-After'):
+        try:
+            retry_after = float(headers.get('Retry-After'))
+        except ValueError:
+            pass
+
+    error_class = MetaAbortError if decision == ABORT else MetaAPIError
+    return error_class(message, decision, status, error.get('code'), error.get('error_subcode'), retry_after)
+
+
+class RetryPolicy:
+    """
+    Backoff com decorrelated jitter + orçamento global de retries da execução.
+
+    next_delay() devolve quantos segundos esperar antes da próxima tentativa,
+    ou None quando o erro não deve (ou não pode mais) ser repetido.
+    """
+
+    def __init__(self, max_attempts: int = 5, base: float = 1.0, cap: float = 60.0,
+                 throttle_base: float = 30.0, throttle_cap: float = 300.0,
+                 budget_retries: int = 200, budget_seconds: float = 1800.0):
+        self.max_attempts = max_attempts
+        self.base = base
+        self.cap = cap
+        self.throttle_base = throttle_base
+        self.throttle_cap = throttle_cap
+        self.budget_retries = budget_retries
+        self.budget_seconds = budget_seconds
+
+        self._lock = threading.Lock()
+        self.retries = 0
+        self.waited = 0.0
+        self.exhausted = False
+
+    def reset_budget(self):
+        """Começa um orçamento novo (modo daemon: um orçamento por job)"""
+        with self._lock:
+            self.retries = 0
+            self.waited = 0.0
+            self.exhausted = False
+
+    def next_delay(self, error: MetaAPIError, attempt: int, previous: Optional[float]) -> Optional[float]:
+        if error.decision != RETRY or attempt >= self.max_attempts:
+            return None
+
+        base, cap = (self.throttle_base, self.throttle_cap) if error.throttled else (self.base, self.cap)
+        delay = min(cap, random.uniform(base, max(base, (previous or base) * 3)))
+        delay = max(delay, error.retry_after)
+
+        with self._lock:
+            if self.retries + 1 > self.budget_retries or self.waited + delay > self.budget_seconds:
+                if not self.exhausted:
+                    print(f"AVISO: Orcamento de retries esgotado ({self.retries} retries, {self.waited:.0f}s de espera). "
+                          f"Erros seguintes nao serao repetidos.")
+                self.exhausted = True
+                return None
+            self.retries += 1
+            self.waited += delay
+
+        return delay
@@ -0,0 +1,114 @@
+"""
+Validação das linhas de dashboard_campaign_metrics antes da gravação e
+arquivo de dead-letter para as linhas que o banco recusar.
+
+validate_metric_row() confere e converte cada coluna para o tipo da tabela
+(texto sem caractere nulo, data YYYY-MM-DD, números finitos dentro do limite
+do tipo). Linhas que não têm conserto não são enviadas: vão direto para o
+dead-letter, junto com as linhas isoladas pela divisão de lotes que falharam.
+
+O dead-letter é um arquivo JSONL (uma linha por registro recusado, com o erro)
+em execution/dead_letter_metrics.jsonl, configurável por DEAD_LETTER_FILE no .env.
+"""
+import json
+import math
+import os
+import threading
+from datetime import date, datetime
+from typing import Dict, Optional
+
+DEAD_LETTER_FILE = os.getenv('DEAD_LETTER_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dead_letter_metrics.jsonl'))
+
+INT4_MAX = 2 ** 31 - 1
+
+# coluna: (tipo, obrigatória)
+METRICS_SCHEMA = {
+    "client_id": ("text", True),
+    "campaign_id": ("text", True),
+    "campaign_name": ("text", False),
+    "data_referencia": ("date", True),
+    "investimento": ("numeric", False),
+    "impressoes": ("integer", False),
+    "cliques_link": ("integer", False),
+    "alcance": ("integer", False),
+    "resultado_valor": ("numeric", False),
+    "resultado_nome": ("text", False),
+}
+
+
+class InvalidRowError(ValueError):
+    """Linha que não pode ser convertida para o schema da tabela"""
+
+
+def _coerce(column: str, kind: str, value):
+    if kind == "text":
+        # O Postgres não aceita \x00 em colunas text
+        return str(value).replace("\x00", "")
+
+    if kind == "date":
+        if isinstance(value, (date, datetime)):
+            return value.strftime("%Y-%m-%d")
+        try:
+            return datetime.strptime(str(value)[:10], "%Y-%m-%d").strftime("%Y-%m-%d")
+        except ValueError:
+            raise InvalidRowError(f"{column}: data invalida ({value!r})")
+
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise InvalidRowError(f"{column}: valor nao numerico ({value!r})")
+    if not math.isfinite(number):
+        raise InvalidRowError(f"{column}: valor nao finito ({value!r})")
+
+    if kind == "integer":
+        number = int(round(number))
+        if abs(number) > INT4_MAX:
+            raise InvalidRowError(f"{column}: fora do limite de integer ({number})")
+        return number
+    return round(number, 2) if column == "investimento" else number
+
+
+def validate_metric_row(row: Dict) -> Dict:
+    """
+    Devolve uma cópia da linha com os tipos corrigidos; levanta InvalidRowError
+    se alguma coluna obrigatória faltar ou não puder ser convertida.
+    Colunas fora do schema são mantidas (ex: id no caminho sem chave única).
+    """
+    clean = dict(row)
+    for column, (kind, required) in METRICS_SCHEMA.items():
+        value = row.get(column)
+        if value is None or value == "":
+            if required:
+                raise InvalidRowError(f"{column}: obrigatorio")
+            if kind in ("numeric", "integer"):
+                clean[column] = 0 if kind == "integer" else 0.0
+            elif column in clean:
+                clean[column] = None
+            continue
+        clean[column] = _coerce(column, kind, value)
+    return clean
+
+
+class DeadLetter:
+    """Arquivo JSONL (append) com as linhas recusadas e o motivo"""
+
+    def __init__(self, path: str = DEAD_LETTER_FILE):
+        self.path = path
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def write(self, row: Dict, error, stage: str, code: Optional[str] = None):
+        record = {
+            "ts": datetime.now().isoformat(),
+            "stage": stage,
+            "error": str(error),
+            "code": code if code is not None else getattr(error, "code", None),
+            "row": row,
+        }
+        with self._lock:
+            self.count += 1
+            try:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+            except OSError as e:
+                print(f"      AVISO: Falha ao gravar dead-letter em {self.path}: {e}")
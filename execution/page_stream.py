@@ -0,0 +1,68 @@
+"""
+Busca de páginas em segundo plano com fila limitada.
+
+prefetch() consome um iterador de páginas (ex: as páginas de /insights) em uma
+thread produtora e entrega as páginas na ordem, à medida que chegam. A fila
+tem tamanho máximo: quando o consumidor (transformação + gravação) está mais
+lento, a produtora espera, então no máximo max_pages páginas ficam em memória
+ao mesmo tempo, independente do tamanho da conta.
+
+A produtora roda no contexto (contextvars) de quem chamou prefetch(), então
+valores como o cliente atual das métricas continuam valendo nela.
+"""
+import contextvars
+import queue
+import threading
+from typing import Iterable, Iterator, TypeVar
+
+T = TypeVar("T")
+
+_DONE = object()
+
+
+class _Failure:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+def prefetch(pages: Iterable[T], max_pages: int = 4) -> Iterator[T]:
+    """
+    Itera pages em uma thread produtora, com até max_pages páginas na fila.
+    Erros da produtora são relançados no consumidor, na posição em que ocorreram.
+    """
+    buffer: "queue.Queue" = queue.Queue(maxsize=max_pages)
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        # Espera vaga na fila, mas desiste se o consumidor abandonou a iteração
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for page in pages:
+                if not put(page):
+                    return
+            put(_DONE)
+        except BaseException as e:
+            put(_Failure(e))
+
+    producer = threading.Thread(target=contextvars.copy_context().run, args=(produce,),
+                                name="page-prefetch", daemon=True)
+    producer.start()
+
+    try:
+        while True:
+            item = buffer.get()
+            if item is _DONE:
+                return
+            if isinstance(item, _Failure):
+                raise item.error
+            yield item
+    finally:
+        stop.set()
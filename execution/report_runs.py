@@ -0,0 +1,135 @@
+"""
+Acompanhamento dos relatórios assíncronos de insights do Meta (report runs).
+
+Para listagens grandes, em vez de paginar /insights de forma síncrona (sujeito
+ao timeout da requisição), o relatório é criado com POST /insights, que
+devolve um report_run_id; o Meta processa o relatório em segundo plano e as
+linhas são lidas depois em /{report_run_id}/insights.
+
+ReportRunPoller consulta o status de todos os relatórios pendentes em uma
+única thread: a cada intervalo, os ids são agrupados por conta e consultados
+com uma chamada por grupo (status_fn), então várias threads esperando
+relatórios diferentes não multiplicam as chamadas de status.
+"""
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from meta_retry import MetaAPIError
+
+# async_status do report run
+JOB_COMPLETED = "Job Completed"
+JOB_FAILED = "Job Failed"
+JOB_SKIPPED = "Job Skipped"
+
+# Máximo de ids por consulta (?ids=)
+STATUS_CHUNK = 50
+
+
+class ReportRunError(Exception):
+    """Relatório que falhou, foi descartado pelo Meta ou passou do tempo limite"""
+
+
+class _Job:
+    __slots__ = ("account_id", "done", "status", "error", "started")
+
+    def __init__(self, account_id: Optional[str]):
+        self.account_id = account_id
+        self.done = threading.Event()
+        self.status: Dict = {}
+        self.error: Optional[BaseException] = None
+        self.started = time.monotonic()
+
+
+class ReportRunPoller:
+    def __init__(self, status_fn: Callable[[List[str], Optional[str]], Dict[str, Dict]],
+                 interval: float = 5.0, timeout: float = 1800.0):
+        """
+        status_fn(ids, account_id) -> {report_run_id: {async_status, async_percent_completion}}
+        """
+        self.status_fn = status_fn
+        self.interval = interval
+        self.timeout = timeout
+
+        self._lock = threading.Lock()
+        self._jobs: Dict[str, _Job] = {}
+        self._thread: Optional[threading.Thread] = None
+
+        # Estatísticas
+        self.jobs = 0
+        self.failed = 0
+        self.status_calls = 0
+        self.waited = 0.0
+
+    def wait(self, report_run_id: str, account_id: Optional[str] = None) -> Dict:
+        """Bloqueia até o relatório terminar; retorna o último status ou levanta ReportRunError"""
+        job = _Job(account_id)
+        with self._lock:
+            self._jobs[report_run_id] = job
+            self.jobs += 1
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="report-run-poller", daemon=True)
+                self._thread.start()
+
+        job.done.wait()
+        with self._lock:
+            self.waited += time.monotonic() - job.started
+            if job.error is not None:
+                self.failed += 1
+        if job.error is not None:
+            raise job.error
+        return job.status
+
+    def _finish(self, report_run_id: str, status: Optional[Dict] = None, error: Optional[BaseException] = None):
+        with self._lock:
+            job = self._jobs.pop(report_run_id, None)
+        if job:
+            job.status = status or {}
+            job.error = error
+            job.done.set()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._jobs:
+                    self._thread = None
+                    return
+                by_account: Dict[Optional[str], List[str]] = {}
+                for report_run_id, job in self._jobs.items():
+                    by_account.setdefault(job.account_id, []).append(report_run_id)
+
+            for account_id, ids in by_account.items():
+                for i in range(0, len(ids), STATUS_CHUNK):
+                    self._poll(ids[i:i + STATUS_CHUNK], account_id)
+
+    def _poll(self, ids: List[str], account_id: Optional[str]):
+        with self._lock:
+            self.status_calls += 1
+        try:
+            statuses = self.status_fn(ids, account_id)
+        except Exception as e:
+            # Erro do Graph API (já repetido por status_fn) encerra a espera; outros ficam para o próximo ciclo
+            if isinstance(e, MetaAPIError):
+                for report_run_id in ids:
+                    self._finish(report_run_id, error=e)
+            else:
+                print(f"      AVISO: Falha ao consultar {len(ids)} relatorio(s) assincrono(s): {str(e)}")
+            return
+
+        now = time.monotonic()
+        for report_run_id in ids:
+            status = statuses.get(report_run_id) or {}
+            async_status = status.get("async_status")
+            if async_status == JOB_COMPLETED and status.get("async_percent_completion", 100) >= 100:
+                self._finish(report_run_id, status)
+            elif async_status in (JOB_FAILED, JOB_SKIPPED):
+                self._finish(report_run_id, status,
+                             ReportRunError(f"Relatorio {report_run_id}: {async_status}"))
+            else:
+                with self._lock:
+                    job = self._jobs.get(report_run_id)
+                if job and now - job.started > self.timeout:
+                    self._finish(report_run_id, status,
+                                 ReportRunError(f"Relatorio {report_run_id} nao terminou em {self.timeout:.0f}s "
+                                                f"({status.get('async_percent_completion', 0)}%)"))
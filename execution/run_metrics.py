@@ -0,0 +1,259 @@
+"""
+Métricas da execução: contadores e histogramas por fase e por cliente.
+
+Cada requisição ao Meta (quantidade, bytes, latência, retries, espera do
+governador de taxa), cada fase da sincronização (listagem de campanhas,
+insights, transformação, upsert) e as linhas gravadas são registradas aqui.
+No fim da execução, write() grava:
+
+- um arquivo texto no formato do Prometheus (para o textfile collector do
+  node_exporter), em METRICS_PROM_FILE (padrão execution/sync_metrics.prom)
+- um resumo JSON, em METRICS_JSON_FILE (padrão execution/sync_metrics.json),
+  com os tempos somados por fase e por cliente
+
+O cliente atual fica em um ContextVar (client_scope), então vale para a
+thread ou task asyncio que está processando o cliente, sem precisar passar
+o nome por todas as funções.
+"""
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import AsyncIterable, AsyncIterator, Dict, Iterable, Iterator, List, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+_DIR = os.path.dirname(os.path.abspath(__file__))
+METRICS_PROM_FILE = os.getenv('METRICS_PROM_FILE', os.path.join(_DIR, 'sync_metrics.prom'))
+METRICS_JSON_FILE = os.getenv('METRICS_JSON_FILE', os.path.join(_DIR, 'sync_metrics.json'))
+
+# Limites (em segundos) dos buckets dos histogramas
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+NO_CLIENT = "-"
+
+_client: contextvars.ContextVar = contextvars.ContextVar("metrics_client", default=NO_CLIENT)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    items = list(labels) + ([extra] if extra else [])
+    if not items:
+        return ""
+    escaped = (f'{key}="{_escape(value)}"' for key, value in items)
+    return "{" + ",".join(escaped) + "}"
+
+
+class _Histogram:
+    __slots__ = ("buckets", "count", "sum", "max")
+
+    def __init__(self):
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                self.buckets[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        """Aproximação pelo limite superior do bucket (o máximo, para o último)"""
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.buckets):
+            seen += count
+            if seen >= target and count:
+                return min(bound, self.max)
+        return self.max
+
+
+class RunMetrics:
+    def __init__(self, prefix: str = "sync_meta"):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple[str, Labels], float] = {}
+        self._gauges: Dict[Tuple[str, Labels], float] = {}
+        self._histograms: Dict[Tuple[str, Labels], _Histogram] = {}
+        self._client_names: Dict[str, str] = {}
+
+    # ---------------------------------------------------------------- cliente
+
+    @contextmanager
+    def client_scope(self, client_id: str, client_name: str) -> Iterator[None]:
+        """Atribui ao cliente as métricas registradas dentro do bloco"""
+        with self._lock:
+            self._client_names[client_id] = client_name
+        token = _client.set(client_name)
+        try:
+            yield
+        finally:
+            _client.reset(token)
+
+    def client_name(self, client_id: str) -> str:
+        with self._lock:
+            return self._client_names.get(client_id, client_id)
+
+    # ---------------------------------------------------------------- registro
+
+    def inc(self, name: str, value: float = 1.0, **labels):
+        """Soma value ao contador (com o cliente atual, se client não for informado)"""
+        labels.setdefault("client", _client.get())
+        key = (name, _labels(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0.0) + value
+
+    def set(self, name: str, value: float, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            self._gauges[key] = value
+
+    def observe(self, name: str, value: float, **labels):
+        labels.setdefault("client", _client.get())
+        key = (name, _labels(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = _Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, phase: str, **labels) -> Iterator[None]:
+        """Registra a duração do bloco no histograma phase_seconds"""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe("phase_seconds", time.monotonic() - started, phase=phase, **labels)
+
+    def timed_pages(self, phase: str, pages: Iterable[T], **labels) -> Iterator[T]:
+        """
+        Itera pages registrando em phase_seconds só o tempo de buscar cada página
+        (o tempo de quem consome as páginas entre uma e outra fica de fora)
+        """
+        labels.setdefault("client", _client.get())
+        elapsed = 0.0
+        iterator = iter(pages)
+        try:
+            while True:
+                started = time.monotonic()
+                try:
+                    page = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    elapsed += time.monotonic() - started
+                yield page
+        finally:
+            self.observe("phase_seconds", elapsed, phase=phase, **labels)
+
+    async def timed_pages_async(self, phase: str, pages: AsyncIterable[T], **labels) -> AsyncIterator[T]:
+        """Versão async de timed_pages"""
+        labels.setdefault("client", _client.get())
+        elapsed = 0.0
+        iterator = pages.__aiter__()
+        try:
+            while True:
+                started = time.monotonic()
+                try:
+                    page = await iterator.__anext__()
+                except StopAsyncIteration:
+                    return
+                finally:
+                    elapsed += time.monotonic() - started
+                yield page
+        finally:
+            self.observe("phase_seconds", elapsed, phase=phase, **labels)
+
+    # ---------------------------------------------------------------- exportação
+
+    def to_prometheus(self) -> str:
+        lines: List[str] = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            gauges = sorted(self._gauges.items())
+            histograms = sorted(self._histograms.items(), key=lambda item: item[0])
+
+        declared = set()
+
+        def declare(name: str, kind: str):
+            if name not in declared:
+                declared.add(name)
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in counters:
+            full = f"{self.prefix}_{name}"
+            declare(full, "counter")
+            lines.append(f"{full}{_format_labels(labels)} {value:g}")
+        for (name, labels), value in gauges:
+            full = f"{self.prefix}_{name}"
+            declare(full, "gauge")
+            lines.append(f"{full}{_format_labels(labels)} {value:g}")
+        for (name, labels), histogram in histograms:
+            full = f"{self.prefix}_{name}"
+            declare(full, "histogram")
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, histogram.buckets):
+                cumulative += count
+                lines.append(f"{full}_bucket{_format_labels(labels, ('le', f'{bound:g}'))} {cumulative}")
+            lines.append(f"{full}_bucket{_format_labels(labels, ('le', '+Inf'))} {histogram.count}")
+            lines.append(f"{full}_sum{_format_labels(labels)} {histogram.sum:.6f}")
+            lines.append(f"{full}_count{_format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> Dict:
+        """Resumo JSON: tudo o que foi registrado, mais os segundos somados por fase e por cliente"""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            gauges = sorted(self._gauges.items())
+            histograms = sorted(self._histograms.items(), key=lambda item: item[0])
+
+        by_phase: Dict[str, float] = {}
+        by_client: Dict[str, Dict[str, float]] = {}
+        for (name, labels), histogram in histograms:
+            if name != "phase_seconds":
+                continue
+            label_map = dict(labels)
+            phase, client = label_map.get("phase", "?"), label_map.get("client", NO_CLIENT)
+            by_phase[phase] = by_phase.get(phase, 0.0) + histogram.sum
+            phases = by_client.setdefault(client, {})
+            phases[phase] = phases.get(phase, 0.0) + histogram.sum
+
+        return {
+            "gauges": [{"name": name, "labels": dict(labels), "value": value} for (name, labels), value in gauges],
+            "counters": [{"name": name, "labels": dict(labels), "value": value} for (name, labels), value in counters],
+            "histograms": [
+                {"name": name, "labels": dict(labels), "count": h.count, "sum": round(h.sum, 6),
+                 "avg": round(h.sum / h.count, 6) if h.count else 0.0,
+                 "p50": h.quantile(0.50), "p95": h.quantile(0.95), "max": round(h.max, 6)}
+                for (name, labels), h in histograms
+            ],
+            "seconds_by_phase": {phase: round(total, 3) for phase, total in sorted(by_phase.items())},
+            "seconds_by_client": {client: {phase: round(total, 3) for phase, total in sorted(phases.items())}
+                                  for client, phases in sorted(by_client.items())},
+        }
+
+    def write(self, prom_path: str = METRICS_PROM_FILE, json_path: str = METRICS_JSON_FILE):
+        """Grava os dois arquivos (com rename, para o coletor nunca ler um arquivo pela metade)"""
+        for path, content in ((prom_path, self.to_prometheus()),
+                              (json_path, json.dumps(self.summary(), ensure_ascii=False, indent=2))):
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(content)
+            os.replace(tmp_path, path)
@@ -0,0 +1,137 @@
+"""
+Coalescência de buscas (single-flight) para contas de anúncios compartilhadas.
+
+Quando dois clientes apontam para a mesma conta (mesmo act_), as listagens e
+os insights de cada janela seriam buscados uma vez por cliente. Com
+SingleFlight, as buscas de um grupo (a conta) com a mesma chave (tipo de
+busca e janela) viram uma só:
+
+- chamadas simultâneas esperam a busca em andamento e recebem o mesmo
+  resultado (ou a mesma exceção)
+- o resultado fica guardado até ser entregue a `consumers` chamadas (os
+  clientes da conta) e então é descartado; forget(grupo) descarta o que
+  sobrou (ex: um cliente com janela diferente não pediu a mesma chave)
+- falhas não são guardadas: a próxima chamada tenta de novo
+
+O mesmo resultado é entregue a todos, então quem recebe não deve alterá-lo.
+do() serve para threads e do_async() para o motor asyncio (um event loop).
+"""
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Tuple[Hashable, Hashable], _Call] = {}
+        self._async_calls: Dict[Tuple[Hashable, Hashable], asyncio.Future] = {}
+        # {grupo: {chave: [resultado, entregas restantes]}}
+        self._results: Dict[Hashable, Dict[Hashable, List]] = {}
+
+        # Estatísticas
+        self.fetches = 0
+        self.shared = 0
+
+    def do(self, group: Hashable, key: Hashable, fn: Callable[[], Any], consumers: int = 1) -> Any:
+        """Resultado de fn() para (group, key), buscado uma vez para até consumers chamadas"""
+        with self._lock:
+            found, value = self._take(group, key)
+            if found:
+                return value
+            call = self._calls.get((group, key))
+            leader = call is None
+            if leader:
+                call = self._calls[(group, key)] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return self._joined(group, key, call.result)
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[(group, key)]
+                self.fetches += 1
+                if call.error is None:
+                    self._store(group, key, call.result, consumers)
+            call.done.set()
+        return call.result
+
+    async def do_async(self, group: Hashable, key: Hashable, fn: Callable[[], Awaitable], consumers: int = 1) -> Any:
+        """Versão asyncio de do(): fn devolve a corrotina da busca"""
+        with self._lock:
+            found, value = self._take(group, key)
+            if found:
+                return value
+
+        future = self._async_calls.get((group, key))
+        if future is not None:
+            result = await asyncio.shield(future)
+            return self._joined(group, key, result)
+
+        future = self._async_calls[(group, key)] = asyncio.get_running_loop().create_future()
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Ninguém esperando: evita o aviso "exception was never retrieved"
+            future.exception()
+            raise
+        finally:
+            del self._async_calls[(group, key)]
+
+        with self._lock:
+            self.fetches += 1
+            self._store(group, key, result, consumers)
+        future.set_result(result)
+        return result
+
+    def forget(self, group: Hashable):
+        """Descarta os resultados guardados do grupo"""
+        with self._lock:
+            self._results.pop(group, None)
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+
+    def _take(self, group: Hashable, key: Hashable) -> tuple:
+        """(encontrado, resultado) de uma busca já feita; chamado com o lock"""
+        held = self._results.get(group, {}).get(key)
+        if held is None:
+            return False, None
+        held[1] -= 1
+        if held[1] <= 0:
+            del self._results[group][key]
+        self.shared += 1
+        return True, held[0]
+
+    def _joined(self, group: Hashable, key: Hashable, result: Any) -> Any:
+        """Chamada que esperou a busca em andamento: conta como uma entrega"""
+        with self._lock:
+            found, value = self._take(group, key)
+            if not found:
+                self.shared += 1
+        return value if found else result
+
+    def _store(self, group: Hashable, key: Hashable, result: Any, consumers: int):
+        # O líder já recebeu o resultado; guarda para as demais entregas
+        if consumers > 1:
+            self._results.setdefault(group, {})[key] = [result, consumers - 1]
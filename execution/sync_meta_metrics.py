@@ -6,11 +6,35 @@ import os
 import sys
 import time
 import json
-from datetime import datetime, timedelta
-from typing import List, Dict, Optional
+import hashlib
+import asyncio
+import signal
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
+from urllib.parse import urlencode, urlsplit
+from datetime import date, datetime, timedelta
+from typing import AsyncIterator, Awaitable, Callable, Iterable, Iterator, List, Dict, Optional
 from dotenv import load_dotenv
 import requests
+import httpx
 from supabase import create_client, Client
+from http_pool import http_get, http_post, make_async_httpx_client, print_connection_stats, supabase_client_options
+from meta_rate_governor import RateGovernor
+from meta_retry import RETRY, SKIP, MetaAPIError, MetaAbortError, RetryPolicy, error_from_response
+from sync_state import REFRESH_TIERS, RunCheckpoint, SyncState, plan_refresh, split_windows
+from write_buffer import WriteBuffer
+from metrics_validation import DeadLetter, InvalidRowError, validate_metric_row
+from page_stream import prefetch
+from report_runs import ReportRunError, ReportRunPoller
+from log_sink import LogSink
+from client_leases import ClientLeases, parse_shard, shard_of
+from sync_scheduler import SCHEDULER_MAX_INTERVAL, SCHEDULER_MIN_INTERVAL, SyncScheduler
+from time_budget import TimeBudget, parse_duration
+from single_flight import SingleFlight
+from run_metrics import METRICS_JSON_FILE, METRICS_PROM_FILE, NO_CLIENT, RunMetrics
+from insight_transform import metric_rows_from_columns, process_actions, transform_insights
 
 # Configurar encoding para Windows
 if sys.platform == 'win32':
@@ -34,439 +58,2584 @@ if not all([META_ACCESS_TOKEN, SUPABASE_URL, SUPABASE_KEY]):
     raise ValueError("Variáveis de ambiente faltando. Verifique META_ACCESS_TOKEN, SUPABASE_URL e SUPABASE_KEY no .env")
 
 # Inicializa cliente Supabase
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY, options=supabase_client_options())
 
 # Configurações da API Meta
 META_API_VERSION = "v21.0"
 META_BASE_URL = f"https://graph.facebook.com/{META_API_VERSION}"
 
-# Delay entre requisições para evitar rate limits (em segundos)
-REQUEST_DELAY = 0.1
+# Ritmo máximo de requisições ao Meta (req/s) quando há folga nos limites de uso.
+# O governador reduz o ritmo por conta conforme os headers X-*-Usage se aproximam
+# do limite e pausa apenas a conta afetada quando ele é atingido.
+GOVERNOR_MAX_RPS = 20.0
 
-# Máximo de tentativas para retry
-MAX_RETRIES = 3
+governor = RateGovernor(max_rps=GOVERNOR_MAX_RPS)
+
+# Máximo de tentativas por requisição
+MAX_RETRIES = 5
+
+# Orçamento de retries da execução inteira: quantidade e segundos de espera.
+# Esgotado o orçamento, erros repetíveis passam a falhar na hora (a campanha é
+# pulada) em vez de travar a execução.
+RETRY_BUDGET = 200
+RETRY_BUDGET_SECONDS = 1800
+
+retry_policy = RetryPolicy(max_attempts=MAX_RETRIES, budget_retries=RETRY_BUDGET,
+                           budget_seconds=RETRY_BUDGET_SECONDS)
+
+# Estado local (watermarks de sincronização por campanha/conta)
+sync_state = SyncState()
+
+# Contadores e histogramas da execução (gravados no fim em .prom e .json)
+metrics = RunMetrics()
+
+# Graph Batch API: máximo de requisições por chamada batch
+BATCH_MAX_REQUESTS = 50
+
+# Motor assíncrono: limite global de requisições simultâneas ao Meta
+# e limite por conta de anúncios (--concurrency / --account-concurrency)
+ASYNC_CONCURRENCY = 8
+ASYNC_ACCOUNT_CONCURRENCY = 2
+
+# Relatórios assíncronos do Meta (POST /insights + report_run_id): usados nas
+# listagens da conta quando a estimativa (campanhas x dias) passa de
+# REPORT_RUN_MIN_ROWS linhas (--report-run-min-rows). Os status de todos os
+# relatórios pendentes são consultados juntos a cada REPORT_RUN_POLL_SECONDS.
+REPORT_RUN_MIN_ROWS = 20000
+REPORT_RUN_POLL_SECONDS = 5.0
+REPORT_RUN_TIMEOUT = 1800.0
+
+
+def insert_logs(entries: List[Dict]):
+    """Insert em lote na tabela logs (chamado pela thread do log_sink)"""
+    supabase.table("logs").insert(entries).execute()
+
+
+# Registros da tabela logs: enfileirados e gravados em lote por uma thread,
+# a cada LOG_BATCH_SIZE registros ou LOG_FLUSH_SECONDS segundos
+LOG_BATCH_SIZE = 100
+LOG_FLUSH_SECONDS = 5.0
+
+log_sink = LogSink(insert_logs, max_entries=LOG_BATCH_SIZE, max_age=LOG_FLUSH_SECONDS)
 
 
 def log_error(client_id: Optional[str], tipo: str, status: str, mensagem: str, meta: Optional[Dict] = None):
-    """Registra erro ou sucesso na tabela logs do Supabase"""
+    """Registra erro ou sucesso na tabela logs do Supabase (sem esperar a gravação)"""
+    log_sink.emit({
+        "client_id": client_id,
+        "tipo": tipo,
+        "status": status,
+        "mensagem": mensagem,
+        "meta": meta or {}
+    })
+
+
+def response_payload(response) -> Dict:
+    """JSON da resposta (requests ou httpx), ou {} se o corpo não for JSON"""
+    try:
+        return response.json() if response.content else {}
+    except ValueError:
+        return {}
+
+
+def meta_endpoint(url: str, params: Optional[Dict] = None) -> str:
+    """Rótulo do endpoint nas métricas: último trecho do caminho (insights, campaigns...), batch ou ids"""
+    segment = urlsplit(url).path.rstrip('/').rsplit('/', 1)[-1]
+    if segment == META_API_VERSION:
+        return "ids" if params and "ids" in params else "batch"
+    return segment if not segment.isdigit() else "object"
+
+
+def record_meta_response(endpoint: str, status, size: int, seconds: float):
+    metrics.inc("requests_total", endpoint=endpoint, status=status)
+    metrics.inc("response_bytes_total", size, endpoint=endpoint)
+    metrics.observe("request_seconds", seconds, endpoint=endpoint)
+    if time_budget is not None:
+        time_budget.observe_request(seconds)
+
+
+def make_meta_request(url: str, params: Dict, method: str = "GET", account_id: Optional[str] = None) -> Optional[Dict]:
+    """
+    Faz requisição à API do Meta com retry e tratamento de rate limits.
+    account_id identifica a conta de anúncios para o governador de taxa.
+    
+    Erros são classificados por meta_retry: throttling e erros transitórios são
+    repetidos com backoff (dentro do orçamento da execução), erros da requisição
+    sobem como MetaAPIError e token inválido sobe como MetaAbortError.
+    """
+    attempt = 0
+    delay = None
+    endpoint = meta_endpoint(url, params)
+    
+    while True:
+        attempt += 1
+        try:
+            waited = time.monotonic()
+            governor.wait(account_id)
+            started = time.monotonic()
+            metrics.inc("rate_limit_wait_seconds_total", started - waited)
+            if method == "POST":
+                response = http_post(url, data=params)
+            else:
+                response = http_get(url, params=params)
+            governor.observe(response.headers, account_id)
+            record_meta_response(endpoint, response.status_code, len(response.content), time.monotonic() - started)
+            
+            if response.status_code == 200:
+                return response.json()
+            
+            error = error_from_response(response.status_code, response_payload(response), response.headers)
+            
+        except requests.exceptions.RequestException as e:
+            record_meta_response(endpoint, "error", 0, time.monotonic() - started)
+            error = MetaAPIError(f"Erro na requisição: {str(e)}", RETRY)
+        
+        delay = retry_policy.next_delay(error, attempt, delay)
+        if delay is not None:
+            metrics.inc("retries_total", endpoint=endpoint, reason="throttled" if error.throttled else "transient")
+        if delay is None:
+            if error.decision == RETRY:
+                raise MetaAPIError(f"{error} (após {attempt} tentativa(s))", SKIP, error.status, error.code, error.subcode)
+            raise error
+        
+        if error.throttled:
+            # Throttling: pausa só a conta afetada; a espera acontece no governor.wait
+            print(f"Rate limit atingido ({account_id or 'app'}). Aguardando {delay:.0f} segundos...")
+            governor.pause(account_id, delay)
+        else:
+            time.sleep(delay)
+
+
+# Status efetivos que ainda podem ter veiculação (ARCHIVED/DELETED ficam de fora da listagem)
+LISTED_EFFECTIVE_STATUSES = ["ACTIVE", "PAUSED", "IN_PROCESS", "WITH_ISSUES"]
+
+
+def campaigns_params(effective_status: Optional[List[str]] = None) -> Dict:
+    """Parâmetros da listagem /{act_id}/campaigns"""
+    params = {
+        "access_token": META_ACCESS_TOKEN,
+        "fields": "id,name,status,effective_status,created_time,updated_time,objective",
+        "limit": 100
+    }
+    if effective_status:
+        params["effective_status"] = json.dumps(effective_status)
+    return params
+
+
+def campaign_statuses_params() -> Dict:
+    """Listagem só dos status efetivos (/{act_id}/campaigns com id e effective_status)"""
+    return {
+        "access_token": META_ACCESS_TOKEN,
+        "fields": "id,effective_status",
+        "limit": 500
+    }
+
+
+def delivery_probe_params(since_date: str, until_date: str) -> Dict:
+    """
+    Parâmetros da sondagem de veiculação: uma linha por campanha com impressões
+    na janela (sem time_increment), só com id e nome
+    """
+    return {
+        "access_token": META_ACCESS_TOKEN,
+        "level": "campaign",
+        "fields": "campaign_id,campaign_name",
+        "time_range": json.dumps({"since": since_date, "until": until_date}),
+        "filtering": json.dumps([{"field": "impressions", "operator": "GREATER_THAN", "value": 0}]),
+        "limit": 500
+    }
+
+
+def iter_pages(url: str, params: Dict, account_id: Optional[str] = None) -> Iterator[List[Dict]]:
+    """
+    Percorre a paginação do Graph API entregando o campo data de cada página
+    assim que ela chega (o link next já traz o access_token)
+    """
+    next_url = url
+    
+    while next_url:
+        data = make_meta_request(next_url, params if next_url == url else {}, account_id=account_id)
+        
+        if not data:
+            break
+        
+        yield data.get('data', [])
+        
+        # Paginação
+        next_url = data.get('paging', {}).get('next')
+
+
+# Contas de anúncios usadas por mais de um cliente nesta execução -> quantidade de
+# clientes (definido em main). As buscas dessas contas passam pelo single-flight:
+# uma busca por (conta, tipo, janela), com o resultado entregue a cada cliente.
+shared_accounts: Dict[str, int] = {}
+single_flight = SingleFlight()
+
+
+def shared_fetch(ad_account_id: Optional[str], key: tuple, fetch: Callable, consumers: Optional[int] = None):
+    """Nas contas compartilhadas, uma busca só por chave para todos os clientes; nas demais, fetch()"""
+    if ad_account_id not in shared_accounts:
+        return fetch()
+    return single_flight.do(ad_account_id, key, fetch, consumers or shared_accounts[ad_account_id])
+
+
+def shared_pages(ad_account_id: Optional[str], key: tuple, pages_fn: Callable[[], Iterator[List[Dict]]],
+                 consumers: Optional[int] = None) -> Iterable[List[Dict]]:
+    """
+    Páginas de uma listagem: em streaming (buscadas à frente por prefetch) ou,
+    nas contas compartilhadas, buscadas uma vez e entregues a cada cliente
+    """
+    if ad_account_id not in shared_accounts:
+        return prefetch(pages_fn(), STREAM_QUEUE_PAGES)
+    return shared_fetch(ad_account_id, key, lambda: list(pages_fn()), consumers)
+
+
+# Catálogo de campanhas (sync_state): a listagem completa da conta, que
+# remove as campanhas excluídas, é refeita a cada CAMPAIGN_CATALOG_RECONCILE_HOURS;
+# nas outras execuções só vêm as campanhas com updated_time depois da última
+# listagem (menos uma folga para diferenças de relógio), mais uma listagem só
+# de effective_status: o status efetivo muda sem mexer no updated_time (fim da
+# programação, conta desativada, conjuntos pausados)
+CAMPAIGN_CATALOG_RECONCILE_HOURS = 24
+CAMPAIGN_CATALOG_OVERLAP_SECONDS = 300
+
+# Listagens do catálogo na execução atual
+CATALOG_STATS = {"full": 0, "delta": 0, "changed": 0, "status_changed": 0}
+_catalog_stats_lock = threading.Lock()
+
+
+def campaign_catalog_plan(ad_account_id: str, full_refresh: bool = False) -> tuple:
+    """
+    (catálogo atual, parâmetros da listagem, listagem completa?) da conta: completa
+    sem catálogo, com --full-refresh ou depois de CAMPAIGN_CATALOG_RECONCILE_HOURS;
+    senão, só as campanhas alteradas desde a última listagem
+    """
+    catalog, listed_at, reconciled_at = sync_state.get_campaign_catalog(ad_account_id)
+    params = campaigns_params()
+    full = (catalog is None or full_refresh
+            or time.time() - reconciled_at >= CAMPAIGN_CATALOG_RECONCILE_HOURS * 3600)
+    if not full:
+        params["filtering"] = json.dumps([{"field": "updated_time", "operator": "GREATER_THAN",
+                                           "value": int(listed_at - CAMPAIGN_CATALOG_OVERLAP_SECONDS)}])
+    return catalog or [], params, full
+
+
+def merge_campaign_catalog(ad_account_id: str, catalog: List[Dict], listed: List[Dict], listed_at: float,
+                           full: bool) -> List[Dict]:
+    """Grava a listagem no catálogo e retorna as campanhas da conta"""
+    with _catalog_stats_lock:
+        CATALOG_STATS["full" if full else "delta"] += 1
+        if not full:
+            CATALOG_STATS["changed"] += len(listed)
+    try:
+        sync_state.save_campaign_catalog(ad_account_id, listed, listed_at, full)
+    except Exception as e:
+        # Sem catálogo gravado, a próxima execução lista tudo de novo
+        print(f"   AVISO: Falha ao gravar catalogo de campanhas de {ad_account_id}: {e}")
+    if full:
+        return listed
+    changed = {c.get('id'): c for c in listed}
+    return [changed.pop(c.get('id'), c) for c in catalog] + list(changed.values())
+
+
+def apply_campaign_statuses(ad_account_id: str, campaigns: List[Dict], statuses: List[Dict],
+                            listed_at: float) -> List[Dict]:
+    """
+    Aplica ao catálogo os status efetivos listados agora (campanhas excluídas
+    continuam até a próxima listagem completa, que as remove)
+    """
+    current = {s.get('id'): s.get('effective_status') for s in statuses}
+    changed = [dict(c, effective_status=current[c.get('id')]) for c in campaigns
+               if c.get('id') in current and c.get('effective_status') != current[c.get('id')]]
+    if changed:
+        with _catalog_stats_lock:
+            CATALOG_STATS["status_changed"] += len(changed)
+        try:
+            sync_state.save_campaign_catalog(ad_account_id, changed, listed_at)
+        except Exception as e:
+            print(f"   AVISO: Falha ao gravar status das campanhas de {ad_account_id}: {e}")
+    updated = {c.get('id'): c for c in changed}
+    return [updated.get(c.get('id'), c) for c in campaigns]
+
+
+def refresh_campaign_catalog(ad_account_id: str, full_refresh: bool = False) -> List[Dict]:
+    """
+    Atualiza o catálogo de campanhas da conta pelo que mudou no Meta e retorna todas
+    as campanhas, com o status efetivo atual
+    """
+    url = f"{META_BASE_URL}/{ad_account_id}/campaigns"
+    catalog, params, full = campaign_catalog_plan(ad_account_id, full_refresh)
+    
+    def fetch(params: Dict) -> List[Dict]:
+        listed = []
+        with metrics.timer("campaigns"):
+            for page in iter_pages(url, params, ad_account_id):
+                listed.extend(page)
+        return listed
+    
+    listed_at = time.time()
+    try:
+        listed = fetch(params)
+    except MetaAbortError:
+        raise
+    except MetaAPIError as e:
+        if full:
+            raise
+        # Filtro por updated_time recusado: listagem completa
+        print(f"   AVISO: Listagem incremental de campanhas falhou ({str(e)}); listando todas")
+        full, listed_at = True, time.time()
+        listed = fetch(campaigns_params())
+    campaigns = merge_campaign_catalog(ad_account_id, catalog, listed, listed_at, full)
+    if full:
+        return campaigns
+    return apply_campaign_statuses(ad_account_id, campaigns, fetch(campaign_statuses_params()), listed_at)
+
+
+def filter_campaign_statuses(campaigns: List[Dict], effective_status: Optional[List[str]] = None) -> List[Dict]:
+    if not effective_status:
+        return list(campaigns)
+    return [c for c in campaigns if c.get('effective_status') in effective_status]
+
+
+def get_campaigns(ad_account_id: str, effective_status: Optional[List[str]] = None,
+                  full_refresh: bool = False) -> List[Dict]:
+    """
+    Campanhas de uma conta de anúncios (todas, ou só as dos status efetivos informados),
+    do catálogo local atualizado pelo que mudou no Meta desde a última listagem
+    """
+    catalog = shared_fetch(ad_account_id, ("campaign_catalog",),
+                           partial(refresh_campaign_catalog, ad_account_id, full_refresh))
+    return filter_campaign_statuses(catalog, effective_status)
+
+
+def get_delivering_campaigns(ad_account_id: str, since_date: Optional[str] = None,
+                             until_date: Optional[str] = None) -> Dict[str, str]:
+    """
+    Sondagem barata (uma listagem agregada por conta) das campanhas que tiveram
+    veiculação na janela. Retorna {campaign_id: campaign_name}.
+    """
+    since_date, until_date = resolve_window(since_date, until_date)
+    url = f"{META_BASE_URL}/{ad_account_id}/insights"
+    params = delivery_probe_params(since_date, until_date)
+    
+    def fetch():
+        delivering = {}
+        with metrics.timer("probe"):
+            for page in iter_pages(url, params, ad_account_id):
+                for row in page:
+                    if row.get('campaign_id'):
+                        delivering[row['campaign_id']] = row.get('campaign_name', 'Sem nome')
+        return delivering
+    
+    return dict(shared_fetch(ad_account_id, ("delivery", since_date, until_date), fetch))
+
+
+def filter_delivering_campaigns(campaigns: List[Dict], delivering: Dict[str, str]) -> tuple:
+    """
+    Mantém só as campanhas que veicularam na janela, incluindo as que veicularam
+    mas não vieram na listagem (ex: arquivadas recentemente).
+    Retorna (campanhas, quantidade puladas).
+    """
+    kept = [c for c in campaigns if c.get('id') in delivering]
+    skipped = len(campaigns) - len(kept)
+    listed = {c.get('id') for c in kept}
+    for campaign_id, campaign_name in delivering.items():
+        if campaign_id not in listed:
+            kept.append({"id": campaign_id, "name": campaign_name, "status": "UNKNOWN"})
+    return kept, skipped
+
+
+def resolve_window(since_date: Optional[str] = None, until_date: Optional[str] = None) -> tuple:
+    """
+    Retorna a janela (since, until) usada na busca de insights
+    """
+    if not until_date:
+        until_date = datetime.now().strftime("%Y-%m-%d")
+    
+    if not since_date:
+        # Meta tem limite de 37 meses para insights
+        # Usamos 30 dias para garantir dados recentes e performance rápida (solicitação do usuário)
+        # (Execução pontual de 90 dias feita para limpeza)
+        since_date = (datetime.now() - timedelta(days=30)).strftime("%Y-%m-%d")
+    
+    return since_date, until_date
+
+
+def campaign_insights_params(since_date: str, until_date: str) -> Dict:
+    """Parâmetros de /{campaign_id}/insights com dados diários"""
+    return {
+        "access_token": META_ACCESS_TOKEN,
+        "fields": "date_start,date_stop,spend,impressions,reach,clicks,actions",
+        "time_range": json.dumps({"since": since_date, "until": until_date}),
+        "time_increment": 1,  # Dados diários
+        "limit": 100
+    }
+
+
+def account_insights_params(since_date: str, until_date: str) -> Dict:
+    """Parâmetros de /{act_id}/insights com uma linha por campanha e dia"""
+    return {
+        "access_token": META_ACCESS_TOKEN,
+        "level": "campaign",
+        "fields": "campaign_id,campaign_name,date_start,date_stop,spend,impressions,reach,clicks,actions",
+        "time_range": json.dumps({"since": since_date, "until": until_date}),
+        "time_increment": 1,  # Dados diários
+        "limit": 500
+    }
+
+
+def iter_campaign_insight_pages(campaign_id: str, since_date: Optional[str] = None, until_date: Optional[str] = None,
+                                ad_account_id: Optional[str] = None) -> Iterator[List[Dict]]:
+    """
+    Páginas de insights diários de uma campanha, à medida que chegam
+    """
+    since_date, until_date = resolve_window(since_date, until_date)
+    return metrics.timed_pages("insights", iter_pages(f"{META_BASE_URL}/{campaign_id}/insights",
+                                                      campaign_insights_params(since_date, until_date), ad_account_id))
+
+
+def iter_account_insight_pages(ad_account_id: str, since_date: Optional[str] = None,
+                               until_date: Optional[str] = None, expected_rows: int = 0) -> Iterator[List[Dict]]:
+    """
+    Páginas da listagem level=campaign da conta (linhas de várias campanhas por página).
+    Se a estimativa de linhas passar de REPORT_RUN_MIN_ROWS, usa um relatório assíncrono.
+    """
+    since_date, until_date = resolve_window(since_date, until_date)
+    url = f"{META_BASE_URL}/{ad_account_id}/insights"
+    params = account_insights_params(since_date, until_date)
+    if expected_rows >= REPORT_RUN_MIN_ROWS:
+        print(f"   [CONTA] ~{expected_rows} linha(s) estimada(s) ({since_date} a {until_date}): relatorio assincrono")
+        return metrics.timed_pages("insights", iter_report_run_pages(url, params, ad_account_id))
+    return metrics.timed_pages("insights", iter_pages(url, params, ad_account_id))
+
+
+def group_by_campaign(rows: List[Dict]) -> Dict[str, List[Dict]]:
+    """Agrupa linhas level=campaign por campaign_id"""
+    insights_by_campaign: Dict[str, List[Dict]] = {}
+    for insight in rows:
+        campaign_id = insight.get('campaign_id')
+        if campaign_id:
+            insights_by_campaign.setdefault(campaign_id, []).append(insight)
+    return insights_by_campaign
+
+
+# Contadores da Batch API na execução atual (round trips economizados)
+BATCH_STATS = {"requests": 0, "batch_calls": 0}
+_batch_stats_lock = threading.Lock()
+
+
+def to_relative_url(next_url: str) -> str:
+    """
+    Converte o link paging.next (absoluto) em relative_url para a Batch API
+    """
+    parts = urlsplit(next_url)
+    path = parts.path.lstrip('/')
+    # Remove a versão da API do caminho (a chamada batch já é versionada)
+    if path.startswith(META_API_VERSION + '/'):
+        path = path[len(META_API_VERSION) + 1:]
+    return f"{path}?{parts.query}" if parts.query else path
+
+
+def make_meta_batch_request(relative_urls: List[str], ad_account_id: Optional[str] = None) -> List[Optional[Dict]]:
+    """
+    Envia até BATCH_MAX_REQUESTS requisições GET em uma única chamada batch do Graph API.
+    Retorna, na mesma ordem, o item de resposta de cada requisição ({code, body}) ou
+    None quando o Meta não chegou a processá-la (timeout interno do batch).
+    """
+    batch = [{"method": "GET", "relative_url": relative_url} for relative_url in relative_urls]
+    data = make_meta_request(f"{META_BASE_URL}/", {
+        "access_token": META_ACCESS_TOKEN,
+        "batch": json.dumps(batch),
+        "include_headers": "false"
+    }, method="POST", account_id=ad_account_id)
+    
+    with _batch_stats_lock:
+        BATCH_STATS["requests"] += len(relative_urls)
+        BATCH_STATS["batch_calls"] += 1
+    
+    return data if isinstance(data, list) else [None] * len(relative_urls)
+
+
+def iter_campaign_insights_batched(campaign_ids: List[str], since_date: Optional[str] = None,
+                                   until_date: Optional[str] = None,
+                                   ad_account_id: Optional[str] = None) -> Iterator[tuple]:
+    """
+    Busca insights diários de várias campanhas empacotando as requisições em
+    chamadas batch de até 50 itens. Páginas seguintes (paging.next) entram na
+    fila dos próximos lotes.
+    
+    Gera, à medida que cada resposta batch chega, (campaign_id, página, erro):
+    uma página de insights (erro None), (campaign_id, None, None) quando a
+    campanha não tem mais páginas, ou (campaign_id, None, mensagem) se falhou.
+    Páginas de campanhas diferentes vêm intercaladas.
+    """
+    since_date, until_date = resolve_window(since_date, until_date)
+    
+    query = urlencode({
+        "fields": "date_start,date_stop,spend,impressions,reach,clicks,actions",
+        "time_range": json.dumps({"since": since_date, "until": until_date}),
+        "time_increment": 1,  # Dados diários
+        "limit": 100
+    })
+    return metrics.timed_pages("insights", _batched_insight_events(campaign_ids, query, ad_account_id))
+
+
+def _batched_insight_events(campaign_ids: List[str], query: str, ad_account_id: Optional[str]) -> Iterator[tuple]:
+    attempts: Dict[str, int] = {}
+    pending = deque((cid, f"{cid}/insights?{query}") for cid in campaign_ids)
+    
+    while pending:
+        chunk = [pending.popleft() for _ in range(min(BATCH_MAX_REQUESTS, len(pending)))]
+        
+        try:
+            responses = make_meta_batch_request([relative_url for _, relative_url in chunk], ad_account_id)
+        except MetaAbortError:
+            raise
+        except Exception as e:
+            for campaign_id, _ in chunk:
+                yield campaign_id, None, str(e)
+            continue
+        
+        for (campaign_id, relative_url), item in zip(chunk, responses):
+            # Item nulo: o Meta não processou a requisição a tempo, tenta de novo
+            if item is None:
+                attempts[relative_url] = attempts.get(relative_url, 0) + 1
+                if attempts[relative_url] < MAX_RETRIES:
+                    pending.append((campaign_id, relative_url))
+                else:
+                    yield campaign_id, None, "Requisição não processada pela Batch API"
+                continue
+            
+            try:
+                body = json.loads(item.get('body') or '{}')
+            except ValueError:
+                body = {}
+            
+            if item.get('code') != 200:
+                error = error_from_response(item.get('code'), body)
+                if isinstance(error, MetaAbortError):
+                    raise error
+                
+                # Throttling/erro transitório no item: volta para a fila e a conta
+                # espera o backoff antes do próximo lote
+                attempts[relative_url] = attempts.get(relative_url, 0) + 1
+                delay = retry_policy.next_delay(error, attempts[relative_url], None)
+                if delay is None:
+                    yield campaign_id, None, str(error)
+                else:
+                    governor.pause(ad_account_id, delay)
+                    pending.append((campaign_id, relative_url))
+                continue
+            
+            # Paginação
+            next_url = body.get('paging', {}).get('next')
+            if next_url:
+                pending.append((campaign_id, to_relative_url(next_url)))
+            yield campaign_id, body.get('data', []), None
+            if not next_url:
+                yield campaign_id, None, None
+
+
+# ----------------------------------------------------------------
+# RELATÓRIOS ASSÍNCRONOS (POST /insights -> report_run_id)
+# ----------------------------------------------------------------
+
+def estimate_insight_rows(campaign_count: int, since_date: str, until_date: str) -> int:
+    """Estimativa de linhas diárias de uma listagem level=campaign (campanhas x dias)"""
+    days = (date.fromisoformat(until_date) - date.fromisoformat(since_date)).days + 1
+    return campaign_count * max(days, 1)
+
+
+def fetch_report_run_status(report_run_ids: List[str], ad_account_id: Optional[str] = None) -> Dict[str, Dict]:
+    """Status de vários relatórios em uma única chamada (?ids=)"""
+    data = make_meta_request(f"{META_BASE_URL}/", {
+        "access_token": META_ACCESS_TOKEN,
+        "ids": ",".join(report_run_ids),
+        "fields": "async_status,async_percent_completion"
+    }, account_id=ad_account_id)
+    return data or {}
+
+
+report_runs = ReportRunPoller(fetch_report_run_status, REPORT_RUN_POLL_SECONDS, REPORT_RUN_TIMEOUT)
+
+
+def iter_report_run_pages(url: str, params: Dict, ad_account_id: Optional[str] = None) -> Iterator[List[Dict]]:
+    """
+    Cria o relatório assíncrono (POST com os mesmos parâmetros da listagem),
+    espera o processamento e percorre as páginas do resultado. Se o Meta recusar
+    ou não concluir o relatório, volta para a paginação síncrona.
+    """
+    try:
+        data = make_meta_request(url, params, method="POST", account_id=ad_account_id)
+        report_run_id = (data or {}).get('report_run_id')
+        if not report_run_id:
+            raise ReportRunError("POST /insights nao devolveu report_run_id")
+        report_runs.wait(report_run_id, ad_account_id)
+    except MetaAbortError:
+        raise
+    except (MetaAPIError, ReportRunError) as e:
+        print(f"      AVISO: Relatorio assincrono indisponivel ({str(e)}); usando paginacao sincrona")
+        yield from iter_pages(url, params, ad_account_id)
+        return
+    
+    yield from iter_pages(f"{META_BASE_URL}/{report_run_id}/insights",
+                          {"access_token": META_ACCESS_TOKEN, "limit": params.get("limit", 500)}, ad_account_id)
+
+
+# Colunas que entram no hash de conteúdo (campaign_name incluído para propagar renomeações)
+HASHED_COLUMNS = ("campaign_name", "investimento", "impressoes", "cliques_link", "alcance",
+                  "resultado_valor", "resultado_nome")
+
+
+def metric_row_hash(row: Dict) -> str:
+    """Hash estável do conteúdo de uma linha já validada (tipos normalizados)"""
+    content = json.dumps([row.get(column) for column in HASHED_COLUMNS], ensure_ascii=False)
+    return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+
+# Chave única de dashboard_campaign_metrics (criada por add_metrics_unique_key.sql)
+METRICS_CONFLICT_KEY = "client_id,campaign_id,data_referencia"
+
+# Linhas por requisição no upsert nativo (ON CONFLICT)
+UPSERT_BATCH_SIZE = 1000
+
+# None = ainda não verificado; False = constraint ausente, usar leitura antes da escrita
+_unique_key_available: Optional[bool] = None
+
+# Linhas recusadas (validação ou banco), com o motivo
+dead_letter = DeadLetter()
+
+# Chaves (client_id, campaign_id, data_referencia) recusadas pelo banco nesta execução:
+# o hash delas não é registrado, então a linha é reenviada quando o dia for buscado de novo
+_rejected_keys: set = set()
+_rejected_keys_lock = threading.Lock()
+
+
+def metric_key(row: Dict) -> tuple:
+    return str(row.get('client_id')), str(row.get('campaign_id')), row.get('data_referencia')
+
+
+def take_rejected_days(client_id: str, campaign_id: str, days: Iterable[str]) -> set:
+    """Dias da campanha recusados pelo banco (retirados do registro)"""
+    with _rejected_keys_lock:
+        rejected = {day for day in days if (str(client_id), str(campaign_id), day) in _rejected_keys}
+        _rejected_keys.difference_update((str(client_id), str(campaign_id), day) for day in rejected)
+    return rejected
+
+
+def is_missing_unique_key_error(e: Exception) -> bool:
+    """Erro do PostgREST quando não existe constraint para o ON CONFLICT (42P10)"""
+    return getattr(e, 'code', None) == '42P10' or '42P10' in str(e) \
+        or 'no unique or exclusion constraint' in str(e)
+
+
+def is_row_data_error(e: Exception) -> bool:
+    """Erro causado pelo conteúdo de alguma linha (SQLSTATE 22xxx dado inválido, 23xxx constraint)"""
+    code = str(getattr(e, 'code', None) or '')
+    return code.startswith('22') or code.startswith('23')
+
+
+def upsert_bisecting(batch: List[Dict], label: str, options: Dict) -> tuple:
+    """
+    Tenta gravar o lote; se o banco recusar, divide ao meio e tenta cada metade,
+    até isolar as linhas problemáticas em O(log n) requisições. Cada linha
+    recusada sozinha vai para o dead-letter com o erro do servidor.
+    
+    Retorna (gravadas, isoladas no dead-letter).
+    """
+    try:
+        supabase.table("dashboard_campaign_metrics").upsert(batch, **options).execute()
+        return len(batch), 0
+    except Exception as e:
+        # Sem a constraint não adianta dividir: quem chamou usa o caminho antigo
+        if options.get("on_conflict") and is_missing_unique_key_error(e):
+            raise
+        # Rede, permissão, servidor fora: não é culpa das linhas, o flush falha e a janela é buscada de novo
+        if not is_row_data_error(e):
+            raise
+        if len(batch) == 1:
+            print(f"      ERRO: Metrica de {batch[0].get('data_referencia')} recusada ({label}), "
+                  f"enviada ao dead-letter: {str(e)}")
+            dead_letter.write(batch[0], e, f"upsert:{label}")
+            with _rejected_keys_lock:
+                _rejected_keys.add(metric_key(batch[0]))
+            metrics.inc("rows_rejected_total", stage="upsert",
+                        client=metrics.client_name(str(batch[0].get('client_id', NO_CLIENT))))
+            return 0, 1
+        middle = len(batch) // 2
+        left = upsert_bisecting(batch[:middle], label, options)
+        right = upsert_bisecting(batch[middle:], label, options)
+        return left[0] + right[0], left[1] + right[1]
+
+
+def batch_upsert(items: List[Dict], label: str = "items", on_conflict: Optional[str] = None,
+                 batch_size: int = 50) -> tuple:
+    """
+    Faz upsert em lotes; um lote recusado é dividido ao meio recursivamente
+    (upsert_bisecting) em vez de ser regravado linha a linha.
+    Com on_conflict usa o upsert nativo pela chave única (sem precisar de id).
+    
+    Retorna (gravadas, isoladas no dead-letter).
+    """
+    if not items: return 0, 0
+    written_total = quarantined_total = 0
+    options = {"on_conflict": on_conflict} if on_conflict else {}
+    for i in range(0, len(items), batch_size):
+        batch = items[i:i + batch_size]
+        written, quarantined = upsert_bisecting(batch, label, options)
+        if quarantined:
+            print(f"      ⚠️  Erro no batch ({label}): {quarantined} de {len(batch)} linha(s) isolada(s) no dead-letter")
+        written_total += written
+        quarantined_total += quarantined
+    return written_total, quarantined_total
+
+
+def write_metric_rows(rows: List[Dict]) -> tuple:
+    """
+    Grava um lote de métricas diárias (de quaisquer campanhas/clientes); é a
+    função de flush do metrics_buffer.
+    
+    Com a chave única (client_id, campaign_id, data_referencia) no banco, é um único
+    upsert ON CONFLICT, sem leitura prévia. Se a constraint não existir, detecta na
+    primeira gravação e passa a usar o caminho antigo (buscar ids e separar
+    updates/inserts, por campanha) pelo resto da execução.
+    
+    Retorna (gravadas, recusadas e isoladas no dead-letter).
+    """
+    with metrics.timer("upsert", client=NO_CLIENT):
+        written, quarantined = _write_metric_rows(rows)
+    
+    # Linhas gravadas por cliente (um flush junta linhas de vários clientes)
+    if written + quarantined == len(rows):
+        with _rejected_keys_lock:
+            rejected = set(_rejected_keys)
+        per_client: Dict[str, int] = {}
+        for row in rows:
+            if quarantined and metric_key(row) in rejected:
+                continue
+            per_client[row['client_id']] = per_client.get(row['client_id'], 0) + 1
+        for client_id, count in per_client.items():
+            metrics.inc("rows_written_total", count, client=metrics.client_name(client_id))
+    else:
+        metrics.inc("rows_written_total", written, client=NO_CLIENT)
+    return written, quarantined
+
+
+def _write_metric_rows(rows: List[Dict]) -> tuple:
+    global _unique_key_available
+    
+    if _unique_key_available is not False and rows:
+        try:
+            written, quarantined = batch_upsert(rows, "upsert", on_conflict=METRICS_CONFLICT_KEY,
+                                                batch_size=UPSERT_BATCH_SIZE)
+            _unique_key_available = True
+            print(f"      OK: {written} metrica(s) gravada(s) (upsert on_conflict)"
+                  + (f", {quarantined} recusada(s)" if quarantined else ""))
+            return written, quarantined
+        except Exception as e:
+            if not is_missing_unique_key_error(e):
+                raise
+            _unique_key_available = False
+            print("      AVISO: Chave unica (client_id, campaign_id, data_referencia) nao encontrada em "
+                  "dashboard_campaign_metrics. Rode add_metrics_unique_key.sql; usando leitura antes da escrita.")
+    
+    by_campaign: Dict[tuple, List[Dict]] = {}
+    for row in rows:
+        by_campaign.setdefault((row['client_id'], row['campaign_id']), []).append(row)
+    written = quarantined = 0
+    for (client_id, campaign_id), campaign_rows in by_campaign.items():
+        campaign_written, campaign_quarantined = save_campaign_metrics_by_id(client_id, campaign_id, campaign_rows)
+        written += campaign_written
+        quarantined += campaign_quarantined
+    return written, quarantined
+
+
+# Buffer de escrita compartilhado por todas as campanhas e clientes da execução
+WRITE_BUFFER_MAX_ROWS = 1000
+WRITE_BUFFER_MAX_BYTES = 1_000_000
+WRITE_BUFFER_MAX_AGE = 10.0
+metrics_buffer = WriteBuffer(write_metric_rows, max_rows=WRITE_BUFFER_MAX_ROWS,
+                             max_bytes=WRITE_BUFFER_MAX_BYTES, max_age=WRITE_BUFFER_MAX_AGE,
+                             label="dashboard_campaign_metrics",
+                             key_fn=lambda row: (row['client_id'], row['campaign_id'], row['data_referencia']))
+
+
+def save_campaign_metrics_by_id(client_id: str, campaign_id: str, metrics_to_insert: List[Dict]) -> tuple:
+    """
+    Caminho sem chave única: busca os IDs existentes e separa updates/inserts.
+    Retorna (gravadas, isoladas no dead-letter).
+    """
+    # Buscar IDs existentes para garantir UPDATE correto (evitar duplicatas)
+    # Formar lista de chaves para busca
+    dates = [m['data_referencia'] for m in metrics_to_insert]
+    existing_map = {}
+    
+    if dates:
+        try:
+            # Buscar registros existentes para este cliente/campanha nessas datas
+            existing_response = supabase.table("dashboard_campaign_metrics").select("id, data_referencia")\
+                .eq("client_id", client_id)\
+                .eq("campaign_id", campaign_id)\
+                .in_("data_referencia", dates)\
+                .execute()
+            
+            if existing_response.data:
+                for row in existing_response.data:
+                    existing_map[row['data_referencia']] = row['id']
+        except Exception as e:
+            print(f"      ⚠️  Erro ao buscar existentes: {str(e)}")
+
+    # Separa atualizações e inserções para garantir consistência de chaves no batch
+    updates = []
+    inserts = []
+    
+    for metric in metrics_to_insert:
+        if metric['data_referencia'] in existing_map:
+            metric['id'] = existing_map[metric['data_referencia']]
+            updates.append(metric)
+        else:
+            inserts.append(metric)
+
+    # Executar batches
+    updated_count, updates_rejected = batch_upsert(updates, "updates")
+    inserted_count, inserts_rejected = batch_upsert(inserts, "inserts")
+    
+    total_ops = updated_count + inserted_count
+    print(f"      OK: {total_ops} metrica(s) processada(s) ({updated_count} updates, {inserted_count} inserts)")
+    return total_ops, updates_rejected + inserts_rejected
+
+
+def update_account_totals(client_id: str, ad_account_id: str):
+    """
+    Atualiza os totais de 30 dias da conta (alcance/impressões reais) na tabela clients
+    """
+    try:
+        # 1. Fetch Account Insights (last_30d)
+        acc_url = f"{META_BASE_URL}/{ad_account_id}/insights"
+        acc_params = {
+            'access_token': META_ACCESS_TOKEN,
+            'level': 'account',
+            'date_preset': 'last_30d',
+            'fields': 'reach,impressions,spend'
+        }
+        try:
+            # Conta compartilhada: uma requisição, gravada na linha de cada cliente
+            data = shared_fetch(ad_account_id, ("account_totals",),
+                                partial(make_meta_request, acc_url, acc_params, account_id=ad_account_id))
+        except MetaAbortError:
+            raise
+        except Exception as e_req:
+            print(f"      ERRO Account Insights: {e_req}")
+            data = None
+        
+        # 2. Update Client Table
+        update_data = {'last_sync_at': datetime.now().isoformat()}
+        
+        if data:
+            d = data.get('data', [])
+            if d:
+                item = d[0]
+                update_data['account_reach_30d'] = int(item.get('reach', 0))
+                update_data['account_impressions_30d'] = int(item.get('impressions', 0))
+                update_data['account_spend_30d'] = float(item.get('spend', 0))
+                print(f"      [CONTA] Reach 30d: {item.get('reach')} | Impr: {item.get('impressions')}")
+        
+        # Try update (ignoring if cols don't exist yet - user needs to run SQL)
+        try:
+            supabase.table('clients').update(update_data).eq('id', client_id).execute()
+        except Exception as ex_db:
+            print(f"      AVISO DB: Falha ao atualizar dados da conta (Colunas existem?): {ex_db}")
+            
+    except MetaAbortError:
+        raise
+    except Exception as e_acc:
+        print(f"      ERRO Account Insights: {e_acc}")
+
+
+# Execução com prazo (--time-budget); definido em main()
+time_budget: Optional[TimeBudget] = None
+
+# --time-budget: a passada prioritária só busca a camada mais recente (hoje e ontem)
+PRIORITY_TIER = REFRESH_TIERS[0]
+BUDGET_PASSES = ((True, "hoje/ontem"), (False, "dias anteriores"))
+
+# Requisições estimadas para começar um cliente (listagem, sondagem ou listagem da conta, totais)
+BUDGET_CLIENT_REQUESTS = 3
+
+# --time-budget: listagem e sondagem da primeira passada, reaproveitadas na segunda,
+# e o resultado de cada cliente somado entre as passadas (registrado uma vez no fim)
+budget_listings: Dict[str, tuple] = {}
+budget_results: Dict[str, tuple] = {}
+
+
+def plan_window(client_id: str, object_id: str, full_refresh: bool = False) -> tuple:
+    """
+    Janela incremental (since, until, camadas) de uma campanha ou conta do cliente,
+    conforme os watermarks salvos. Com full_refresh busca a janela completa.
+    Na passada prioritária do --time-budget, só a camada mais recente; na
+    seguinte, só os dias anteriores a ela (hoje/ontem já foram buscados).
+    """
+    if full_refresh:
+        return plan_refresh({})
+    watermarks = sync_state.get_watermarks(f"{client_id}:{object_id}")
+    if time_budget is None:
+        return plan_refresh(watermarks)
+    if time_budget.priority_pass:
+        return plan_refresh(watermarks, max_day=PRIORITY_TIER[2])
+    return plan_refresh(watermarks, min_day=PRIORITY_TIER[2] + 1)
+
+
+def within_budget(requests: int = 1) -> bool:
+    """--time-budget: True se a unidade de trabalho cabe no tempo restante (sem prazo, sempre True)"""
+    return time_budget is None or time_budget.allows(requests)
+
+
+def older_tiers_due(client_id: str, object_id: str, full_refresh: bool = False) -> bool:
+    """Segunda passada do --time-budget: True se há camadas além de hoje/ontem a atualizar"""
+    return not full_refresh and bool(plan_window(client_id, object_id)[2])
+
+
+def budget_campaigns(client_id: str, campaigns: List[Dict], full_refresh: bool = False) -> List[Dict]:
+    """
+    --time-budget: na passada prioritária, campanhas ativas primeiro; na
+    seguinte, só as campanhas com dias anteriores a atualizar
+    """
+    if time_budget.priority_pass:
+        return sorted(campaigns, key=lambda c: (c.get('effective_status') or c.get('status')) != 'ACTIVE')
+    due = [c for c in campaigns if older_tiers_due(client_id, c.get('id'), full_refresh)]
+    if len(due) < len(campaigns):
+        print(f"   {len(campaigns) - len(due)} campanha(s) ja em dia (so hoje/ontem, feitos na passada prioritaria)")
+    return due
+
+
+def report_client_result(client_id: str, client_name: str, result: Dict):
+    """Log de sucesso e resumo de um cliente sincronizado"""
+    log_error(client_id, "sync_meta_metrics", "success",
+             f"Sincronização concluída para {client_name}", result)
+    print(f"   OK: Cliente {client_name} processado: {result['insights_processed']} metrica(s) enviada(s), "
+          f"{result['insights_unchanged']} sem alteracao "
+          f"({result['campaigns_skipped']} campanha(s) sem veiculacao pulada(s))")
+    if result["campaigns_deferred"]:
+        print(f"   PRAZO: {result['campaigns_deferred']} campanha(s) adiada(s) para a proxima execucao")
+
+
+def add_budget_result(client_id: str, client_name: str, result: Dict):
+    """
+    --time-budget: soma o resultado da passada ao do cliente. Métricas são somadas;
+    campanhas com veiculação e adiadas ficam com o maior valor entre as passadas
+    """
+    if client_id not in budget_results:
+        budget_results[client_id] = (client_name, dict(result))
+        return
+    total = budget_results[client_id][1]
+    total["insights_processed"] += result["insights_processed"]
+    total["insights_unchanged"] += result["insights_unchanged"]
+    if result["campaigns_processed"] > total["campaigns_processed"]:
+        total["campaigns_processed"] = result["campaigns_processed"]
+        total["campaigns_skipped"] = result["campaigns_skipped"]
+    total["campaigns_deferred"] = max(total["campaigns_deferred"], result["campaigns_deferred"])
+
+
+def report_budget_results():
+    """--time-budget: um resultado por cliente, depois de todas as passadas"""
+    if budget_results:
+        print("\n--- Resultado por cliente ---")
+    for client_id, (client_name, result) in budget_results.items():
+        report_client_result(client_id, client_name, result)
+
+
+def mark_refreshed(client_id: str, object_id: str, tiers: List[str]):
+    """Registra o watermark após gravar com sucesso a janela buscada"""
+    try:
+        sync_state.save_watermarks(f"{client_id}:{object_id}", tiers)
+    except Exception as e:
+        print(f"      AVISO: Falha ao salvar watermark de {object_id}: {e}")
+
+
+def mark_refreshed_if_written(client_id: str, object_id: str, tiers: List[str], failed_flushes_before: int):
+    """
+    Callback pós-gravação do watermark da conta: só avança se nenhum flush do
+    buffer falhou desde o início do cliente (as linhas podem ter ido em vários flushes)
+    """
+    if metrics_buffer.failed_flushes == failed_flushes_before:
+        mark_refreshed(client_id, object_id, tiers)
+
+
+# Checkpoint da execução atual (--resume); definido em main()
+run_checkpoint: Optional[RunCheckpoint] = None
+
+
+def unit_completed(kind: str, unit: str) -> bool:
+    """True se a unidade (client_id ou client_id:campaign_id) já foi concluída nesta execução"""
+    return run_checkpoint is not None and run_checkpoint.is_done(kind, unit)
+
+
+def mark_unit_done_if_written(kind: str, unit: str, failed_flushes_before: int):
+    """Callback pós-gravação: registra a unidade como concluída se nenhum flush falhou"""
+    if run_checkpoint is None or metrics_buffer.failed_flushes != failed_flushes_before:
+        return
+    try:
+        run_checkpoint.mark_done(kind, unit)
+    except Exception as e:
+        print(f"      AVISO: Falha ao registrar checkpoint de {unit}: {e}")
+
+
+# Modo worker (--worker): leases dos clientes na tabela clients; definido em main()
+client_leases: Optional[ClientLeases] = None
+
+
+def claim_client(client_id: str, client_name: str) -> bool:
+    """Modo worker: tenta tomar o lease do cliente (fora do modo worker, sempre True)"""
+    if client_leases is None:
+        return True
+    if client_leases.claim(client_id):
+        print(f"\n[WORKER] Lease de {client_name} obtido ({client_leases.owner})")
+        return True
+    print(f"\n[WORKER] {client_name} esta com outro worker ou ja foi concluido nesta rodada. Pulando...")
+    return False
+
+
+def release_client(client_id: str):
+    """
+    Modo worker: grava o que está no buffer e libera o lease; o cliente conta
+    como concluído se o checkpoint da execução o registrou
+    """
+    if client_leases is None:
+        return
+    metrics_buffer.flush()
+    client_leases.release(client_id, unit_completed("client", client_id))
+
+
+def pending_campaigns(client_id: str, campaigns: List[Dict]) -> List[Dict]:
+    """Tira da lista as campanhas já concluídas nesta execução (--resume)"""
+    pending = [c for c in campaigns if not unit_completed("campaign", f"{client_id}:{c.get('id')}")]
+    if len(pending) < len(campaigns):
+        print(f"   {len(campaigns) - len(pending)} campanha(s) ja concluida(s) nesta execucao")
+    return pending
+
+
+# Opções que definem os clientes e as campanhas de uma execução: guardadas no
+# checkpoint e restauradas pelo --resume
+RESUME_OPTIONS = ("client", "fetch_mode", "shard", "no_prefilter", "engine", "full_refresh")
+
+
+def run_options(args) -> Dict:
+    """Opções da execução no formato guardado em sync_runs (JSON)"""
+    return {name: list(value) if isinstance(value, tuple) else value
+            for name, value in ((name, getattr(args, name)) for name in RESUME_OPTIONS)}
+
+
+def find_resume_run(resume: str) -> Optional[Dict]:
+    """
+    Execução a retomar com --resume. Sem RUN_ID, só a mais recente e só se
+    ela não foi concluída (uma execução antiga interrompida não é revivida
+    depois de outras terem terminado). None se não há nada a retomar.
+    """
+    run = sync_state.latest_run() if resume == "latest" else sync_state.get_run(resume)
+    if run is None:
+        print(f"Nada a retomar: nenhuma execucao {'registrada' if resume == 'latest' else resume}")
+        return None
+    if run["finished_at"]:
+        latest = " mais recente" if resume == "latest" else ""
+        print(f"Nada a retomar: a execucao{latest} {run['run_id']} foi concluida em {run['finished_at']}")
+        return None
+    return run
+
+
+def restore_run_options(parser, args, run: Dict):
+    """
+    --resume: refaz a execução com as opções originais. Uma opção passada na
+    linha de comando com valor diferente do original é recusada.
+    """
+    stored = run["options"]
+    current = run_options(args)
+    for name in RESUME_OPTIONS:
+        if name not in stored:
+            continue
+        if current[name] != stored[name] and current[name] != parser.get_default(name):
+            parser.error(f"--resume {run['run_id']}: a execucao original usou {name}={stored[name]!r}, "
+                         f"nao {current[name]!r}")
+        value = stored[name]
+        setattr(args, name, tuple(value) if isinstance(value, list) else value)
+
+
+def open_run_checkpoint(run: Optional[Dict], clients: int, options: Dict) -> RunCheckpoint:
+    """Abre a execução retomada (ver find_resume_run) ou registra uma nova"""
+    if run is None:
+        run_id = f"{datetime.now():%Y%m%d-%H%M%S}-{os.getpid()}"
+        sync_state.start_run(run_id, clients, options)
+        print(f"Execucao {run_id} (retome com --resume se for interrompida)")
+        return RunCheckpoint(sync_state, run_id)
+    
+    checkpoint = RunCheckpoint(sync_state, run["run_id"])
+    print(f"RETOMANDO execucao {run['run_id']} (iniciada em {run['started_at']}): "
+          f"{checkpoint.resumed['client']} cliente(s) e {checkpoint.resumed['campaign']} campanha(s) ja concluido(s)")
+    if clients != run["clients"]:
+        print(f"AVISO: a execucao original tinha {run['clients']} cliente(s); agora sao {clients} "
+              f"(lista de clientes ativos mudou)")
+    return checkpoint
+
+
+def iter_campaign_insights_batched_by_window(client_id: str, campaign_ids: List[str], ad_account_id: str,
+                                             full_refresh: bool = False) -> tuple:
+    """
+    Modo batch com janelas incrementais: agrupa as campanhas pela janela planejada
+    (são poucas combinações) e faz as chamadas batch de cada grupo em streaming,
+    como as outras listagens (shared_pages).
+    
+    Retorna (camadas_por_campanha, eventos de iter_campaign_insights_batched de todos os grupos).
+    """
+    groups: Dict[tuple, List[str]] = {}
+    tiers_by_campaign: Dict[str, List[str]] = {}
+    for campaign_id in campaign_ids:
+        since_date, until_date, tiers = plan_window(client_id, campaign_id, full_refresh)
+        groups.setdefault((since_date, until_date), []).append(campaign_id)
+        tiers_by_campaign[campaign_id] = tiers
+    
+    def events() -> Iterator[tuple]:
+        for (since_date, until_date), ids in groups.items():
+            yield from shared_pages(ad_account_id, ("batch_insights", since_date, until_date, tuple(sorted(ids))),
+                                    partial(iter_campaign_insights_batched, ids, since_date, until_date, ad_account_id))
+    
+    return tiers_by_campaign, events()
+
+
+def store_batched_insights(client_id: str, campaigns: List[Dict], tiers_by_campaign: Dict[str, List[str]],
+                           events: Iterable[tuple], force_write: bool = False,
+                           client_name: Optional[str] = None) -> tuple:
+    """
+    Modo batch: grava as páginas de cada campanha à medida que as respostas batch
+    chegam; o resumo e o watermark de cada campanha ficam para quando ela termina.
+    client_name identifica as mensagens no motor async (clientes em paralelo).
+    Retorna (linhas enfileiradas, linhas sem alteração, ids das campanhas com falha).
+    """
+    listed = {c.get('id'): c for c in campaigns}
+    totals = {campaign_id: [0, 0, 0] for campaign_id in listed}  # dias, enfileiradas, sem alteração
+    failed_flushes_before = metrics_buffer.failed_flushes
+    failed: set = set()
+    prefix = f"[{client_name}] " if client_name else ""
+    error_label = f"ERRO [{client_name}]" if client_name else "ERRO"
+    
+    for campaign_id, page, error in events:
+        campaign = listed.get(campaign_id)
+        if campaign is None or campaign_id in failed:
+            continue
+        campaign_name = campaign.get('name', 'Sem nome')
+        try:
+            if error is not None:
+                raise Exception(error)
+            if page is not None:
+                if page:
+                    queued, unchanged = store_campaign_insights(client_id, campaign, page,
+                                                                force_write=force_write, report=False)
+                    campaign_totals = totals[campaign_id]
+                    campaign_totals[0] += len(page)
+                    campaign_totals[1] += queued
+                    campaign_totals[2] += unchanged
+                continue
+            
+            # Última página da campanha
+            print(f"   {prefix}Campanha: {campaign_name} ({campaign.get('status', 'UNKNOWN')}) "
+                  f"- Obj: {campaign.get('objective')}")
+            report_campaign_totals(*totals[campaign_id])
+            # O watermark só avança depois que o buffer gravar todas as páginas
+            tiers = tiers_by_campaign.get(campaign_id)
+            if tiers:
+                metrics_buffer.add([], on_written=partial(mark_refreshed_if_written, client_id, campaign_id,
+                                                          tiers, failed_flushes_before))
+            metrics_buffer.add([], on_written=partial(mark_unit_done_if_written, "campaign",
+                                                      f"{client_id}:{campaign_id}", failed_flushes_before))
+        except MetaAbortError:
+            raise
+        except Exception as e:
+            failed.add(campaign_id)
+            error_msg = f"Erro ao processar campanha {campaign_name}: {str(e)}"
+            print(f"      {error_label}: {error_msg}")
+            log_error(client_id, "sync_meta_metrics", "error", error_msg,
+                     {"campaign_id": campaign_id, "campaign_name": campaign_name})
+    
+    return sum(t[1] for t in totals.values()), sum(t[2] for t in totals.values()), failed
+
+
+# Páginas de insights buscadas à frente da gravação (fila limitada em page_stream.prefetch)
+STREAM_QUEUE_PAGES = 4
+
+# Modos de busca de insights:
+# - campaign: uma listagem de /insights por campanha (comportamento original)
+# - account: uma única listagem /{act_id}/insights?level=campaign distribuída por campaign_id
+# - batch: requisições por campanha agrupadas em chamadas batch de até 50 itens
+FETCH_MODES = ("campaign", "account", "batch")
+
+
+def save_metric_hashes(client_id: str, campaign_id: str, hashes: Dict[str, str]):
+    """Registra os hashes das linhas gravadas (chamado depois do flush)"""
+    try:
+        sync_state.save_metric_hashes(client_id, campaign_id, hashes)
+    except Exception as e:
+        print(f"      AVISO: Falha ao salvar hashes de {campaign_id}: {e}")
+
+
+def archive_insights(client_id: str, campaign: Dict, insights: List[Dict]):
+    """Guarda os insights brutos no arquivo local (para --reclassify)"""
+    try:
+        sync_state.archive_insights(client_id, campaign.get('id'), campaign.get('name'),
+                                    campaign.get('objective'), insights)
+    except Exception as e:
+        print(f"      AVISO: Falha ao arquivar insights de {campaign.get('id')}: {e}")
+
+
+def report_campaign_totals(days: int, queued: int, unchanged: int):
+    """Resumo de uma campanha na janela (uma vez, mesmo quando os insights chegam em várias páginas)"""
+    if not days:
+        print(f"      AVISO: Nenhum insight encontrado")
+        return
+    print(f"      OK: {days} dia(s) de dados encontrados")
+    print(f"      OK: {queued} metrica(s) enfileirada(s) para gravacao, {unchanged} sem alteracao")
+
+
+def store_campaign_insights(client_id: str, campaign: Dict, insights: List[Dict],
+                            on_written: Optional[Callable[[], None]] = None,
+                            force_write: bool = False, archive: bool = True, report: bool = True) -> tuple:
+    """
+    Converte os insights diários de uma campanha e enfileira no buffer de escrita
+    só as linhas cujo hash de conteúdo mudou desde a última gravação
+    (force_write envia todas). on_written é chamado depois que as linhas forem
+    gravadas no Supabase. Com archive, os insights brutos vão para o arquivo local.
+    Sem report, o resumo fica para quem chamou (ex: uma página de várias).
+    
+    Retorna (linhas enfileiradas, linhas sem alteração).
+    """
+    campaign_id = campaign.get('id')
+    campaign_name = campaign.get('name', 'Sem nome')
+    
+    if insights and archive:
+        archive_insights(client_id, campaign, insights)
+    
+    if not insights:
+        if report:
+            report_campaign_totals(0, 0, 0)
+        if on_written:
+            on_written()
+        return 0, 0
+    
+    stored_hashes = {} if force_write else sync_state.get_metric_hashes(client_id, campaign_id)
+    
+    # Processar cada dia de insights
+    metrics_to_insert = []
+    new_hashes = {}
+    unchanged = 0
+    
+    with metrics.timer("transform"):
+        # Transformação colunar da página inteira; o resultado de cada dia vem de process_actions
+        # (bench_transform.py confere contra o caminho linha a linha original)
+        columns = transform_insights(insights, campaign.get('objective'), campaign_name)
+        for metric_data in metric_rows_from_columns(columns, client_id, campaign_id, campaign_name):
+            # Confere os tipos antes de enviar, para uma linha ruim não derrubar o lote inteiro
+            try:
+                metric_data = validate_metric_row(metric_data)
+            except InvalidRowError as e:
+                print(f"      AVISO: Metrica de {metric_data.get('data_referencia')} invalida, enviada ao dead-letter: {e}")
+                dead_letter.write(metric_data, e, "validacao")
+                metrics.inc("rows_rejected_total", stage="validacao")
+                continue
+            
+            content_hash = metric_row_hash(metric_data)
+            if stored_hashes.get(metric_data['data_referencia']) == content_hash:
+                unchanged += 1
+                continue
+            new_hashes[metric_data['data_referencia']] = content_hash
+            metrics_to_insert.append(metric_data)
+    
+    metrics.inc("insights_received_total", len(insights))
+    metrics.inc("rows_queued_total", len(metrics_to_insert))
+    metrics.inc("rows_unchanged_total", unchanged)
+    
+    def on_stored():
+        # Linhas recusadas pelo banco ficam sem hash: voltam a ser enviadas na próxima busca do dia
+        for day in take_rejected_days(client_id, campaign_id, list(new_hashes)):
+            del new_hashes[day]
+        if new_hashes:
+            save_metric_hashes(client_id, campaign_id, new_hashes)
+        if on_written:
+            on_written()
+    
+    metrics_buffer.add(metrics_to_insert, on_written=on_stored)
+    if report:
+        report_campaign_totals(len(insights), len(metrics_to_insert), unchanged)
+    return len(metrics_to_insert), unchanged
+
+
+def store_insight_pages(client_id: str, campaign: Dict, pages: Iterable[List[Dict]],
+                        force_write: bool = False) -> tuple:
+    """
+    Transforma e enfileira as páginas de insights de uma campanha à medida que
+    chegam. Retorna (linhas enfileiradas, linhas sem alteração).
+    """
+    days = queued = unchanged = 0
+    for page in pages:
+        if not page:
+            continue
+        days += len(page)
+        page_queued, page_unchanged = store_campaign_insights(client_id, campaign, page, force_write=force_write,
+                                                              report=False)
+        queued += page_queued
+        unchanged += page_unchanged
+    report_campaign_totals(days, queued, unchanged)
+    return queued, unchanged
+
+
+def store_account_page(client_id: str, listed: Dict[str, Dict], page: List[Dict], force_write: bool,
+                       delivered: set) -> tuple:
+    """
+    Grava uma página da listagem level=campaign (linhas de várias campanhas).
+    Campanhas que não vieram na listagem (ex: excluídas) entram com o nome da linha.
+    """
+    queued = unchanged = 0
+    for campaign_id, rows in group_by_campaign(page).items():
+        campaign = listed.get(campaign_id) or {
+            "id": campaign_id, "name": rows[0].get('campaign_name', 'Sem nome'), "status": "UNKNOWN"}
+        if campaign_id not in delivered:
+            delivered.add(campaign_id)
+            print(f"   Campanha: {campaign.get('name', 'Sem nome')} ({campaign.get('status', 'UNKNOWN')}) "
+                  f"- Obj: {campaign.get('objective')}")
+        # O resumo da listagem da conta sai no fim (uma linha [CONTA] por janela)
+        page_queued, page_unchanged = store_campaign_insights(client_id, campaign, rows, force_write=force_write,
+                                                              report=False)
+        queued += page_queued
+        unchanged += page_unchanged
+    return queued, unchanged
+
+
+def stream_account_insights(client_id: str, campaigns: List[Dict], ad_account_id: str, since_date: str,
+                            until_date: str, force_write: bool = False, consumers: Optional[int] = None) -> tuple:
+    """
+    Modo conta em streaming: cada página da listagem é transformada e enfileirada
+    enquanto a próxima é buscada, com no máximo STREAM_QUEUE_PAGES páginas em memória
+    (nas contas compartilhadas, a listagem é buscada uma vez para os consumers clientes).
+    Retorna (linhas enfileiradas, linhas sem alteração, ids das campanhas com dados).
+    """
+    listed = {c.get('id'): c for c in campaigns}
+    delivered: set = set()
+    queued = unchanged = 0
+    expected_rows = estimate_insight_rows(len(campaigns), since_date, until_date)
+    pages = shared_pages(ad_account_id, ("account_insights", since_date, until_date),
+                         partial(iter_account_insight_pages, ad_account_id, since_date, until_date, expected_rows),
+                         consumers)
+    for page in pages:
+        page_queued, page_unchanged = store_account_page(client_id, listed, page, force_write, delivered)
+        queued += page_queued
+        unchanged += page_unchanged
+    return queued, unchanged, delivered
+
+
+def sync_client_metrics(client_id: str, client_name: str, ad_account_id: str, fetch_mode: str = "campaign",
+                        full_refresh: bool = False, prefilter: bool = True, force_write: bool = False) -> bool:
+    """
+    Sincroniza um cliente, com as métricas da execução atribuídas a ele
+    (no modo worker, só se conseguir o lease do cliente).
+    Retorna True se nenhuma campanha falhou.
+    """
+    if not claim_client(client_id, client_name):
+        return False
+    started = time.monotonic()
+    with metrics.client_scope(client_id, client_name):
+        try:
+            return _sync_client_metrics(client_id, client_name, ad_account_id, fetch_mode, full_refresh,
+                                        prefilter, force_write)
+        finally:
+            metrics.observe("client_seconds", time.monotonic() - started)
+            release_client(client_id)
+
+
+def _sync_client_metrics(client_id: str, client_name: str, ad_account_id: str, fetch_mode: str = "campaign",
+                         full_refresh: bool = False, prefilter: bool = True, force_write: bool = False) -> bool:
+    """
+    Sincroniza métricas de todas as campanhas de um cliente.
+    Por padrão busca só as janelas incrementais devidas (ver sync_state.REFRESH_TIERS);
+    full_refresh ignora os watermarks e busca a janela completa.
+    Com prefilter, só campanhas com veiculação na janela recebem requisição de insights.
+    Linhas sem alteração (mesmo hash de conteúdo) não são regravadas, exceto com force_write.
+    """
+    if unit_completed("client", client_id):
+        print(f"\nCliente {client_name} ja concluido nesta execucao. Pulando...")
+        return True
+    
+    if not within_budget(BUDGET_CLIENT_REQUESTS):
+        time_budget.defer(client_name)
+        return False
+    
+    print(f"\nProcessando cliente: {client_name} ({ad_account_id})")
+    
+    try:
+        if (fetch_mode == "account" and time_budget is not None and not time_budget.priority_pass
+                and not older_tiers_due(client_id, ad_account_id, full_refresh)):
+            print("   [CONTA] Dias anteriores em dia; nada alem da passada prioritaria")
+            return True
+        
+        # Na segunda passada do --time-budget, listagem e sondagem vêm da primeira
+        listing = budget_listings.get(client_id) if time_budget is not None else None
+        if listing is None:
+            # Buscar campanhas (sem arquivadas/excluídas quando há pré-filtro)
+            campaigns = get_campaigns(ad_account_id, LISTED_EFFECTIVE_STATUSES if prefilter else None, full_refresh)
+            print(f"   Encontradas {len(campaigns)} campanha(s)")
+            skipped_campaigns = 0
+            if fetch_mode != "account" and prefilter:
+                # Sondagem de veiculação: uma requisição por conta no lugar de uma por campanha parada
+                campaigns, skipped_campaigns = filter_delivering_campaigns(campaigns, get_delivering_campaigns(ad_account_id))
+            if time_budget is not None:
+                budget_listings[client_id] = (campaigns, skipped_campaigns)
+        else:
+            campaigns, skipped_campaigns = listing
+            print(f"   {len(campaigns)} campanha(s) da passada anterior (sem nova listagem)")
+        
+        total_insights = 0
+        total_unchanged = 0
+        failed_campaigns = 0
+        failed_flushes_before = metrics_buffer.failed_flushes
+        account_tiers = None
+        deferred_campaigns = 0
+        
+        if fetch_mode == "account":
+            # Modo conta: uma única listagem paginada, gravada página a página à medida que chega
+            since_date, until_date, account_tiers = plan_window(client_id, ad_account_id, full_refresh)
+            total_insights, total_unchanged, delivered = stream_account_insights(
+                client_id, campaigns, ad_account_id, since_date, until_date, force_write)
+            skipped_campaigns = len({c.get('id') for c in campaigns} - delivered)
+            print(f"   [CONTA] {total_insights + total_unchanged} linha(s) para {len(delivered)} campanha(s) "
+                  f"com veiculacao ({since_date} a {until_date})")
+            processed_campaigns = len(delivered)
+            # Já gravadas durante a listagem: nada a buscar por campanha
+            campaigns = []
+        else:
+            processed_campaigns = len(campaigns)
+        
+        if prefilter:
+            print(f"   {processed_campaigns} campanha(s) com veiculacao na janela, {skipped_campaigns} pulada(s)")
+        
+        if not processed_campaigns and not skipped_campaigns:
+            if listing is None:
+                log_error(client_id, "sync_meta_metrics", "warning", 
+                         f"Nenhuma campanha encontrada para {client_name}",
+                         {"ad_account_id": ad_account_id})
+            mark_unit_done_if_written("client", client_id, metrics_buffer.failed_flushes)
+            return True
+        
+        campaigns = pending_campaigns(client_id, campaigns)
+        if time_budget is not None:
+            campaigns = budget_campaigns(client_id, campaigns, full_refresh)
+        
+        # No modo batch, as requisições por campanha são agrupadas em chamadas batch e
+        # as páginas de cada campanha são gravadas à medida que as respostas chegam
+        if fetch_mode == "batch" and campaigns and not within_budget(-(-len(campaigns) // BATCH_MAX_REQUESTS)):
+            time_budget.defer(client_name, len(campaigns))
+            deferred_campaigns = len(campaigns)
+            campaigns = []
+        if fetch_mode == "batch":
+            batch_tiers, events = iter_campaign_insights_batched_by_window(
+                client_id, [c.get('id') for c in campaigns], ad_account_id, full_refresh)
+            total_insights, total_unchanged, failed = store_batched_insights(
+                client_id, campaigns, batch_tiers, events, force_write)
+            failed_campaigns = len(failed)
+            campaigns = []
+        
+        # Processar cada campanha
+        for campaign in campaigns:
+            campaign_id = campaign.get('id')
+            campaign_name = campaign.get('name', 'Sem nome')
+            campaign_status = campaign.get('status', 'UNKNOWN')
+            
+            # Pular campanhas arquivadas se desejar otimizar mais
+            # if campaign_status == 'ARCHIVED': continue
+            
+            if fetch_mode == "campaign" and not within_budget(1):
+                time_budget.defer(client_name, 1)
+                deferred_campaigns += 1
+                continue
+            
+            print(f"   Campanha: {campaign_name} ({campaign_status}) - Obj: {campaign.get('objective')}")
+            
+            try:
+                campaign_failed_flushes = metrics_buffer.failed_flushes
+                
+                # Buscar insights históricos (janela incremental); cada página é
+                # transformada e enfileirada enquanto a próxima é buscada
+                since_date, until_date, tiers = plan_window(client_id, campaign_id, full_refresh)
+                pages = shared_pages(ad_account_id, ("campaign_insights", campaign_id, since_date, until_date),
+                                     partial(iter_campaign_insight_pages, campaign_id, since_date, until_date,
+                                             ad_account_id))
+                
+                queued, unchanged = store_insight_pages(client_id, campaign, pages, force_write)
+                total_insights += queued
+                total_unchanged += unchanged
+                
+                # O watermark da campanha só avança depois que o buffer gravar todas as páginas
+                if tiers:
+                    metrics_buffer.add([], on_written=partial(mark_refreshed_if_written, client_id, campaign_id,
+                                                              tiers, campaign_failed_flushes))
+                metrics_buffer.add([], on_written=partial(mark_unit_done_if_written, "campaign",
+                                                          f"{client_id}:{campaign_id}", campaign_failed_flushes))
+                
+            except MetaAbortError:
+                raise
+            except Exception as e:
+                failed_campaigns += 1
+                error_msg = f"Erro ao processar campanha {campaign_name}: {str(e)}"
+                print(f"      ERRO: {error_msg}")
+                log_error(client_id, "sync_meta_metrics", "error", error_msg,
+                         {"campaign_id": campaign_id, "campaign_name": campaign_name})
+        
+        # No modo conta o watermark é da conta inteira: só avança se nada falhou
+        # (nem a busca nem a gravação, que pode acontecer depois, em outro flush)
+        if account_tiers and not failed_campaigns:
+            metrics_buffer.add([], on_written=partial(mark_refreshed_if_written, client_id, ad_account_id,
+                                                      account_tiers, failed_flushes_before))
+        
+        # Cliente concluído nesta execução (--resume pula) só se todas as campanhas foram gravadas
+        if not failed_campaigns and not deferred_campaigns:
+            metrics_buffer.add([], on_written=partial(mark_unit_done_if_written, "client", client_id,
+                                                      failed_flushes_before))
+        
+        # ----------------------------------------------------------------
+        # 4. ATUALIZAÇÃO NÍVEL CONTA (Alcance/Impressões 30d REAIS)
+        # (com --time-budget, só na passada prioritária e se couber no prazo)
+        # ----------------------------------------------------------------
+        if time_budget is None or (time_budget.priority_pass and within_budget(1)):
+            update_account_totals(client_id, ad_account_id)
+
+        # Log de sucesso (com --time-budget, um só por cliente depois de todas as passadas)
+        result = {"campaigns_processed": processed_campaigns, "campaigns_skipped": skipped_campaigns,
+                  "insights_processed": total_insights, "insights_unchanged": total_unchanged,
+                  "campaigns_deferred": deferred_campaigns, "fetch_mode": fetch_mode}
+        if time_budget is None:
+            report_client_result(client_id, client_name, result)
+        else:
+            add_budget_result(client_id, client_name, result)
+            print(f"   Passada {time_budget.pass_label}: {total_insights} metrica(s) enviada(s), "
+                  f"{total_unchanged} sem alteracao")
+        return not failed_campaigns and not deferred_campaigns
+        
+    except MetaAbortError:
+        raise
+    except Exception as e:
+        error_msg = f"Erro ao sincronizar cliente {client_name}: {str(e)}"
+        print(f"   ERRO: {error_msg}")
+        log_error(client_id, "sync_meta_metrics", "error", error_msg,
+                 {"ad_account_id": ad_account_id})
+        budget_results.pop(client_id, None)
+        return False
+
+
+def reclassify_archive(client_ids: Optional[List[str]] = None, force_write: bool = False) -> tuple:
+    """
+    Recalcula resultado_valor/resultado_nome a partir do arquivo de insights
+    brutos, sem chamar o Meta: cada dia passa de novo por process_actions com o
+    objetivo e o nome arquivados da campanha. Pelo hash de conteúdo, só as linhas
+    cujo resultado mudou são regravadas. Retorna (linhas enviadas, sem alteração).
+    """
+    total_queued = 0
+    total_unchanged = 0
+    campaigns = 0
+    
+    for client_id, campaign_id, campaign_name, objective, insights in sync_state.iter_archived_campaigns(client_ids):
+        campaigns += 1
+        print(f"   Campanha: {campaign_name} ({campaign_id}) - Obj: {objective}")
+        # Mesmo caminho da sincronização: transform_insights -> process_actions(objetivo, nome)
+        queued, unchanged = store_campaign_insights(
+            client_id, {"id": campaign_id, "name": campaign_name or 'Sem nome', "objective": objective},
+            insights, force_write=force_write, archive=False)
+        total_queued += queued
+        total_unchanged += unchanged
+    
+    metrics_buffer.flush()
+    print(f"\nOK: Reclassificacao de {campaigns} campanha(s): {total_queued} metrica(s) alterada(s), "
+          f"{total_unchanged} sem alteracao")
+    return total_queued, total_unchanged
+
+
+# ----------------------------------------------------------------
+# BACKFILL HISTÓRICO (--backfill since..until)
+# O período é dividido em janelas; cada janela de cada cliente é uma listagem
+# level=campaign da conta (modo account em streaming). As janelas rodam em
+# paralelo em threads, com o ritmo controlado pelo governador de taxa, e as
+# concluídas ficam registradas em sync_state para o comando poder ser retomado.
+# ----------------------------------------------------------------
+
+# O Meta só devolve insights dos últimos 37 meses
+META_MAX_HISTORY_MONTHS = 37
+BACKFILL_WINDOW_DAYS = 30
+BACKFILL_WORKERS = 4
+
+
+def oldest_available_date(today: Optional[date] = None) -> date:
+    """Primeiro dia aceito pelo Meta (hoje - 37 meses)"""
+    today = today or date.today()
+    months = today.year * 12 + today.month - 1 - META_MAX_HISTORY_MONTHS
+    year, month = divmod(months, 12)
+    return date(year, month + 1, min(today.day, 28))
+
+
+def parse_backfill_range(value: str) -> tuple:
+    """
+    "YYYY-MM-DD..YYYY-MM-DD" (until opcional = hoje) -> (since, until) como date.
+    O início é limitado aos 37 meses que o Meta mantém.
+    """
+    since_str, sep, until_str = value.partition("..")
+    if not sep:
+        raise argparse.ArgumentTypeError("use o formato since..until (ex: 2023-10-01..2026-10-01)")
     try:
-        log_data = {
-            "client_id": client_id,
-            "tipo": tipo,
-            "status": status,
-            "mensagem": mensagem,
-            "meta": meta or {}
-        }
-        supabase.table("logs").insert(log_data).execute()
+        since = date.fromisoformat(since_str.strip())
+        until = date.fromisoformat(until_str.strip()) if until_str.strip() else date.today()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"data invalida em '{value}' (use YYYY-MM-DD)")
+    
+    until = min(until, date.today())
+    oldest = oldest_available_date()
+    if since < oldest:
+        print(f"AVISO: O Meta guarda só {META_MAX_HISTORY_MONTHS} meses de insights; backfill a partir de {oldest}")
+        since = oldest
+    if since > until:
+        raise argparse.ArgumentTypeError(f"periodo vazio: {since}..{until}")
+    return since, until
+
+
+def mark_window_done_if_written(client_id: str, since_date: str, until_date: str, rows: int,
+                                failed_flushes_before: int):
+    """Callback pós-gravação: registra o checkpoint da janela se nenhum flush falhou"""
+    if metrics_buffer.failed_flushes != failed_flushes_before:
+        return
+    try:
+        sync_state.mark_window_completed(client_id, since_date, until_date, rows)
     except Exception as e:
-        print(f"Erro ao registrar log: {str(e)}")
+        print(f"      AVISO: Falha ao registrar checkpoint {since_date}..{until_date}: {e}")
+
 
+def backfill_window(client_id: str, client_name: str, ad_account_id: str, campaigns: List[Dict],
+                    since_date: str, until_date: str, force_write: bool = False, consumers: int = 1) -> int:
+    """
+    Busca e grava uma janela de um cliente; retorna as linhas recebidas
+    (consumers: clientes da mesma conta com esta janela pendente, que recebem a mesma listagem)
+    """
+    failed_flushes_before = metrics_buffer.failed_flushes
+    with metrics.client_scope(client_id, client_name):
+        queued, unchanged, delivered = stream_account_insights(
+            client_id, campaigns, ad_account_id, since_date, until_date, force_write, consumers)
+    rows = queued + unchanged
+    print(f"   [BACKFILL] {client_name} {since_date}..{until_date}: {rows} linha(s), "
+          f"{len(delivered)} campanha(s) ({queued} enviada(s), {unchanged} sem alteracao)")
+    metrics_buffer.add([], on_written=partial(mark_window_done_if_written, client_id, since_date, until_date,
+                                              rows, failed_flushes_before))
+    return rows
 
-def make_meta_request(url: str, params: Dict) -> Optional[Dict]:
+
+def run_backfill(jobs: List[tuple], since: date, until: date, window_days: int = BACKFILL_WINDOW_DAYS,
+                 workers: int = BACKFILL_WORKERS, force_write: bool = False):
     """
-    Faz requisição à API do Meta com retry e tratamento de rate limits
+    Backfill histórico de vários clientes: janelas pendentes em paralelo, com
+    checkpoint por janela concluída e progresso (linhas/s e ETA) a cada janela.
+    jobs: lista de (client_id, client_name, conta_anuncio)
     """
-    for attempt in range(MAX_RETRIES):
+    windows = split_windows(since, until, window_days)
+    units = []
+    for client_id, client_name, ad_account_id in jobs:
+        done = sync_state.get_completed_windows(client_id)
+        pending = [w for w in windows if w not in done]
+        if len(pending) < len(windows):
+            print(f"   {client_name}: {len(windows) - len(pending)} janela(s) ja concluida(s), {len(pending)} pendente(s)")
+        if not pending:
+            continue
+        # Todas as campanhas (inclusive arquivadas) para nome/objetivo; uma listagem por cliente
+        with metrics.client_scope(client_id, client_name):
+            campaigns = get_campaigns(ad_account_id)
+        units.extend((client_id, client_name, ad_account_id, campaigns, w_since, w_until) for w_since, w_until in pending)
+    
+    # Contas compartilhadas: cada janela é buscada uma vez e entregue aos clientes da conta
+    # que a têm pendente; as janelas da mesma conta ficam juntas para o resultado durar pouco
+    consumers: Dict[tuple, int] = {}
+    for _, _, ad_account_id, _, w_since, w_until in units:
+        consumers[(ad_account_id, w_since, w_until)] = consumers.get((ad_account_id, w_since, w_until), 0) + 1
+    if shared_accounts:
+        units.sort(key=lambda unit: (unit[4], unit[2]))
+    
+    print(f"\nBackfill {since}..{until}: {len(units)} janela(s) de ate {window_days} dia(s) "
+          f"para {len(jobs)} cliente(s), {workers} em paralelo")
+    if not units:
+        return
+    
+    started = time.time()
+    completed = failed = total_rows = 0
+    
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(backfill_window, client_id, client_name, ad_account_id, campaigns,
+                            w_since, w_until, force_write, consumers[(ad_account_id, w_since, w_until)]):
+                (client_id, client_name, w_since, w_until)
+            for client_id, client_name, ad_account_id, campaigns, w_since, w_until in units
+        }
         try:
-            response = requests.get(url, params=params, timeout=30)
-            
-            # Rate limit - aguardar e tentar novamente
-            if response.status_code == 429:
-                retry_after = int(response.headers.get('Retry-After', 60))
-                print(f"Rate limit atingido. Aguardando {retry_after} segundos...")
-                time.sleep(retry_after)
-                continue
-            
-            # Erro de autenticação
-            if response.status_code == 401:
-                error_data = response.json()
-                raise Exception(f"Token inválido: {error_data.get('error', {}).get('message', 'Erro desconhecido')}")
+            for future in as_completed(futures):
+                client_id, client_name, w_since, w_until = futures[future]
+                try:
+                    total_rows += future.result()
+                    completed += 1
+                except MetaAbortError:
+                    raise
+                except Exception as e:
+                    failed += 1
+                    error_msg = f"Erro no backfill de {client_name} ({w_since}..{w_until}): {str(e)}"
+                    print(f"   ERRO: {error_msg}")
+                    log_error(client_id, "sync_meta_metrics", "error", error_msg,
+                              {"backfill_since": w_since, "backfill_until": w_until})
+                
+                elapsed = time.time() - started
+                finished = completed + failed
+                eta = elapsed / finished * (len(units) - finished)
+                print(f"   [BACKFILL] {finished}/{len(units)} janela(s) | {total_rows} linha(s) | "
+                      f"{total_rows / elapsed:.0f} linhas/s | ETA {timedelta(seconds=int(eta))}")
+        except MetaAbortError:
+            for pending_future in futures:
+                pending_future.cancel()
+            raise
+    
+    # Checkpoints das últimas janelas dependem do flush final
+    metrics_buffer.flush()
+    single_flight.clear()
+    print(f"OK: Backfill concluido: {completed} janela(s), {failed} com erro, {total_rows} linha(s) "
+          f"em {timedelta(seconds=int(time.time() - started))}")
+
+
+# ----------------------------------------------------------------
+# MOTOR ASSÍNCRONO (asyncio + httpx)
+# Mesmo resultado de sync_client_metrics, mas clientes e campanhas são
+# sincronizados em paralelo, respeitando um limite global e um limite por
+# conta de anúncios. As gravações no Supabase (cliente síncrono) rodam em
+# threads via asyncio.to_thread para não bloquear o loop.
+# ----------------------------------------------------------------
+
+class AsyncLimits:
+    """Semáforos de concorrência: um global e um por conta de anúncios"""
+    
+    def __init__(self, concurrency: int, account_concurrency: int):
+        self.global_sem = asyncio.Semaphore(concurrency)
+        self.account_concurrency = account_concurrency
+        self.account_sems: Dict[str, asyncio.Semaphore] = {}
+    
+    def for_account(self, ad_account_id: str) -> asyncio.Semaphore:
+        if ad_account_id not in self.account_sems:
+            self.account_sems[ad_account_id] = asyncio.Semaphore(self.account_concurrency)
+        return self.account_sems[ad_account_id]
+
+
+async def make_meta_request_async(http: httpx.AsyncClient, limits: AsyncLimits, ad_account_id: str,
+                                  url: str, params: Dict) -> Optional[Dict]:
+    """
+    Versão assíncrona de make_meta_request (mesma classificação de erros e retry)
+    """
+    attempt = 0
+    delay = None
+    endpoint = meta_endpoint(url, params)
+    
+    while True:
+        attempt += 1
+        try:
+            waited = time.monotonic()
+            await governor.wait_async(ad_account_id)
+            metrics.inc("rate_limit_wait_seconds_total", time.monotonic() - waited)
+            async with limits.for_account(ad_account_id), limits.global_sem:
+                started = time.monotonic()
+                response = await http.get(url, params=params)
+            governor.observe(response.headers, ad_account_id)
+            record_meta_response(endpoint, response.status_code, len(response.content), time.monotonic() - started)
             
-            # Outros erros HTTP
-            if response.status_code != 200:
-                error_data = response.json() if response.content else {}
-                raise Exception(f"Erro HTTP {response.status_code}: {error_data.get('error', {}).get('message', 'Erro desconhecido')}")
+            if response.status_code == 200:
+                return response.json()
             
-            return response.json()
+            error = error_from_response(response.status_code, response_payload(response), response.headers)
             
-        except requests.exceptions.RequestException as e:
-            if attempt == MAX_RETRIES - 1:
-                raise Exception(f"Erro na requisição após {MAX_RETRIES} tentativas: {str(e)}")
-            time.sleep(2 ** attempt)  # Backoff exponencial
-    
-    return None
+        except httpx.RequestError as e:
+            record_meta_response(endpoint, "error", 0, time.monotonic() - started)
+            error = MetaAPIError(f"Erro na requisição: {str(e)}", RETRY)
+        
+        delay = retry_policy.next_delay(error, attempt, delay)
+        if delay is not None:
+            metrics.inc("retries_total", endpoint=endpoint, reason="throttled" if error.throttled else "transient")
+        if delay is None:
+            if error.decision == RETRY:
+                raise MetaAPIError(f"{error} (após {attempt} tentativa(s))", SKIP, error.status, error.code, error.subcode)
+            raise error
+        
+        if error.throttled:
+            # Throttling: pausa só esta conta, as demais seguem
+            print(f"Rate limit atingido ({ad_account_id}). Aguardando {delay:.0f} segundos...")
+            governor.pause(ad_account_id, delay)
+        else:
+            await asyncio.sleep(delay)
 
 
-def get_campaigns(ad_account_id: str) -> List[Dict]:
+async def iter_pages_async(http: httpx.AsyncClient, limits: AsyncLimits, ad_account_id: str,
+                           url: str, params: Dict) -> AsyncIterator[List[Dict]]:
     """
-    Busca todas as campanhas de uma conta de anúncios
+    Percorre a paginação do Graph API entregando o campo data de cada página;
+    a próxima página só é pedida quando o consumidor termina a atual
     """
-    url = f"{META_BASE_URL}/{ad_account_id}/campaigns"
-    params = {
-        "access_token": META_ACCESS_TOKEN,
-        "fields": "id,name,status,created_time,objective",
-        "limit": 100
-    }
-    
-    campaigns = []
     next_url = url
     
     while next_url:
-        time.sleep(REQUEST_DELAY)
-        data = make_meta_request(next_url, params if next_url == url else {})
+        data = await make_meta_request_async(http, limits, ad_account_id, next_url, params if next_url == url else {})
         
         if not data:
             break
         
-        campaigns.extend(data.get('data', []))
+        yield data.get('data', [])
         
-        # Paginação
-        paging = data.get('paging', {})
-        next_url = paging.get('next')
-        if next_url:
-            # Remove access_token dos params pois já está na URL
-            params = {}
-    
-    return campaigns
+        # Paginação (o link next já traz o access_token)
+        next_url = data.get('paging', {}).get('next')
 
 
-def get_campaign_insights(campaign_id: str, since_date: Optional[str] = None, until_date: Optional[str] = None) -> List[Dict]:
+async def fetch_all_pages_async(http: httpx.AsyncClient, limits: AsyncLimits, ad_account_id: str,
+                                url: str, params: Dict) -> List[Dict]:
     """
-    Busca insights históricos de uma campanha
+    Percorre a paginação do Graph API acumulando o campo data de cada página
     """
-    if not until_date:
-        until_date = datetime.now().strftime("%Y-%m-%d")
-    
-        # Meta tem limite de 37 meses para insights
-        # Usamos 30 dias para garantir dados recentes e performance rápida (solicitação do usuário)
-        # (Execução pontual de 90 dias feita para limpeza)
-        since_date = (datetime.now() - timedelta(days=30)).strftime("%Y-%m-%d")
+    items = []
+    async for page in iter_pages_async(http, limits, ad_account_id, url, params):
+        items.extend(page)
+    return items
+
+
+async def refresh_campaign_catalog_async(http: httpx.AsyncClient, limits: AsyncLimits, ad_account_id: str,
+                                         full_refresh: bool = False) -> List[Dict]:
+    """Versão async de refresh_campaign_catalog"""
+    url = f"{META_BASE_URL}/{ad_account_id}/campaigns"
+    catalog, params, full = await asyncio.to_thread(campaign_catalog_plan, ad_account_id, full_refresh)
+    listed_at = time.time()
+    try:
+        with metrics.timer("campaigns"):
+            listed = await fetch_all_pages_async(http, limits, ad_account_id, url, params)
+    except MetaAbortError:
+        raise
+    except MetaAPIError as e:
+        if full:
+            raise
+        print(f"   AVISO: Listagem incremental de campanhas falhou ({str(e)}); listando todas")
+        full, listed_at = True, time.time()
+        with metrics.timer("campaigns"):
+            listed = await fetch_all_pages_async(http, limits, ad_account_id, url, campaigns_params())
+    campaigns = await asyncio.to_thread(merge_campaign_catalog, ad_account_id, catalog, listed, listed_at, full)
+    if full:
+        return campaigns
+    with metrics.timer("campaigns"):
+        statuses = await fetch_all_pages_async(http, limits, ad_account_id, url, campaign_statuses_params())
+    return await asyncio.to_thread(apply_campaign_statuses, ad_account_id, campaigns, statuses, listed_at)
+
+
+async def collect_pages_async(http: httpx.AsyncClient, limits: AsyncLimits, ad_account_id: str,
+                              url: str, params: Dict) -> List[List[Dict]]:
+    """Todas as páginas de uma listagem, separadas (para entregar a mais de um cliente)"""
+    return [page async for page in iter_pages_async(http, limits, ad_account_id, url, params)]
+
+
+async def shared_fetch_async(ad_account_id: str, key: tuple, fetch: Callable[[], Awaitable]):
+    """Versão async de shared_fetch: fetch devolve a corrotina da busca"""
+    if ad_account_id not in shared_accounts:
+        return await fetch()
+    return await single_flight.do_async(ad_account_id, key, fetch, shared_accounts[ad_account_id])
+
+
+async def shared_pages_async(http: httpx.AsyncClient, limits: AsyncLimits, ad_account_id: str, key: tuple,
+                             url: str, params: Dict) -> AsyncIterator[List[Dict]]:
+    """Versão async de shared_pages: página a página, ou buscadas uma vez nas contas compartilhadas"""
+    if ad_account_id not in shared_accounts:
+        async for page in iter_pages_async(http, limits, ad_account_id, url, params):
+            yield page
+        return
+    for page in await shared_fetch_async(ad_account_id, key,
+                                         partial(collect_pages_async, http, limits, ad_account_id, url, params)):
+        yield page
+
+
+async def get_delivering_campaigns_async(http: httpx.AsyncClient, limits: AsyncLimits, ad_account_id: str,
+                                         since_date: str, until_date: str) -> Dict[str, str]:
+    """Versão async de get_delivering_campaigns"""
+    with metrics.timer("probe"):
+        probe = await fetch_all_pages_async(http, limits, ad_account_id, f"{META_BASE_URL}/{ad_account_id}/insights",
+                                            delivery_probe_params(since_date, until_date))
+    return {row['campaign_id']: row.get('campaign_name', 'Sem nome') for row in probe if row.get('campaign_id')}
+
+
+async def sync_campaign_async(http: httpx.AsyncClient, limits: AsyncLimits, client_id: str, client_name: str,
+                              ad_account_id: str, campaign: Dict,
+                              full_refresh: bool = False, force_write: bool = False) -> Optional[tuple]:
+    """
+    Busca e grava os insights de uma campanha, página a página.
+    Retorna (métricas enviadas, métricas sem alteração), ou None se a campanha falhou.
+    """
+    campaign_id = campaign.get('id')
+    campaign_name = campaign.get('name', 'Sem nome')
     
-    url = f"{META_BASE_URL}/{campaign_id}/insights"
-    params = {
-        "access_token": META_ACCESS_TOKEN,
-        "fields": "date_start,date_stop,spend,impressions,reach,clicks,actions",
-        "time_range": json.dumps({"since": since_date, "until": until_date}),
-        "time_increment": 1,  # Dados diários
-        "limit": 100
-    }
+    try:
+        campaign_failed_flushes = metrics_buffer.failed_flushes
+        
+        print(f"   [{client_name}] Campanha: {campaign_name} ({campaign.get('status', 'UNKNOWN')}) - Obj: {campaign.get('objective')}")
+        since_date, until_date, tiers = await asyncio.to_thread(plan_window, client_id, campaign_id, full_refresh)
+        days = queued = unchanged = 0
+        pages = shared_pages_async(http, limits, ad_account_id,
+                                   ("campaign_insights", campaign_id, since_date, until_date),
+                                   f"{META_BASE_URL}/{campaign_id}/insights",
+                                   campaign_insights_params(since_date, until_date))
+        async for page in metrics.timed_pages_async("insights", pages):
+            if not page:
+                continue
+            days += len(page)
+            page_queued, page_unchanged = await asyncio.to_thread(
+                store_campaign_insights, client_id, campaign, page, force_write=force_write, report=False)
+            queued += page_queued
+            unchanged += page_unchanged
+        report_campaign_totals(days, queued, unchanged)
+        totals = (queued, unchanged)
+        
+        # O watermark da campanha só avança depois que o buffer gravar todas as páginas
+        if tiers:
+            await asyncio.to_thread(metrics_buffer.add, [],
+                                    partial(mark_refreshed_if_written, client_id, campaign_id,
+                                            tiers, campaign_failed_flushes))
+        await asyncio.to_thread(metrics_buffer.add, [],
+                                partial(mark_unit_done_if_written, "campaign", f"{client_id}:{campaign_id}",
+                                        campaign_failed_flushes))
+        return totals
+        
+    except MetaAbortError:
+        raise
+    except Exception as e:
+        error_msg = f"Erro ao processar campanha {campaign_name}: {str(e)}"
+        print(f"      ERRO [{client_name}]: {error_msg}")
+        await asyncio.to_thread(log_error, client_id, "sync_meta_metrics", "error", error_msg,
+                                {"campaign_id": campaign_id, "campaign_name": campaign_name})
+        return None
+
+
+async def sync_client_metrics_async(http: httpx.AsyncClient, limits: AsyncLimits, client_id: str,
+                                    client_name: str, ad_account_id: str, fetch_mode: str = "campaign",
+                                    full_refresh: bool = False, prefilter: bool = True, force_write: bool = False):
+    """
+    Sincroniza um cliente (motor async), com as métricas da execução atribuídas
+    a ele (no modo worker, só se conseguir o lease do cliente)
+    """
+    if not await asyncio.to_thread(claim_client, client_id, client_name):
+        return
+    started = time.monotonic()
+    with metrics.client_scope(client_id, client_name):
+        try:
+            await _sync_client_metrics_async(http, limits, client_id, client_name, ad_account_id, fetch_mode,
+                                             full_refresh, prefilter, force_write)
+        finally:
+            metrics.observe("client_seconds", time.monotonic() - started)
+            await asyncio.to_thread(release_client, client_id)
+
+
+async def _sync_client_metrics_async(http: httpx.AsyncClient, limits: AsyncLimits, client_id: str,
+                                     client_name: str, ad_account_id: str, fetch_mode: str = "campaign",
+                                     full_refresh: bool = False, prefilter: bool = True, force_write: bool = False):
+    """
+    Versão assíncrona de sync_client_metrics: campanhas do cliente em paralelo
+    """
+    if unit_completed("client", client_id):
+        print(f"\nCliente {client_name} ja concluido nesta execucao. Pulando...")
+        return
     
-    insights = []
-    next_url = url
+    print(f"\nProcessando cliente: {client_name} ({ad_account_id})")
     
-    while next_url:
-        time.sleep(REQUEST_DELAY)
-        data = make_meta_request(next_url, params if next_url == url else {})
+    try:
+        catalog = await shared_fetch_async(
+            ad_account_id, ("campaign_catalog",),
+            partial(refresh_campaign_catalog_async, http, limits, ad_account_id, full_refresh))
+        campaigns = filter_campaign_statuses(catalog, LISTED_EFFECTIVE_STATUSES if prefilter else None)
+        print(f"   [{client_name}] Encontradas {len(campaigns)} campanha(s)")
         
-        if not data:
-            break
+        account_tiers = None
+        skipped_campaigns = 0
+        account_totals = (0, 0)
+        failed_flushes_before = metrics_buffer.failed_flushes
+        if fetch_mode == "account":
+            # Listagem da conta gravada página a página à medida que chega
+            since_date, until_date, account_tiers = await asyncio.to_thread(
+                plan_window, client_id, ad_account_id, full_refresh)
+            listed = {c.get('id'): c for c in campaigns}
+            if estimate_insight_rows(len(campaigns), since_date, until_date) >= REPORT_RUN_MIN_ROWS:
+                # Conta grande: relatório assíncrono, esperado em uma thread junto com os das outras contas
+                queued, unchanged, delivered = await asyncio.to_thread(
+                    stream_account_insights, client_id, campaigns, ad_account_id, since_date, until_date, force_write)
+            else:
+                delivered = set()
+                queued = unchanged = 0
+                pages = shared_pages_async(http, limits, ad_account_id, ("account_insights", since_date, until_date),
+                                           f"{META_BASE_URL}/{ad_account_id}/insights",
+                                           account_insights_params(since_date, until_date))
+                async for page in metrics.timed_pages_async("insights", pages):
+                    page_queued, page_unchanged = await asyncio.to_thread(
+                        store_account_page, client_id, listed, page, force_write, delivered)
+                    queued += page_queued
+                    unchanged += page_unchanged
+            account_totals = (queued, unchanged)
+            skipped_campaigns = len(set(listed) - delivered)
+            print(f"   [{client_name}] [CONTA] {queued + unchanged} linha(s) para {len(delivered)} campanha(s) "
+                  f"com veiculacao ({since_date} a {until_date})")
+            processed_campaigns = len(delivered)
+            campaigns = []
+        else:
+            if prefilter:
+                since_date, until_date = resolve_window()
+                delivering = await shared_fetch_async(
+                    ad_account_id, ("delivery", since_date, until_date),
+                    partial(get_delivering_campaigns_async, http, limits, ad_account_id, since_date, until_date))
+                campaigns, skipped_campaigns = filter_delivering_campaigns(campaigns, delivering)
+            processed_campaigns = len(campaigns)
         
-        insights.extend(data.get('data', []))
+        if prefilter:
+            print(f"   [{client_name}] {processed_campaigns} campanha(s) com veiculacao na janela, {skipped_campaigns} pulada(s)")
         
-        # Paginação
-        paging = data.get('paging', {})
-        next_url = paging.get('next')
-        if next_url:
-            params = {}
-    
-    return insights
-
-
-def process_actions(actions: List[Dict], objective: str = None, campaign_name: str = "", insight_data: Dict = None) -> tuple:
-    """
-    Processa array de ações e retorna (resultado_valor, resultado_nome)
-    
-    NOVA LÓGICA GERAL:
-    Independente do objetivo, procuramos as métricas reais que o cliente considera como "Lead".
-    - Conversas de mensagem
-    - Formulários de lead / site lead
-    - Compras (purchases)
-    """
-    if not actions:
-        return (0.0, None)
-    
-    action_map = {a.get('action_type'): float(a.get('value', 0)) for a in actions}
-    
-    # 1. Cadastros/Formulários (Super Prioridade)
-    if 'lead' in action_map:
-        return (action_map['lead'], 'lead')
-    if 'leads' in action_map:
-        return (action_map['leads'], 'leads')
-        
-    # 2. Início de Conversa (Mensagens)
-    # Procuramos variáveis consolidadas no Meta:
-    msg_keys = [
-        'onsite_conversion.messaging_conversation_started_7d',
-        'onsite_conversion.messaging_conversation_started_1d',
-        'omnichannel_messaging_conversation_started_7d',
-        'omnichannel_messaging_conversation_started',
-        'onsite_conversion.messaging_first_reply'
-    ]
-    for key in msg_keys:
-        if key in action_map:
-            return (action_map[key], key)
-            
-    # 3. Compras
-    if 'purchase' in action_map:
-        return (action_map['purchase'], 'purchase')
+        if not processed_campaigns and not skipped_campaigns:
+            await asyncio.to_thread(log_error, client_id, "sync_meta_metrics", "warning",
+                                    f"Nenhuma campanha encontrada para {client_name}",
+                                    {"ad_account_id": ad_account_id})
+            await asyncio.to_thread(mark_unit_done_if_written, "client", client_id, metrics_buffer.failed_flushes)
+            return
+        
+        campaigns = pending_campaigns(client_id, campaigns)
+        
+        if fetch_mode == "batch":
+            # Páginas gravadas à medida que as respostas batch chegam (em uma thread)
+            batch_tiers, events = await asyncio.to_thread(
+                iter_campaign_insights_batched_by_window, client_id, [c.get('id') for c in campaigns],
+                ad_account_id, full_refresh)
+            queued, unchanged, failed = await asyncio.to_thread(
+                store_batched_insights, client_id, campaigns, batch_tiers, events, force_write, client_name)
+            totals = [(queued, unchanged)] + [None] * len(failed)
+        else:
+            totals = await asyncio.gather(*[
+                sync_campaign_async(http, limits, client_id, client_name, ad_account_id, campaign,
+                                    full_refresh, force_write)
+                for campaign in campaigns
+            ])
+        total_insights = account_totals[0] + sum(t[0] for t in totals if t)
+        total_unchanged = account_totals[1] + sum(t[1] for t in totals if t)
+        
+        # No modo conta o watermark é da conta inteira: só avança se nada falhou
+        if account_tiers and None not in totals:
+            await asyncio.to_thread(metrics_buffer.add, [],
+                                    partial(mark_refreshed_if_written, client_id, ad_account_id,
+                                            account_tiers, failed_flushes_before))
+        
+        if None not in totals:
+            await asyncio.to_thread(metrics_buffer.add, [],
+                                    partial(mark_unit_done_if_written, "client", client_id, failed_flushes_before))
         
-    # Para qualquer outra métrica de engajamento, tráfego e conscientização, 
-    # retornamos 0 para não poluir o painel "Leads" com cliques de link vazios.
-    return (0.0, None)
+        await asyncio.to_thread(update_account_totals, client_id, ad_account_id)
+        
+        await asyncio.to_thread(log_error, client_id, "sync_meta_metrics", "success",
+                                f"Sincronização concluída para {client_name}",
+                                {"campaigns_processed": processed_campaigns, "campaigns_skipped": skipped_campaigns,
+                                 "insights_processed": total_insights, "insights_unchanged": total_unchanged,
+                                 "fetch_mode": fetch_mode, "engine": "async"})
+        
+        print(f"   OK: Cliente {client_name} processado: {total_insights} metrica(s) enviada(s), "
+              f"{total_unchanged} sem alteracao ({skipped_campaigns} campanha(s) sem veiculacao pulada(s))")
+        
+    except MetaAbortError:
+        raise
+    except Exception as e:
+        error_msg = f"Erro ao sincronizar cliente {client_name}: {str(e)}"
+        print(f"   ERRO: {error_msg}")
+        await asyncio.to_thread(log_error, client_id, "sync_meta_metrics", "error", error_msg,
+                                {"ad_account_id": ad_account_id})
 
 
-def sync_client_metrics(client_id: str, client_name: str, ad_account_id: str):
+async def run_async_sync(jobs: List[tuple], fetch_mode: str, concurrency: int, account_concurrency: int,
+                         full_refresh: bool = False, prefilter: bool = True, force_write: bool = False):
     """
-    Sincroniza métricas de todas as campanhas de um cliente
+    Executa a sincronização de vários clientes em paralelo.
+    jobs: lista de (client_id, client_name, conta_anuncio)
     """
-    print(f"\nProcessando cliente: {client_name} ({ad_account_id})")
+    limits = AsyncLimits(concurrency, account_concurrency)
     
     try:
-        # Buscar campanhas
-        campaigns = get_campaigns(ad_account_id)
-        print(f"   Encontradas {len(campaigns)} campanha(s)")
-        
-        if not campaigns:
-            log_error(client_id, "sync_meta_metrics", "warning", 
-                     f"Nenhuma campanha encontrada para {client_name}",
-                     {"ad_account_id": ad_account_id})
-            return
+        async with make_async_httpx_client(pool_size=concurrency) as http:
+            await asyncio.gather(*[
+                sync_client_metrics_async(http, limits, client_id, client_name, conta_anuncio, fetch_mode,
+                                          full_refresh, prefilter, force_write)
+                for client_id, client_name, conta_anuncio in jobs
+            ])
+    finally:
+        # Buscas compartilhadas que algum cliente não chegou a pedir
+        single_flight.clear()
+
+
+def write_run_metrics(elapsed_time: float, success: bool):
+    """Grava as métricas da execução (.prom e .json) e mostra onde o tempo foi gasto"""
+    metrics.set("run_duration_seconds", elapsed_time)
+    metrics.set("run_success", 1 if success else 0)
+    metrics.set("run_finished_timestamp_seconds", time.time())
+    metrics.set("write_flushes", metrics_buffer.flushes)
+    metrics.set("write_failed_flushes", metrics_buffer.failed_flushes)
+    metrics.set("retry_budget_used", retry_policy.retries)
+    metrics.set("single_flight_shared", single_flight.shared)
+    metrics.set("campaign_catalog_full_listings", CATALOG_STATS["full"])
+    metrics.set("campaign_catalog_delta_listings", CATALOG_STATS["delta"])
+    metrics.set("campaign_catalog_status_changes", CATALOG_STATS["status_changed"])
+    try:
+        metrics.write()
+    except OSError as e:
+        print(f"AVISO: Falha ao gravar metricas da execucao: {e}")
+        return
+    
+    phases = metrics.summary()["seconds_by_phase"]
+    if phases:
+        print("Tempo por fase: " + ", ".join(f"{phase} {seconds:.1f}s" for phase, seconds in
+                                            sorted(phases.items(), key=lambda item: -item[1])))
+    print(f"Metricas da execucao: {METRICS_PROM_FILE} e {METRICS_JSON_FILE}")
+
+
+def load_active_clients(client_filter: Optional[str] = None,
+                        columns: str = "id,cliente,conta_anuncio") -> List[Dict]:
+    """Clientes ativos (só os que contêm client_filter no nome, se informado)"""
+    clients = supabase.table("clients").select(columns).eq("ativo", True).execute().data
+    
+    if not clients:
+        print("AVISO: Nenhum cliente ativo encontrado")
+        return []
+    
+    # Filtrar se argumento foi passado
+    if client_filter:
+        clients = [c for c in clients if client_filter.lower() in c.get('cliente', '').lower()]
+        if not clients:
+            print(f"AVISO: Nenhum cliente encontrado com o termo '{client_filter}'")
+    return clients
+
+
+def client_jobs(clients: List[Dict], shard: Optional[tuple] = None) -> List[tuple]:
+    """(client_id, nome, act_id) de cada cliente com conta de anúncios (só os do shard, se informado)"""
+    jobs = []
+    for client in clients:
+        client_id = client.get('id')
+        client_name = client.get('cliente', 'Sem nome')
+        conta_anuncio = client.get('conta_anuncio')
         
-        total_insights = 0
+        if not conta_anuncio:
+            print(f"AVISO: Cliente {client_name} sem conta_anuncio. Pulando...")
+            continue
         
-        # Processar cada campanha
-        for campaign in campaigns:
-            campaign_id = campaign.get('id')
-            campaign_name = campaign.get('name', 'Sem nome')
-            campaign_status = campaign.get('status', 'UNKNOWN')
+        # Garantir formato correto (act_XXXXXXXXX)
+        if not conta_anuncio.startswith('act_'):
+            conta_anuncio = f"act_{conta_anuncio.replace('act_', '')}"
+        
+        jobs.append((client_id, client_name, conta_anuncio))
+    
+    if shard:
+        shard_index, shards = shard
+        jobs = [job for job in jobs if shard_of(job[0], shards) == shard_index]
+        print(f"SHARD {shard_index + 1}/{shards}: {len(jobs)} cliente(s)")
+    return jobs
+
+
+def rank_jobs_by_spend(jobs: List[tuple]) -> List[tuple]:
+    """Ordena os jobs pelo investimento dos últimos 30 dias (maior primeiro)"""
+    try:
+        rows = supabase.table("clients").select("id,account_spend_30d").eq("ativo", True).execute().data
+    except Exception as e:
+        print(f"AVISO: Investimento indisponivel ({str(e)}); mantendo a ordem da tabela. Rode add_account_metrics.sql.")
+        return jobs
+    spend = {row.get('id'): float(row.get('account_spend_30d') or 0) for row in rows}
+    return sorted(jobs, key=lambda job: -spend.get(job[0], 0.0))
+
+
+def group_shared_accounts(jobs: List[tuple]) -> List[tuple]:
+    """
+    Registra em shared_accounts as contas de anúncios com mais de um cliente e
+    reordena os jobs para os clientes da mesma conta ficarem em sequência (na
+    posição do primeiro deles), para as buscas compartilhadas durarem pouco
+    """
+    by_account: Dict[str, List[tuple]] = {}
+    for job in jobs:
+        by_account.setdefault(job[2], []).append(job)
+
+    shared_accounts.clear()
+    for ad_account_id, account_jobs in by_account.items():
+        if len(account_jobs) > 1:
+            shared_accounts[ad_account_id] = len(account_jobs)
+            print(f"CONTA COMPARTILHADA: {ad_account_id} ({', '.join(job[1] for job in account_jobs)}); "
+                  f"buscas feitas uma vez para os {len(account_jobs)} clientes")
+    return [job for account_jobs in by_account.values() for job in account_jobs]
+
+
+# Modo daemon (--daemon): intervalo de recarga da lista de clientes (novos
+# clientes, investimento atualizado) e espera máxima entre verificações da fila
+DAEMON_CLIENTS_REFRESH_SECONDS = 900
+DAEMON_MAX_SLEEP = 60.0
+
+
+def parse_timestamp(value) -> Optional[float]:
+    """Timestamp ISO do Supabase -> epoch (None se vazio ou inválido)"""
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(str(value).replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return None
+
+
+def load_daemon_clients(client_filter: Optional[str], shard: Optional[tuple]) -> List[Dict]:
+    """Clientes para a fila do daemon, com investimento de 30 dias e última sincronização"""
+    try:
+        clients = load_active_clients(client_filter, "id,cliente,conta_anuncio,account_spend_30d,last_sync_at")
+    except Exception as e:
+        # Sem add_account_metrics.sql: todos com o mesmo peso
+        print(f"AVISO: Investimento/ultima sincronizacao indisponiveis ({str(e)}). Rode add_account_metrics.sql.")
+        clients = load_active_clients(client_filter)
+    by_id = {c.get('id'): c for c in clients}
+    return [{
+        "client_id": client_id,
+        "client_name": client_name,
+        "ad_account_id": conta_anuncio,
+        "spend": float(by_id[client_id].get('account_spend_30d') or 0),
+        "last_sync": parse_timestamp(by_id[client_id].get('last_sync_at')),
+    } for client_id, client_name, conta_anuncio in client_jobs(clients, shard)]
+
+
+def run_daemon(scheduler: SyncScheduler, client_filter: Optional[str], shard: Optional[tuple], fetch_mode: str,
+               full_refresh: bool, prefilter: bool, force_write: bool):
+    """
+    Modo daemon: executa continuamente o job vencido de maior prioridade
+    (ver sync_scheduler), um cliente por vez, até receber SIGTERM/Ctrl+C.
+    O buffer de escrita é gravado ao fim de cada job e as métricas (.prom/.json)
+    são atualizadas a cada job.
+    """
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    print(f"MODO DAEMON: clientes atualizados a cada {scheduler.min_interval / 60:.0f} min (maior investimento) "
+          f"a {scheduler.max_interval / 60:.0f} min (sem investimento)")
+    
+    started = time.time()
+    refreshed_at = None
+    try:
+        while not stop.is_set():
+            now = time.time()
+            if refreshed_at is None or now - refreshed_at >= DAEMON_CLIENTS_REFRESH_SECONDS:
+                refreshed_at = now
+                try:
+                    scheduler.update_clients(load_daemon_clients(client_filter, shard), now)
+                except Exception as e:
+                    print(f"AVISO: Falha ao recarregar clientes ({str(e)}); mantendo a fila atual")
+                print(f"[DAEMON] {len(scheduler)} cliente(s) na fila, {scheduler.due_count(now)} vencido(s)")
             
-            # Pular campanhas arquivadas se desejar otimizar mais
-            # if campaign_status == 'ARCHIVED': continue
+            job = scheduler.next_job(now)
+            if job is None:
+                wait = scheduler.seconds_until_next(now)
+                stop.wait(min(DAEMON_MAX_SLEEP if wait is None else wait, DAEMON_MAX_SLEEP))
+                continue
             
-            print(f"   Campanha: {campaign_name} ({campaign_status}) - Obj: {campaign.get('objective')}")
+            age = f"{(now - job.last_sync) / 60:.0f} min" if job.last_sync is not None else "nunca sincronizado"
+            print(f"\n[DAEMON] {job.client_name}: prioridade {scheduler.priority(job, now):.1f} "
+                  f"(investimento 30d {job.spend:.2f}, ultima atualizacao {age}, {job.failures} falha(s) seguida(s))")
             
+            # Orçamento de retries por job: um cliente problemático não esgota o do daemon inteiro
+            retry_policy.reset_budget()
+            failed_flushes_before = metrics_buffer.failed_flushes
+            success = False
             try:
-                # Buscar insights históricos (últimos 30 dias por padrão)
-                insights = get_campaign_insights(campaign_id)
-                
-                if not insights:
-                    print(f"      AVISO: Nenhum insight encontrado")
-                    continue
-                
-                print(f"      OK: {len(insights)} dia(s) de dados encontrados")
-                
-                # Processar cada dia de insights
-                metrics_to_insert = []
-                
-                for insight in insights:
-                    # Usar date_start como data de referência
-                    date_str = insight.get('date_start')
-                    if not date_str:
-                        continue
-                    
-                    # Processar ações
-                    actions = insight.get('actions', [])
-                    resultado_valor, resultado_nome = process_actions(actions, campaign.get('objective'), campaign_name, insight)
-                    
-                    # Preparar dados para inserção
-                    metric_data = {
-                        "client_id": client_id,
-                        "campaign_id": campaign_id,
-                        "campaign_name": campaign_name,
-                        "data_referencia": date_str,
-                        "investimento": float(insight.get('spend', 0)) if insight.get('spend') else 0.0,
-                        "impressoes": int(insight.get('impressions', 0)) if insight.get('impressions') else 0,
-                        "cliques_link": int(insight.get('clicks', 0)) if insight.get('clicks') else 0,
-                        "alcance": int(insight.get('reach', 0)) if insight.get('reach') else 0,
-                        "resultado_valor": resultado_valor, # Já garantido ser float (0.0 se vazio)
-                        "resultado_nome": resultado_nome
-                    }
-                    
-                    metrics_to_insert.append(metric_data)
-                
-                # Buscar IDs existentes para garantir UPDATE correto (evitar duplicatas)
-                # Formar lista de chaves para busca
-                dates = [m['data_referencia'] for m in metrics_to_insert]
-                existing_map = {}
-                
-                if dates:
-                    try:
-                        # Buscar registros existentes para este cliente/campanha nessas datas
-                        existing_response = supabase.table("dashboard_campaign_metrics").select("id, data_referencia")\
-                            .eq("client_id", client_id)\
-                            .eq("campaign_id", campaign_id)\
-                            .in_("data_referencia", dates)\
-                            .execute()
-                        
-                        if existing_response.data:
-                            for row in existing_response.data:
-                                existing_map[row['data_referencia']] = row['id']
-                    except Exception as e:
-                        print(f"      ⚠️  Erro ao buscar existentes: {str(e)}")
-
-                # Separa atualizações e inserções para garantir consistência de chaves no batch
-                updates = []
-                inserts = []
-                
-                for metric in metrics_to_insert:
-                    if metric['data_referencia'] in existing_map:
-                        metric['id'] = existing_map[metric['data_referencia']]
-                        updates.append(metric)
-                    else:
-                        inserts.append(metric)
-
-                # Função auxiliar para batch upsert
-                def batch_upsert(items, label="items"):
-                    if not items: return 0
-                    count = 0
-                    batch_size = 50
-                    for i in range(0, len(items), batch_size):
-                        batch = items[i:i + batch_size]
-                        try:
-                            # Upsert deve funcionar agora que temos IDs para os existentes
-                            result = supabase.table("dashboard_campaign_metrics").upsert(
-                                batch
-                            ).execute()
-                            count += len(batch)
-                        except Exception as e:
-                            # Se batch falhar, tentar individualmente
-                            print(f"      ⚠️  Erro no batch ({label}), tentando individualmente: {str(e)}")
-                            for metric in batch:
-                                try:
-                                    supabase.table("dashboard_campaign_metrics").upsert(metric).execute()
-                                    count += 1
-                                except Exception as e2:
-                                    print(f"      ERRO: Erro ao inserir metrica para {metric['data_referencia']}: {str(e2)}")
-                    return count
-
-                # Executar batches
-                updated_count = batch_upsert(updates, "updates")
-                inserted_count = batch_upsert(inserts, "inserts")
-                
-                total_ops = updated_count + inserted_count
-                total_insights += total_ops
-                print(f"      OK: {total_ops} metrica(s) processada(s) ({updated_count} updates, {inserted_count} inserts)")
-                
+                success = sync_client_metrics(job.client_id, job.client_name, job.ad_account_id, fetch_mode,
+                                              full_refresh, prefilter, force_write)
+            except MetaAbortError:
+                raise
             except Exception as e:
-                error_msg = f"Erro ao processar campanha {campaign_name}: {str(e)}"
-                print(f"      ERRO: {error_msg}")
-                log_error(client_id, "sync_meta_metrics", "error", error_msg,
-                         {"campaign_id": campaign_id, "campaign_name": campaign_name})
-        
-        # ----------------------------------------------------------------
-        # 4. ATUALIZAÇÃO NÍVEL CONTA (Alcance/Impressões 30d REAIS)
-        # ----------------------------------------------------------------
-        try:
-            # 1. Fetch Account Insights (last_30d)
-            acc_url = f"{META_BASE_URL}/{ad_account_id}/insights"
-            acc_params = {
-                'access_token': META_ACCESS_TOKEN,
-                'level': 'account',
-                'date_preset': 'last_30d',
-                'fields': 'reach,impressions,spend'
-            }
-            resp = requests.get(acc_url, params=acc_params)
+                print(f"ERRO CRÍTICO ao processar cliente {job.client_name}: {str(e)}")
+            finally:
+                metrics_buffer.flush()
+            success = success and metrics_buffer.failed_flushes == failed_flushes_before
             
-            # 2. Update Client Table
-            update_data = {'last_sync_at': datetime.now().isoformat()}
+            scheduler.complete(job, success)
+            metrics.inc("daemon_jobs_total", client=job.client_name, status="ok" if success else "failed")
+            print(f"[DAEMON] {job.client_name} {'atualizado' if success else 'com falha'}; "
+                  f"proxima atualizacao em {(job.due - time.time()) / 60:.0f} min")
             
-            if resp.status_code == 200:
-                d = resp.json().get('data', [])
-                if d:
-                    item = d[0]
-                    update_data['account_reach_30d'] = int(item.get('reach', 0))
-                    update_data['account_impressions_30d'] = int(item.get('impressions', 0))
-                    update_data['account_spend_30d'] = float(item.get('spend', 0))
-                    print(f"      [CONTA] Reach 30d: {item.get('reach')} | Impr: {item.get('impressions')}")
-            
-            # Try update (ignoring if cols don't exist yet - user needs to run SQL)
+            metrics.set("daemon_clients", len(scheduler))
+            metrics.set("daemon_due_jobs", scheduler.due_count())
             try:
-                supabase.table('clients').update(update_data).eq('id', client_id).execute()
-            except Exception as ex_db:
-                print(f"      AVISO DB: Falha ao atualizar dados da conta (Colunas existem?): {ex_db}")
-                
-        except Exception as e_acc:
-            print(f"      ERRO Account Insights: {e_acc}")
+                metrics.write()
+            except OSError as e:
+                print(f"AVISO: Falha ao gravar metricas do daemon: {e}")
+    except KeyboardInterrupt:
+        print("\n[DAEMON] Interrompido")
+    finally:
+        metrics_buffer.flush()
+        log_sink.flush()
+    
+    print(f"\n[DAEMON] Encerrado: {scheduler.runs} job(s), {scheduler.failed} com falha")
+    write_run_metrics(time.time() - started, success=True)
 
-        # Log de sucesso
-        log_error(client_id, "sync_meta_metrics", "success",
-                 f"Sincronização concluída para {client_name}",
-                 {"campaigns_processed": len(campaigns), "insights_processed": total_insights})
-        
-        print(f"   OK: Cliente {client_name} processado: {total_insights} metricas")
-        
-    except Exception as e:
-        error_msg = f"Erro ao sincronizar cliente {client_name}: {str(e)}"
-        print(f"   ERRO: {error_msg}")
-        log_error(client_id, "sync_meta_metrics", "error", error_msg,
-                 {"ad_account_id": ad_account_id})
+
+def print_budget_report():
+    """--time-budget: tempo usado e o que ficou para a próxima execução"""
+    print(f"Prazo: {time_budget.elapsed():.0f}s de {time_budget.seconds:.0f}s, "
+          f"{time_budget.requests} requisicao(oes), custo estimado {time_budget.request_cost():.2f}s por requisicao")
+    metrics.set("budget_seconds", time_budget.seconds)
+    metrics.set("budget_deferred_clients", len(time_budget.deferred))
+    if not time_budget.deferred:
+        return
+    print(f"PRAZO ESGOTADO apos {time_budget.exhausted_at:.0f}s. Adiado para a proxima execucao:")
+    for line in time_budget.report():
+        print(f"   {line}")
+    log_error(None, "sync_meta_metrics", "warning",
+              f"Prazo de {time_budget.seconds:.0f}s esgotado: {len(time_budget.deferred)} cliente(s) com trabalho adiado",
+              {"deferred": time_budget.deferred})
 
 
 import argparse
 
+
+def shard_arg(value: str) -> tuple:
+    try:
+        return parse_shard(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def duration_arg(value: str) -> float:
+    try:
+        return parse_duration(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
 def main():
     """
     Função principal: busca clientes ativos e sincroniza métricas
     """
+    global REPORT_RUN_MIN_ROWS, run_checkpoint, client_leases, time_budget
+    
     parser = argparse.ArgumentParser(description='Sincronizar métricas do Meta Ads.')
     parser.add_argument('--client', type=str, help='Nome (ou parte do nome) do cliente para sincronizar apenas ele.')
+    parser.add_argument('--fetch-mode', choices=FETCH_MODES, default='campaign',
+                        help='campaign: um /insights por campanha; account: uma listagem level=campaign por conta; '
+                             'batch: requisições por campanha agrupadas na Graph Batch API.')
+    parser.add_argument('--full-refresh', action='store_true',
+                        help='Ignora os watermarks e busca a janela completa de 30 dias para todas as campanhas.')
+    parser.add_argument('--force-write', action='store_true',
+                        help='Regrava todas as linhas, mesmo as que não mudaram desde a última gravação.')
+    parser.add_argument('--backfill', type=parse_backfill_range, metavar='SINCE..UNTIL',
+                        help='Backfill histórico do período (ex: 2023-10-01..2026-10-01), em janelas paralelas e retomável.')
+    parser.add_argument('--backfill-window-days', type=int, default=BACKFILL_WINDOW_DAYS,
+                        help='Backfill: tamanho das janelas em dias.')
+    parser.add_argument('--backfill-workers', type=int, default=BACKFILL_WORKERS,
+                        help='Backfill: janelas buscadas em paralelo.')
+    parser.add_argument('--resume', nargs='?', const='latest', metavar='RUN_ID',
+                        help='Retoma uma execução interrompida (sem RUN_ID, a mais recente, se não foi concluída), '
+                             'com as mesmas opções e pulando clientes e campanhas já gravados.')
+    parser.add_argument('--worker', action='store_true',
+                        help='Modo worker: só sincroniza clientes cujo lease conseguir tomar na tabela clients '
+                             '(vários processos/hosts sem trabalho duplicado; requer add_client_leases.sql).')
+    parser.add_argument('--round-id', metavar='ID',
+                        help='Modo worker: rodada compartilhada por todos os workers iniciados juntos (ex: a data e '
+                             'a hora do agendamento); cliente concluído na rodada não é sincronizado de novo.')
+    parser.add_argument('--shard', type=shard_arg, metavar='I/N',
+                        help='Processa só a parte I de N dos clientes (divisão fixa pelo id, ex: 1/3).')
+    parser.add_argument('--daemon', action='store_true',
+                        help='Modo daemon: roda continuamente, atualizando cada cliente com frequência proporcional '
+                             'ao investimento recente (prioridade por investimento, atraso e falhas).')
+    parser.add_argument('--daemon-min-interval', type=float, default=SCHEDULER_MIN_INTERVAL,
+                        help='Modo daemon: intervalo (segundos) entre atualizações do cliente com maior investimento.')
+    parser.add_argument('--daemon-max-interval', type=float, default=SCHEDULER_MAX_INTERVAL,
+                        help='Modo daemon: intervalo (segundos) entre atualizações de clientes sem investimento.')
+    parser.add_argument('--time-budget', type=duration_arg, metavar='DURACAO',
+                        help='Prazo da execução (segundos, ou 45m, 1h): primeiro hoje/ontem de todos os clientes '
+                             '(maior investimento primeiro), depois os dias anteriores; para no prazo e informa o que '
+                             'foi adiado.')
+    parser.add_argument('--reclassify', action='store_true',
+                        help='Recalcula os resultados a partir do arquivo local de insights brutos, sem chamar o Meta.')
+    parser.add_argument('--no-prefilter', action='store_true',
+                        help='Busca insights de todas as campanhas, inclusive arquivadas e sem veiculação na janela.')
+    parser.add_argument('--max-rps', type=float, default=GOVERNOR_MAX_RPS,
+                        help='Ritmo máximo de requisições por segundo ao Meta quando há folga de uso.')
+    parser.add_argument('--engine', choices=('sync', 'async'), default='sync',
+                        help='sync: clientes em sequência; async: clientes e campanhas em paralelo (httpx).')
+    parser.add_argument('--concurrency', type=int, default=ASYNC_CONCURRENCY,
+                        help='Motor async: máximo de requisições simultâneas ao Meta.')
+    parser.add_argument('--account-concurrency', type=int, default=ASYNC_ACCOUNT_CONCURRENCY,
+                        help='Motor async: máximo de requisições simultâneas por conta de anúncios.')
+    parser.add_argument('--report-run-min-rows', type=int, default=REPORT_RUN_MIN_ROWS,
+                        help='Listagens da conta com mais linhas estimadas que isto usam relatório assíncrono do Meta.')
+    parser.add_argument('--write-batch-rows', type=int, default=WRITE_BUFFER_MAX_ROWS,
+                        help='Buffer de escrita: grava quando acumular esta quantidade de linhas.')
+    parser.add_argument('--write-batch-bytes', type=int, default=WRITE_BUFFER_MAX_BYTES,
+                        help='Buffer de escrita: grava quando o payload acumulado passar deste tamanho (bytes).')
+    parser.add_argument('--write-flush-seconds', type=float, default=WRITE_BUFFER_MAX_AGE,
+                        help='Buffer de escrita: grava linhas que estejam esperando há mais que estes segundos.')
     args = parser.parse_args()
+    if args.worker and (args.backfill or args.reclassify):
+        parser.error("--worker vale só para a sincronização normal (sem --backfill/--reclassify)")
+    if args.worker and not args.round_id:
+        parser.error("--worker requer --round-id (o mesmo em todos os workers da rodada)")
+    if args.round_id and not args.worker:
+        parser.error("--round-id vale só com --worker")
+    if args.daemon and (args.backfill or args.reclassify or args.resume or args.worker or args.engine == 'async'):
+        parser.error("--daemon não combina com --backfill/--reclassify/--resume/--worker/--engine async")
+    # Com --worker, o cliente só é marcado como concluído pelo checkpoint da execução, que o
+    # --time-budget não usa: os clientes nunca seriam liberados como concluídos
+    if args.time_budget and (args.backfill or args.reclassify or args.resume or args.daemon or args.worker
+                             or args.engine == 'async'):
+        parser.error("--time-budget não combina com --backfill/--reclassify/--resume/--daemon/--worker/--engine async")
+    resumed_run = None
+    if args.resume:
+        resumed_run = find_resume_run(args.resume)
+        if resumed_run is None:
+            return
+        restore_run_options(parser, args, resumed_run)
+    if args.time_budget:
+        # O prazo conta desde o início do processo
+        time_budget = TimeBudget(args.time_budget)
+    REPORT_RUN_MIN_ROWS = args.report_run_min_rows
 
     print("=" * 60)
     print("Iniciando sincronizacao Meta -> Supabase")
     if args.client:
         print(f"MODO FILTRADO: Apenas clientes contendo '{args.client}'")
+    print(f"Modo de busca de insights: {args.fetch_mode}")
+    if args.full_refresh:
+        print("MODO COMPLETO: ignorando watermarks (janela de 30 dias)")
+    if args.force_write:
+        print("GRAVACAO FORCADA: regravando inclusive linhas sem alteracao")
+    if time_budget:
+        print(f"PRAZO: {time_budget.seconds:.0f}s (hoje/ontem de todos os clientes primeiro, depois dias anteriores)")
+    governor.set_max_rps(args.max_rps)
+    metrics_buffer.configure(args.write_batch_rows, args.write_batch_bytes, args.write_flush_seconds)
+    if args.engine == 'async':
+        print(f"Motor async: {args.concurrency} requisicoes simultaneas ({args.account_concurrency} por conta)")
     print("=" * 60)
     print(f"Data/Hora: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     
     start_time = time.time()
     
     try:
+        if args.daemon:
+            # Roda até ser interrompido; a lista de clientes é recarregada periodicamente
+            run_daemon(SyncScheduler(args.daemon_min_interval, args.daemon_max_interval), args.client,
+                       args.shard, args.fetch_mode, args.full_refresh, not args.no_prefilter, args.force_write)
+            return
+        
         # Buscar clientes ativos
         print("\nBuscando clientes ativos...")
-        clients_response = supabase.table("clients").select("id,cliente,conta_anuncio").eq("ativo", True).execute()
-        clients = clients_response.data
-        
+        clients = load_active_clients(args.client)
         if not clients:
-            print("AVISO: Nenhum cliente ativo encontrado")
             return
-            
-        # Filtrar se argumento foi passado
-        if args.client:
-            filtered_clients = [
-                c for c in clients 
-                if args.client.lower() in c.get('cliente', '').lower()
-            ]
-            if not filtered_clients:
-                 print(f"AVISO: Nenhum cliente encontrado com o termo '{args.client}'")
-                 return
-            clients = filtered_clients
         
         print(f"OK: {len(clients)} cliente(s) para processar\n")
         
-        # Processar cada cliente
-        for client in clients:
-            client_id = client.get('id')
-            client_name = client.get('cliente', 'Sem nome')
-            conta_anuncio = client.get('conta_anuncio')
-            
-            if not conta_anuncio:
-                print(f"AVISO: Cliente {client_name} sem conta_anuncio. Pulando...")
-                continue
-            
-            # Garantir formato correto (act_XXXXXXXXX)
-            if not conta_anuncio.startswith('act_'):
-                conta_anuncio = f"act_{conta_anuncio.replace('act_', '')}"
-            
+        jobs = client_jobs(clients, args.shard)
+        if time_budget:
+            jobs = rank_jobs_by_spend(jobs)
+        jobs = group_shared_accounts(jobs)
+        
+        if args.worker:
+            client_leases = ClientLeases(supabase, args.round_id)
             try:
-                sync_client_metrics(client_id, client_name, conta_anuncio)
+                client_leases.renew()
             except Exception as e:
-                print(f"ERRO CRÍTICO ao processar cliente {client_name}: {str(e)}")
-                # Continue processando outros clientes
-                continue
+                print(f"ERRO: Leases indisponiveis ({str(e)}). Rode add_client_leases.sql no Supabase.")
+                return
+            print(f"MODO WORKER: {client_leases.owner}, rodada {client_leases.round_id} (lease de {client_leases.ttl}s, "
+                  f"renovado a cada {client_leases.heartbeat:.0f}s)")
+        
+        # Checkpoint por cliente/campanha (o backfill tem os seus, por janela; com --time-budget
+        # o que foi adiado continua devido nos watermarks e vai na próxima execução)
+        if not args.reclassify and not args.backfill and not time_budget:
+            run_checkpoint = open_run_checkpoint(resumed_run, len(jobs), run_options(args))
+        
+        try:
+            if args.reclassify:
+                # Só o arquivo local: nenhuma chamada ao Meta
+                print("RECLASSIFICACAO: recalculando resultados a partir do arquivo de insights brutos")
+                reclassify_archive([c.get('id') for c in clients] if args.client else None, args.force_write)
+            elif args.backfill:
+                run_backfill(jobs, args.backfill[0], args.backfill[1], args.backfill_window_days,
+                             args.backfill_workers, args.force_write)
+            elif args.engine == 'async':
+                # Clientes e campanhas em paralelo
+                asyncio.run(run_async_sync(jobs, args.fetch_mode, args.concurrency, args.account_concurrency,
+                                           args.full_refresh, not args.no_prefilter, args.force_write))
+            else:
+                # Com --time-budget: primeiro hoje/ontem de todos os clientes, depois os dias anteriores
+                for priority_pass, label in (BUDGET_PASSES if time_budget else ((False, ""),)):
+                    if time_budget:
+                        # Watermarks da passada anterior gravados antes de planejar a próxima
+                        metrics_buffer.flush()
+                        time_budget.start_pass(priority_pass, label)
+                        print(f"\n--- Passada {label}: {time_budget.remaining():.0f}s restantes ---")
+                    # Processar cada cliente
+                    for index, (client_id, client_name, conta_anuncio) in enumerate(jobs):
+                        try:
+                            sync_client_metrics(client_id, client_name, conta_anuncio, args.fetch_mode,
+                                                args.full_refresh, not args.no_prefilter, args.force_write)
+                        except MetaAbortError:
+                            raise
+                        except Exception as e:
+                            print(f"ERRO CRÍTICO ao processar cliente {client_name}: {str(e)}")
+                            # Continue processando outros clientes
+                            continue
+                        finally:
+                            # Último cliente da conta: descarta o que ninguém mais vai pedir
+                            if index + 1 == len(jobs) or jobs[index + 1][2] != conta_anuncio:
+                                single_flight.forget(conta_anuncio)
+                if time_budget:
+                    report_budget_results()
+        finally:
+            # Grava o que ficou no buffer (inclusive se a execução for interrompida)
+            metrics_buffer.flush()
+            log_sink.flush()
+            if client_leases:
+                client_leases.close()
+        
+        if run_checkpoint:
+            # No modo worker, os clientes que outros workers pegaram não ficam pendentes aqui
+            completed = run_checkpoint.count("client") + (client_leases.skipped if client_leases else 0)
+            if completed >= len(jobs):
+                sync_state.finish_run(run_checkpoint.run_id)
+            else:
+                print(f"AVISO: {len(jobs) - completed} cliente(s) nao concluido(s); "
+                      f"para tentar de novo: python sync_meta_metrics.py --resume {run_checkpoint.run_id}")
         
         elapsed_time = time.time() - start_time
         print("\n" + "=" * 60)
+        if BATCH_STATS["batch_calls"]:
+            saved = BATCH_STATS["requests"] - BATCH_STATS["batch_calls"]
+            print(f"Batch API: {BATCH_STATS['requests']} requisicao(oes) em {BATCH_STATS['batch_calls']} "
+                  f"chamada(s) batch ({saved} round trip(s) economizado(s))")
+        if report_runs.jobs:
+            print(f"Relatorios assincronos: {report_runs.jobs} ({report_runs.failed} com falha), "
+                  f"{report_runs.status_calls} consulta(s) de status, "
+                  f"espera media {report_runs.waited / report_runs.jobs:.0f}s")
+        if CATALOG_STATS["full"] or CATALOG_STATS["delta"]:
+            print(f"Catalogo de campanhas: {CATALOG_STATS['delta']} listagem(ns) incremental(is) "
+                  f"({CATALOG_STATS['changed']} campanha(s) nova(s)/alterada(s), "
+                  f"{CATALOG_STATS['status_changed']} com status efetivo alterado), "
+                  f"{CATALOG_STATS['full']} completa(s)")
+        if single_flight.shared:
+            print(f"Contas compartilhadas: {single_flight.shared} busca(s) reaproveitada(s) "
+                  f"({single_flight.fetches} feita(s))")
+        print(f"Espera acumulada do governador de taxa: {governor.total_wait:.1f} segundos")
+        print(f"Retries: {retry_policy.retries}/{RETRY_BUDGET} ({retry_policy.waited:.0f}s de backoff)")
+        metrics_buffer.print_summary()
+        if dead_letter.count:
+            print(f"AVISO: {dead_letter.count} metrica(s) recusada(s) gravada(s) em {dead_letter.path}")
+        if time_budget:
+            print_budget_report()
+        if client_leases:
+            print(f"Worker {client_leases.owner}: {client_leases.claimed} cliente(s) processado(s), "
+                  f"{client_leases.skipped} com outro worker ou ja concluido(s)"
+                  + (f", {client_leases.lost} lease(s) perdido(s)" if client_leases.lost else ""))
+        if log_sink.inserts:
+            print(f"Logs: {log_sink.sent} registro(s) em {log_sink.inserts} insert(s)")
+        if log_sink.fallback:
+            print(f"AVISO: {log_sink.fallback} log(s) gravado(s) em {log_sink.fallback_path} (Supabase indisponivel)")
+        print_connection_stats()
+        write_run_metrics(elapsed_time, success=True)
         print(f"OK: Sincronizacao concluida em {elapsed_time:.2f} segundos")
         print("=" * 60)
         
@@ -474,6 +2643,7 @@ def main():
         error_msg = f"Erro fatal na sincronizacao: {str(e)}"
         print(f"\nERRO: {error_msg}")
         log_error(None, "sync_meta_metrics", "error", error_msg)
+        write_run_metrics(time.time() - start_time, success=False)
         raise
 
 
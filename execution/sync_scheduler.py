@@ -0,0 +1,166 @@
+"""
+Fila de prioridade do modo daemon (--daemon).
+
+Em vez de uma passada fixa por todos os clientes, o daemon mantém um job de
+atualização por cliente e executa sempre o mais valioso entre os vencidos:
+
+- o intervalo entre atualizações depende do investimento recente
+  (account_spend_30d): o cliente que mais investe é atualizado a cada
+  min_interval, um cliente sem investimento a cada max_interval e os demais
+  em escala geométrica entre os dois (pelo log do investimento)
+- entre os jobs vencidos, a prioridade é o peso do investimento x o atraso
+  relativo (idade da última atualização / intervalo)
+- falhas seguidas adiam o próximo job do cliente (backoff exponencial) e
+  reduzem a prioridade dele
+
+São dois heaps: jobs agendados, por horário de vencimento, e jobs vencidos,
+por prioridade. Quais campanhas e dias cada job busca continua sendo decidido
+pelos watermarks e pelo pré-filtro de veiculação, e o ritmo das requisições
+pelo governador de taxa; a fila só decide a ordem e a frequência.
+"""
+import heapq
+import itertools
+import math
+import time
+from typing import Dict, List, Optional
+
+SCHEDULER_MIN_INTERVAL = 600
+SCHEDULER_MAX_INTERVAL = 6 * 3600
+SCHEDULER_FAILURE_BACKOFF = 300
+SCHEDULER_MAX_BACKOFF = 2 * 3600
+
+
+class ClientJob:
+    def __init__(self, client_id: str, client_name: str, ad_account_id: str, spend: float,
+                 last_sync: Optional[float]):
+        self.client_id = client_id
+        self.client_name = client_name
+        self.ad_account_id = ad_account_id
+        self.spend = spend
+        self.last_sync = last_sync
+        self.interval = float(SCHEDULER_MAX_INTERVAL)
+        self.due = 0.0
+        self.failures = 0
+        self.running = False
+        # Entradas antigas dos heaps (job reagendado ou cliente removido) são descartadas pela versão
+        self.version = 0
+
+
+class SyncScheduler:
+    def __init__(self, min_interval: float = SCHEDULER_MIN_INTERVAL, max_interval: float = SCHEDULER_MAX_INTERVAL,
+                 failure_backoff: float = SCHEDULER_FAILURE_BACKOFF, max_backoff: float = SCHEDULER_MAX_BACKOFF):
+        self.min_interval = min_interval
+        self.max_interval = max(max_interval, min_interval)
+        self.failure_backoff = failure_backoff
+        self.max_backoff = max_backoff
+
+        self._jobs: Dict[str, ClientJob] = {}
+        self._waiting: List[tuple] = []
+        self._ready: List[tuple] = []
+        self._seq = itertools.count(1)
+
+        # Estatísticas
+        self.runs = 0
+        self.failed = 0
+
+    def __len__(self) -> int:
+        return len(self._jobs)
+
+    def interval_for(self, spend: float, max_spend: float) -> float:
+        """min_interval para o maior investimento, max_interval sem investimento"""
+        if spend <= 0 or max_spend <= 0:
+            return float(self.max_interval)
+        share = min(1.0, math.log1p(spend) / math.log1p(max_spend))
+        return self.max_interval * (self.min_interval / self.max_interval) ** share
+
+    def priority(self, job: ClientJob, now: float) -> float:
+        """Peso do investimento x atraso relativo, dividido pelas falhas seguidas"""
+        age = now - job.last_sync if job.last_sync is not None else now
+        return (1.0 + math.log1p(job.spend)) * (age / job.interval) / (1 + job.failures)
+
+    def update_clients(self, clients: List[Dict], now: Optional[float] = None):
+        """
+        Sincroniza a fila com a lista de clientes ativos (dicts com client_id,
+        client_name, ad_account_id, spend e last_sync em epoch ou None)
+        """
+        now = time.time() if now is None else now
+        max_spend = max((c["spend"] for c in clients), default=0.0)
+        seen = set()
+        for client in clients:
+            client_id = client["client_id"]
+            seen.add(client_id)
+            job = self._jobs.get(client_id)
+            if job is None:
+                job = self._jobs[client_id] = ClientJob(client_id, client["client_name"], client["ad_account_id"],
+                                                        client["spend"], client["last_sync"])
+            else:
+                job.client_name = client["client_name"]
+                job.ad_account_id = client["ad_account_id"]
+                job.spend = client["spend"]
+
+            interval = self.interval_for(job.spend, max_spend)
+            if job.version and (job.running or job.failures or interval == job.interval):
+                continue
+            job.interval = interval
+            job.due = job.last_sync + interval if job.last_sync is not None else now
+            self._push(job)
+
+        for client_id in set(self._jobs) - seen:
+            # Cliente desativado: as entradas nos heaps ficam órfãs e são descartadas
+            del self._jobs[client_id]
+
+    def next_job(self, now: Optional[float] = None) -> Optional[ClientJob]:
+        """Job vencido de maior prioridade (None se nenhum venceu)"""
+        now = time.time() if now is None else now
+        while self._waiting and self._waiting[0][0] <= now:
+            _, _, client_id, version = heapq.heappop(self._waiting)
+            job = self._current(client_id, version)
+            if job is not None:
+                heapq.heappush(self._ready, (-self.priority(job, now), next(self._seq), client_id, version))
+
+        while self._ready:
+            _, _, client_id, version = heapq.heappop(self._ready)
+            job = self._current(client_id, version)
+            if job is not None:
+                job.running = True
+                return job
+        return None
+
+    def seconds_until_next(self, now: Optional[float] = None) -> Optional[float]:
+        now = time.time() if now is None else now
+        if self._ready:
+            return 0.0
+        if self._waiting:
+            return max(0.0, self._waiting[0][0] - now)
+        return None
+
+    def complete(self, job: ClientJob, success: bool, now: Optional[float] = None):
+        """Reagenda o job: pelo intervalo se deu certo, com backoff se falhou"""
+        now = time.time() if now is None else now
+        job.running = False
+        self.runs += 1
+        if success:
+            job.last_sync = now
+            job.failures = 0
+            job.due = now + job.interval
+        else:
+            self.failed += 1
+            job.failures += 1
+            backoff = min(self.failure_backoff * 2 ** (job.failures - 1), self.max_backoff)
+            job.due = now + backoff
+        if job.client_id in self._jobs:
+            self._push(job)
+
+    def due_count(self, now: Optional[float] = None) -> int:
+        now = time.time() if now is None else now
+        return sum(1 for job in self._jobs.values() if not job.running and job.due <= now)
+
+    def _push(self, job: ClientJob):
+        job.version = next(self._seq)
+        heapq.heappush(self._waiting, (job.due, next(self._seq), job.client_id, job.version))
+
+    def _current(self, client_id: str, version: int) -> Optional[ClientJob]:
+        job = self._jobs.get(client_id)
+        if job is None or job.version != version or job.running:
+            return None
+        return job
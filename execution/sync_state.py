@@ -0,0 +1,429 @@
+"""
+Estado local da sincronização (SQLite).
+
+Guarda, entre execuções, informações que evitam refazer trabalho no Meta e no
+Supabase. O arquivo padrão é execution/sync_state.db (SYNC_STATE_DB no .env).
+
+Watermarks de sincronização
+---------------------------
+Para cada escopo (campanha ou conta de anúncios) registramos quando cada
+faixa de dias foi atualizada pela última vez. A política de atualização em
+camadas decide quais dias buscar em cada execução:
+
+- hoje e ontem (dias 0-1): toda execução
+- dias 2-7: uma vez por dia
+- dias 8-28: uma vez por semana (janela de atribuição do Meta)
+- mais antigos: nunca (só na primeira sincronização do escopo)
+
+Hashes de conteúdo
+------------------
+Para cada linha gravada em dashboard_campaign_metrics guardamos um hash do
+conteúdo (client_id, campaign_id, data_referencia -> hash). Linhas recalculadas
+com o mesmo hash já estão no banco e não precisam ser reenviadas.
+
+Arquivo de insights brutos
+--------------------------
+Cada insight diário recebido do Meta (inclusive o array actions) é guardado
+comprimido (zlib) em raw_insights, só acrescentando uma versão nova quando o
+conteúdo muda. Assim, quando as regras de resultado mudam, o resultado
+pode ser recalculado a partir do arquivo (--reclassify) sem chamar o Meta.
+
+Checkpoints de backfill
+-----------------------
+No --backfill o período é dividido em janelas; cada janela concluída (linhas
+gravadas) é registrada em backfill_windows e pulada se o comando for rodado
+de novo.
+
+Checkpoints de execução
+-----------------------
+Cada sincronização recebe um run_id (sync_runs). Campanhas e clientes
+concluídos (linhas gravadas) são registrados em run_units; com --resume, uma
+execução interrompida continua do ponto em que parou, pulando essas unidades.
+
+Catálogo de campanhas
+---------------------
+Os metadados das campanhas de cada conta (id, nome, status, objetivo...)
+ficam em campaign_catalog. Cada execução busca no Meta só as campanhas
+criadas ou alteradas desde a última listagem (updated_time); de tempos em
+tempos a listagem é completa e substitui o catálogo da conta, removendo as
+campanhas excluídas.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import zlib
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterator, List, Optional
+
+SYNC_STATE_DB = os.getenv('SYNC_STATE_DB', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sync_state.db'))
+
+# (nome, dia inicial, dia final, intervalo mínimo em dias entre atualizações)
+REFRESH_TIERS = [
+    ("recent", 0, 1, 0),
+    ("week", 2, 7, 1),
+    ("attribution", 8, 28, 7),
+]
+
+# Janela da primeira sincronização de um escopo sem watermark
+INITIAL_WINDOW_DAYS = 30
+
+
+class SyncState:
+    """Acesso thread-safe ao banco SQLite de estado local"""
+
+    def __init__(self, path: str = SYNC_STATE_DB):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS sync_watermarks (
+                    scope TEXT NOT NULL,
+                    tier TEXT NOT NULL,
+                    refreshed_on TEXT NOT NULL,
+                    PRIMARY KEY (scope, tier)
+                );
+                CREATE TABLE IF NOT EXISTS metric_hashes (
+                    client_id TEXT NOT NULL,
+                    campaign_id TEXT NOT NULL,
+                    data_referencia TEXT NOT NULL,
+                    hash TEXT NOT NULL,
+                    PRIMARY KEY (client_id, campaign_id, data_referencia)
+                );
+                CREATE TABLE IF NOT EXISTS raw_insights (
+                    client_id TEXT NOT NULL,
+                    campaign_id TEXT NOT NULL,
+                    data_referencia TEXT NOT NULL,
+                    fetched_at TEXT NOT NULL,
+                    raw_hash TEXT NOT NULL,
+                    campaign_name TEXT,
+                    objective TEXT,
+                    payload BLOB NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS raw_insights_key
+                    ON raw_insights (client_id, campaign_id, data_referencia);
+                CREATE TABLE IF NOT EXISTS backfill_windows (
+                    client_id TEXT NOT NULL,
+                    since TEXT NOT NULL,
+                    until TEXT NOT NULL,
+                    rows INTEGER NOT NULL,
+                    completed_at TEXT NOT NULL,
+                    PRIMARY KEY (client_id, since, until)
+                );
+                CREATE TABLE IF NOT EXISTS sync_runs (
+                    run_id TEXT PRIMARY KEY,
+                    started_at TEXT NOT NULL,
+                    finished_at TEXT,
+                    clients INTEGER NOT NULL,
+                    options TEXT
+                );
+                CREATE TABLE IF NOT EXISTS run_units (
+                    run_id TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    unit TEXT NOT NULL,
+                    completed_at TEXT NOT NULL,
+                    PRIMARY KEY (run_id, kind, unit)
+                );
+                CREATE TABLE IF NOT EXISTS campaign_catalog (
+                    ad_account_id TEXT NOT NULL,
+                    campaign_id TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    PRIMARY KEY (ad_account_id, campaign_id)
+                );
+                CREATE TABLE IF NOT EXISTS campaign_catalog_sync (
+                    ad_account_id TEXT PRIMARY KEY,
+                    listed_at TEXT NOT NULL,
+                    reconciled_at TEXT NOT NULL
+                );
+            """)
+        return self._conn
+
+    def get_watermarks(self, scope: str) -> Dict[str, str]:
+        """{tier: data da última atualização (YYYY-MM-DD)}"""
+        with self._lock:
+            rows = self._db().execute(
+                "SELECT tier, refreshed_on FROM sync_watermarks WHERE scope = ?", (scope,)).fetchall()
+        return dict(rows)
+
+    def save_watermarks(self, scope: str, tiers: List[str], refreshed_on: Optional[str] = None):
+        refreshed_on = refreshed_on or date.today().isoformat()
+        with self._lock:
+            db = self._db()
+            db.executemany(
+                "INSERT OR REPLACE INTO sync_watermarks (scope, tier, refreshed_on) VALUES (?, ?, ?)",
+                [(scope, tier, refreshed_on) for tier in tiers])
+            db.commit()
+
+    def get_metric_hashes(self, client_id: str, campaign_id: str) -> Dict[str, str]:
+        """{data_referencia: hash} das linhas já gravadas da campanha"""
+        with self._lock:
+            rows = self._db().execute(
+                "SELECT data_referencia, hash FROM metric_hashes WHERE client_id = ? AND campaign_id = ?",
+                (client_id, campaign_id)).fetchall()
+        return dict(rows)
+
+    def save_metric_hashes(self, client_id: str, campaign_id: str, hashes: Dict[str, str]):
+        with self._lock:
+            db = self._db()
+            db.executemany(
+                "INSERT OR REPLACE INTO metric_hashes (client_id, campaign_id, data_referencia, hash) VALUES (?, ?, ?, ?)",
+                [(client_id, campaign_id, day, value) for day, value in hashes.items()])
+            db.commit()
+
+    def archive_insights(self, client_id: str, campaign_id: str, campaign_name: Optional[str],
+                         objective: Optional[str], insights: List[Dict]) -> int:
+        """
+        Acrescenta ao arquivo os insights diários cujo conteúdo mudou desde a
+        última versão guardada; retorna quantas versões novas foram gravadas
+        """
+        encoded = []
+        for insight in insights:
+            day = insight.get('date_start')
+            if not day:
+                continue
+            raw = json.dumps(insight, sort_keys=True, ensure_ascii=False).encode("utf-8")
+            encoded.append((day, hashlib.sha1(raw).hexdigest(), zlib.compress(raw)))
+        if not encoded:
+            return 0
+
+        fetched_at = datetime.now().isoformat(timespec="seconds")
+        with self._lock:
+            db = self._db()
+            latest = dict(db.execute(
+                """SELECT data_referencia, raw_hash FROM raw_insights r
+                   WHERE client_id = ? AND campaign_id = ? AND rowid = (
+                       SELECT MAX(rowid) FROM raw_insights
+                       WHERE client_id = r.client_id AND campaign_id = r.campaign_id
+                         AND data_referencia = r.data_referencia)""",
+                (client_id, campaign_id)).fetchall())
+            new_rows = [(client_id, campaign_id, day, fetched_at, raw_hash, campaign_name, objective, payload)
+                        for day, raw_hash, payload in encoded if latest.get(day) != raw_hash]
+            db.executemany(
+                "INSERT INTO raw_insights (client_id, campaign_id, data_referencia, fetched_at, raw_hash, "
+                "campaign_name, objective, payload) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", new_rows)
+            db.commit()
+        return len(new_rows)
+
+    def get_completed_windows(self, client_id: str) -> set:
+        """{(since, until)} das janelas de backfill já concluídas do cliente"""
+        with self._lock:
+            rows = self._db().execute(
+                "SELECT since, until FROM backfill_windows WHERE client_id = ?", (client_id,)).fetchall()
+        return set(rows)
+
+    def mark_window_completed(self, client_id: str, since: str, until: str, rows: int):
+        with self._lock:
+            db = self._db()
+            db.execute(
+                "INSERT OR REPLACE INTO backfill_windows (client_id, since, until, rows, completed_at) VALUES (?, ?, ?, ?, ?)",
+                (client_id, since, until, rows, datetime.now().isoformat(timespec="seconds")))
+            db.commit()
+
+    def start_run(self, run_id: str, clients: int, options: Optional[Dict] = None):
+        with self._lock:
+            db = self._db()
+            db.execute(
+                "INSERT INTO sync_runs (run_id, started_at, clients, options) VALUES (?, ?, ?, ?)",
+                (run_id, datetime.now().isoformat(timespec="seconds"), clients, json.dumps(options or {})))
+            db.commit()
+
+    def finish_run(self, run_id: str):
+        with self._lock:
+            db = self._db()
+            db.execute("UPDATE sync_runs SET finished_at = ? WHERE run_id = ?",
+                       (datetime.now().isoformat(timespec="seconds"), run_id))
+            db.commit()
+
+    def _run_query(self, where: str = "", params: tuple = ()) -> Optional[Dict]:
+        with self._lock:
+            row = self._db().execute(
+                f"SELECT run_id, started_at, finished_at, clients, options FROM sync_runs {where} "
+                "ORDER BY started_at DESC, run_id DESC LIMIT 1", params).fetchone()
+        if row is None:
+            return None
+        run_id, started_at, finished_at, clients, options = row
+        return {"run_id": run_id, "started_at": started_at, "finished_at": finished_at,
+                "clients": clients, "options": json.loads(options or "{}")}
+
+    def get_run(self, run_id: str) -> Optional[Dict]:
+        return self._run_query("WHERE run_id = ?", (run_id,))
+
+    def latest_run(self) -> Optional[Dict]:
+        """Execução mais recente, concluída ou não"""
+        return self._run_query()
+
+    def get_completed_units(self, run_id: str, kind: str) -> set:
+        """Unidades (ex: client_id, client_id:campaign_id) concluídas na execução"""
+        with self._lock:
+            rows = self._db().execute(
+                "SELECT unit FROM run_units WHERE run_id = ? AND kind = ?", (run_id, kind)).fetchall()
+        return {unit for unit, in rows}
+
+    def mark_unit_completed(self, run_id: str, kind: str, unit: str):
+        with self._lock:
+            db = self._db()
+            db.execute(
+                "INSERT OR REPLACE INTO run_units (run_id, kind, unit, completed_at) VALUES (?, ?, ?, ?)",
+                (run_id, kind, unit, datetime.now().isoformat(timespec="seconds")))
+            db.commit()
+
+    def run_progress(self, run_id: str) -> Dict:
+        """{kind: (unidades concluídas, último registro)}"""
+        with self._lock:
+            rows = self._db().execute(
+                "SELECT kind, COUNT(*), MAX(completed_at) FROM run_units WHERE run_id = ? GROUP BY kind",
+                (run_id,)).fetchall()
+        return {kind: (count, last) for kind, count, last in rows}
+
+    def get_campaign_catalog(self, ad_account_id: str) -> tuple:
+        """
+        (campanhas, início da última listagem, início da última listagem completa) da
+        conta, com os horários em epoch; (None, None, None) se a conta nunca foi listada
+        """
+        with self._lock:
+            db = self._db()
+            sync = db.execute(
+                "SELECT listed_at, reconciled_at FROM campaign_catalog_sync WHERE ad_account_id = ?",
+                (ad_account_id,)).fetchone()
+            if sync is None:
+                return None, None, None
+            rows = db.execute(
+                "SELECT payload FROM campaign_catalog WHERE ad_account_id = ? ORDER BY campaign_id",
+                (ad_account_id,)).fetchall()
+        listed_at, reconciled_at = (datetime.fromisoformat(value).timestamp() for value in sync)
+        return [json.loads(payload) for payload, in rows], listed_at, reconciled_at
+
+    def save_campaign_catalog(self, ad_account_id: str, campaigns: List[Dict], listed_at: float,
+                              full: bool = False):
+        """
+        Grava as campanhas listadas a partir de listed_at (epoch do início da listagem).
+        full: listagem completa, que substitui o catálogo da conta (remove as excluídas).
+        """
+        listed_on = datetime.fromtimestamp(listed_at).isoformat(timespec="seconds")
+        with self._lock:
+            db = self._db()
+            if full:
+                db.execute("DELETE FROM campaign_catalog WHERE ad_account_id = ?", (ad_account_id,))
+            db.executemany(
+                "INSERT OR REPLACE INTO campaign_catalog (ad_account_id, campaign_id, payload) VALUES (?, ?, ?)",
+                [(ad_account_id, str(c["id"]), json.dumps(c, sort_keys=True, ensure_ascii=False))
+                 for c in campaigns if c.get("id")])
+            db.execute(
+                "INSERT INTO campaign_catalog_sync (ad_account_id, listed_at, reconciled_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (ad_account_id) DO UPDATE SET listed_at = excluded.listed_at"
+                + (", reconciled_at = excluded.reconciled_at" if full else ""),
+                (ad_account_id, listed_on, listed_on))
+            db.commit()
+
+    def iter_archived_campaigns(self, client_ids: Optional[List[str]] = None) -> Iterator[tuple]:
+        """
+        Percorre o arquivo campanha a campanha, com a versão mais recente de cada dia.
+        Gera (client_id, campaign_id, campaign_name, objective, [insights]).
+        """
+        query = """SELECT client_id, campaign_id, campaign_name, objective, payload FROM raw_insights r
+                   WHERE rowid = (
+                       SELECT MAX(rowid) FROM raw_insights
+                       WHERE client_id = r.client_id AND campaign_id = r.campaign_id
+                         AND data_referencia = r.data_referencia)"""
+        params: List[str] = []
+        if client_ids is not None:
+            query += f" AND client_id IN ({','.join('?' * len(client_ids))})"
+            params = list(client_ids)
+        query += " ORDER BY client_id, campaign_id, data_referencia"
+
+        # Conexão própria de leitura: o arquivo pode ser grande demais para carregar de uma vez
+        self._db()
+        reader = sqlite3.connect(self.path)
+        rows = reader.execute(query, params)
+
+        current = None
+        insights: List[Dict] = []
+        for client_id, campaign_id, campaign_name, objective, payload in rows:
+            if current and current[:2] != (client_id, campaign_id):
+                yield (*current, insights)
+                insights = []
+            current = (client_id, campaign_id, campaign_name, objective)
+            insights.append(json.loads(zlib.decompress(payload)))
+        if current:
+            yield (*current, insights)
+        reader.close()
+
+
+class RunCheckpoint:
+    """Unidades concluídas de uma execução, consultadas em memória e gravadas no SQLite"""
+
+    def __init__(self, state: SyncState, run_id: str):
+        self.state = state
+        self.run_id = run_id
+        self._lock = threading.Lock()
+        self._done = {kind: state.get_completed_units(run_id, kind) for kind in ("client", "campaign")}
+        self.resumed = {kind: len(units) for kind, units in self._done.items()}
+
+    def is_done(self, kind: str, unit: str) -> bool:
+        with self._lock:
+            return unit in self._done.get(kind, ())
+
+    def mark_done(self, kind: str, unit: str):
+        self.state.mark_unit_completed(self.run_id, kind, unit)
+        with self._lock:
+            self._done.setdefault(kind, set()).add(unit)
+
+    def count(self, kind: str) -> int:
+        with self._lock:
+            return len(self._done.get(kind, ()))
+
+
+def split_windows(since: date, until: date, window_days: int) -> List[tuple]:
+    """
+    Divide [since, until] em janelas de até window_days dias, com limites fixos
+    (múltiplos de window_days desde 0001-01-01) para que os checkpoints continuem
+    valendo se o período do backfill mudar. Retorna [(since, until)] em YYYY-MM-DD.
+    """
+    windows = []
+    start = since
+    while start <= until:
+        boundary = date.fromordinal((start.toordinal() // window_days + 1) * window_days)
+        end = min(until, boundary - timedelta(days=1))
+        windows.append((start.isoformat(), end.isoformat()))
+        start = end + timedelta(days=1)
+    return windows
+
+
+def plan_refresh(watermarks: Dict[str, str], today: Optional[date] = None, max_day: Optional[int] = None,
+                 min_day: int = 0) -> tuple:
+    """
+    Calcula a janela a buscar para um escopo a partir dos watermarks.
+
+    Retorna (since, until, tiers) com as datas em YYYY-MM-DD e a lista das
+    camadas que ficam atualizadas ao buscar essa janela. Com max_day, só as
+    camadas que terminam até esse dia (exceto na primeira sincronização).
+    Com min_day, só as camadas que começam a partir desse dia, e a janela
+    termina min_day dias atrás; tiers vazio quando nenhuma delas vence.
+    """
+    today = today or date.today()
+    until = today - timedelta(days=min_day)
+
+    if not watermarks:
+        since = today - timedelta(days=INITIAL_WINDOW_DAYS)
+        return (since.isoformat(), until.isoformat(),
+                [name for name, first_day, _, _ in REFRESH_TIERS if first_day >= min_day])
+
+    oldest_day = 0
+    for name, first_day, last_day, interval in REFRESH_TIERS:
+        if first_day < min_day or (max_day is not None and last_day > max_day):
+            continue
+        refreshed_on = watermarks.get(name)
+        if refreshed_on is None or (today - date.fromisoformat(refreshed_on)).days >= interval:
+            oldest_day = max(oldest_day, last_day)
+
+    # As camadas são contíguas: a janela cobre todas as que terminam até oldest_day
+    tiers = [name for name, first_day, last_day, _ in REFRESH_TIERS
+             if first_day >= min_day and last_day <= oldest_day]
+    since = today - timedelta(days=oldest_day)
+    return since.isoformat(), until.isoformat(), tiers
@@ -0,0 +1,122 @@
+"""
+Leases do modo worker (client_leases.py): tomar, renovar, expirar e liberar.
+
+Roda sem Supabase: as funções de add_client_leases.sql são reproduzidas em
+SQLite, com o mesmo UPDATE condicional e um relógio controlado pelo teste
+(no banco real, now()).
+
+    python test_client_leases.py
+"""
+import os
+import sqlite3
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from client_leases import ClientLeases
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self.data = data
+
+    def execute(self):
+        return self
+
+
+class SQLiteLeases:
+    """Tabela clients e RPCs de add_client_leases.sql em SQLite"""
+
+    def __init__(self, client_ids):
+        self.now = 1000.0
+        self.db = sqlite3.connect(":memory:", check_same_thread=False)
+        self.db.execute("""CREATE TABLE clients (
+            id TEXT PRIMARY KEY, lease_owner TEXT, lease_expires_at REAL, sync_completed_round TEXT)""")
+        self.db.executemany("INSERT INTO clients (id) VALUES (?)", [(c,) for c in client_ids])
+
+    def rpc(self, name, params):
+        return FakeResponse(getattr(self, name)(**params))
+
+    def claim_client_lease(self, p_client_id, p_owner, p_ttl_seconds, p_round_id):
+        cursor = self.db.execute(
+            """UPDATE clients SET lease_owner = ?, lease_expires_at = ?
+               WHERE id = ?
+                 AND (lease_owner IS NULL OR lease_owner = ? OR lease_expires_at < ?)
+                 AND sync_completed_round IS NOT ?""",
+            (p_owner, self.now + p_ttl_seconds, p_client_id, p_owner, self.now, p_round_id))
+        return True if cursor.rowcount else None
+
+    def renew_client_leases(self, p_owner, p_ttl_seconds):
+        ids = [row[0] for row in self.db.execute("SELECT id FROM clients WHERE lease_owner = ?", (p_owner,))]
+        self.db.execute("UPDATE clients SET lease_expires_at = ? WHERE lease_owner = ?",
+                        (self.now + p_ttl_seconds, p_owner))
+        return ids
+
+    def release_client_lease(self, p_client_id, p_owner, p_completed, p_round_id):
+        cursor = self.db.execute(
+            """UPDATE clients SET lease_owner = NULL, lease_expires_at = NULL,
+                      sync_completed_round = CASE WHEN ? THEN ? ELSE sync_completed_round END
+               WHERE id = ? AND lease_owner = ?""",
+            (p_completed, p_round_id, p_client_id, p_owner))
+        return True if cursor.rowcount else None
+
+
+def worker(db, owner, round_id="rodada-1"):
+    # Heartbeat longo: as renovações do teste são chamadas explicitamente
+    return ClientLeases(db, round_id, owner=owner, ttl=300, heartbeat=3600)
+
+
+def test_claim_renew_expire_release():
+    db = SQLiteLeases(["k1", "k2"])
+    a = worker(db, "host-a:1")
+    b = worker(db, "host-b:2")
+    try:
+        # Tomar: só um worker fica com o cliente
+        assert a.claim("k1")
+        assert not b.claim("k1")
+        assert b.claim("k2")
+        assert (a.claimed, b.claimed, b.skipped) == (1, 1, 1)
+
+        # Renovar: o lease de A continua valendo depois do TTL original
+        db.now += 200
+        a.renew()
+        db.now += 200
+        assert not b.claim("k1")
+        assert a.lost == 0
+
+        # Expirar: sem renovação, B assume k1 e A percebe que perdeu o lease
+        db.now += 301
+        assert b.claim("k1")
+        b.renew()
+        a.renew()
+        assert a.lost == 1 and "k1" not in a._held
+
+        # Liberar sem concluir: o cliente volta a ficar livre
+        b.release("k1", completed=False)
+        assert a.claim("k1")
+        a.release("k1", completed=True)
+
+        # Concluído na rodada: nenhum worker da mesma rodada o pega de novo,
+        # nem um que começou depois da conclusão
+        late = worker(db, "host-c:3")
+        assert not b.claim("k1")
+        assert not late.claim("k1")
+
+        # Liberar o lease de outro worker não tem efeito
+        a.release("k2", completed=True)
+        assert not a.claim("k2")
+        b.release("k2", completed=True)
+
+        # A próxima rodada sincroniza os clientes de novo
+        next_round = worker(db, "host-a:4", round_id="rodada-2")
+        assert next_round.claim("k1") and next_round.claim("k2")
+        next_round.close()
+        late.close()
+    finally:
+        a.close()
+        b.close()
+
+
+if __name__ == "__main__":
+    test_claim_renew_expire_release()
+    print("OK: leases tomados, renovados, expirados e liberados")
@@ -0,0 +1,94 @@
+"""
+Linha recusada pelo banco (dead-letter) volta a ser enviada na execução seguinte.
+
+Roda sem credenciais reais e sem rede: o cliente Supabase é trocado por um
+falso que recusa a linha de um dia enquanto o "problema de schema" existe, e o
+estado local vai para um diretório temporário.
+
+    python test_dead_letter_retry.py
+"""
+import os
+import sys
+import tempfile
+
+TMP_DIR = tempfile.mkdtemp(prefix="test_dead_letter_")
+os.environ["SYNC_STATE_DB"] = os.path.join(TMP_DIR, "sync_state.db")
+os.environ["DEAD_LETTER_FILE"] = os.path.join(TMP_DIR, "dead_letter.jsonl")
+os.environ["METRICS_PROM_FILE"] = os.path.join(TMP_DIR, "sync_metrics.prom")
+os.environ["METRICS_JSON_FILE"] = os.path.join(TMP_DIR, "sync_metrics.json")
+os.environ.setdefault("META_ACCESS_TOKEN", "test")
+os.environ.setdefault("SUPABASE_URL", "http://localhost")
+os.environ.setdefault("SUPABASE_KEY", "eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoiYW5vbiJ9.test")
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from postgrest.exceptions import APIError
+
+import sync_meta_metrics as sync
+
+BAD_DAY = "2026-10-11"
+
+
+class FakeTable:
+    def __init__(self, db):
+        self.db = db
+        self.rows = []
+
+    def upsert(self, rows, **kwargs):
+        self.rows = rows
+        return self
+
+    def execute(self):
+        if self.db.broken and any(row["data_referencia"] == BAD_DAY for row in self.rows):
+            raise APIError({"code": "22P02", "message": "invalid input syntax", "details": None, "hint": None})
+        self.db.written.extend(self.rows)
+        return self
+
+
+class FakeSupabase:
+    def __init__(self):
+        self.broken = True
+        self.written = []
+
+    def table(self, name):
+        return FakeTable(self)
+
+
+def insights():
+    return [{"date_start": f"2026-10-{day:02d}", "date_stop": f"2026-10-{day:02d}", "spend": "1.5",
+             "impressions": "100", "reach": "80", "clicks": "3",
+             "actions": [{"action_type": "lead", "value": "2"}]} for day in (10, 11, 12)]
+
+
+def test_rejected_row_is_resent_next_run():
+    db = FakeSupabase()
+    sync.supabase = db
+    campaign = {"id": "c1", "name": "Campanha", "objective": "OUTCOME_LEADS"}
+
+    # Contadores do processo (outros testes podem ter rodado antes no mesmo processo)
+    dead_letters = sync.dead_letter.count
+    written = sync.metrics_buffer.rows_written
+    rejected = sync.metrics_buffer.rows_rejected
+
+    # Execução 1: o banco recusa a linha de BAD_DAY, que vai para o dead-letter
+    queued, unchanged = sync.store_campaign_insights("k1", campaign, insights(), archive=False)
+    sync.metrics_buffer.flush()
+    assert queued == 3 and unchanged == 0
+    assert sorted(row["data_referencia"] for row in db.written) == ["2026-10-10", "2026-10-12"]
+    assert sync.dead_letter.count - dead_letters == 1
+    assert sync.metrics_buffer.rows_written - written == 2
+    assert sync.metrics_buffer.rows_rejected - rejected == 1
+    assert BAD_DAY not in sync.sync_state.get_metric_hashes("k1", "c1")
+
+    # Execução 2: problema corrigido; só a linha recusada é reenviada
+    db.broken = False
+    db.written.clear()
+    queued, unchanged = sync.store_campaign_insights("k1", campaign, insights(), archive=False)
+    sync.metrics_buffer.flush()
+    assert queued == 1 and unchanged == 2
+    assert [row["data_referencia"] for row in db.written] == [BAD_DAY]
+    assert BAD_DAY in sync.sync_state.get_metric_hashes("k1", "c1")
+
+
+if __name__ == "__main__":
+    test_rejected_row_is_resent_next_run()
+    print("OK: linha recusada reenviada na execucao seguinte")
@@ -1,6 +1,6 @@
 import os
 from dotenv import load_dotenv
-import requests
+from http_pool import http_get
 
 load_dotenv()
 
@@ -8,7 +8,7 @@ token = os.getenv('META_ACCESS_TOKEN')
 print(f"Token loaded (first 10 chars): {token[:10]}...")
 
 url = f"https://graph.facebook.com/v18.0/me?access_token={token}"
-response = requests.get(url)
+response = http_get(url)
 
 print(f"Status Code: {response.status_code}")
 print(f"Response: {response.text}")
@@ -0,0 +1,96 @@
+"""
+--reclassify aplica as regras de process_actions com o objetivo e o nome
+arquivados de cada campanha.
+
+Roda sem credenciais reais e sem rede: o cliente Supabase é trocado por um
+falso e o estado local vai para um diretório temporário.
+
+    python test_reclassify_rules.py
+"""
+import os
+import sys
+import tempfile
+
+TMP_DIR = tempfile.mkdtemp(prefix="test_reclassify_")
+os.environ["SYNC_STATE_DB"] = os.path.join(TMP_DIR, "sync_state.db")
+os.environ["DEAD_LETTER_FILE"] = os.path.join(TMP_DIR, "dead_letter.jsonl")
+os.environ["METRICS_PROM_FILE"] = os.path.join(TMP_DIR, "sync_metrics.prom")
+os.environ["METRICS_JSON_FILE"] = os.path.join(TMP_DIR, "sync_metrics.json")
+os.environ.setdefault("META_ACCESS_TOKEN", "test")
+os.environ.setdefault("SUPABASE_URL", "http://localhost")
+os.environ.setdefault("SUPABASE_KEY", "eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoiYW5vbiJ9.test")
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import insight_transform
+import sync_meta_metrics as sync
+
+
+class FakeTable:
+    def __init__(self, db):
+        self.db = db
+        self.rows = []
+
+    def upsert(self, rows, **kwargs):
+        self.rows = rows
+        return self
+
+    def execute(self):
+        self.db.written.extend(self.rows)
+        return self
+
+
+class FakeSupabase:
+    def __init__(self):
+        self.written = []
+
+    def table(self, name):
+        return FakeTable(self)
+
+
+def insights():
+    return [{"date_start": f"2026-10-{day:02d}", "date_stop": f"2026-10-{day:02d}", "spend": "1.5",
+             "impressions": "100", "reach": "80", "clicks": "3",
+             "actions": [{"action_type": "lead", "value": "2"},
+                         {"action_type": "post_engagement", "value": "40"}]} for day in (10, 11)]
+
+
+def test_reclassify_uses_archived_objective_and_name():
+    db = FakeSupabase()
+    sync.supabase = db
+    leads = {"id": "c1", "name": "[LEAD] Formulario", "objective": "OUTCOME_LEADS"}
+    engagement = {"id": "c2", "name": "[ENG] Post", "objective": "OUTCOME_ENGAGEMENT"}
+
+    # Sincronização com as regras atuais: as duas campanhas contam 'lead'
+    for campaign in (leads, engagement):
+        sync.store_campaign_insights("k-reclassify", campaign, insights())
+    sync.metrics_buffer.flush()
+    assert {row["resultado_nome"] for row in db.written} == {"lead"}
+
+    # Nova regra: campanhas de engajamento contam engajamento com o post
+    original = insight_transform.process_actions
+    calls = set()
+
+    def process_actions(actions, objective=None, campaign_name="", insight_data=None):
+        calls.add((objective, campaign_name))
+        if objective == "OUTCOME_ENGAGEMENT":
+            action_map = {a.get('action_type'): float(a.get('value', 0)) for a in actions}
+            return (action_map.get('post_engagement', 0.0), 'post_engagement')
+        return original(actions, objective, campaign_name, insight_data)
+
+    insight_transform.process_actions = process_actions
+    try:
+        db.written.clear()
+        queued, unchanged = sync.reclassify_archive(["k-reclassify"])
+    finally:
+        insight_transform.process_actions = original
+
+    assert calls == {("OUTCOME_LEADS", "[LEAD] Formulario"), ("OUTCOME_ENGAGEMENT", "[ENG] Post")}
+    # Só as linhas da campanha de engajamento mudaram
+    assert queued == 2 and unchanged == 2
+    assert {(row["campaign_id"], row["resultado_nome"], row["resultado_valor"]) for row in db.written} == \
+        {("c2", "post_engagement", 40.0)}
+
+
+if __name__ == "__main__":
+    test_reclassify_uses_archived_objective_and_name()
+    print("OK: reclassificacao usa o objetivo e o nome arquivados")
@@ -7,6 +7,8 @@ import sys
 from dotenv import load_dotenv
 from supabase import create_client
 
+from http_pool import http_get, supabase_client_options
+
 # Configurar encoding para Windows
 if sys.platform == 'win32':
     import io
@@ -39,7 +41,7 @@ print("OK: Variaveis de ambiente carregadas")
 # Testar conexão Supabase
 print("\nTestando conexao com Supabase...")
 try:
-    supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+    supabase = create_client(SUPABASE_URL, SUPABASE_KEY, options=supabase_client_options())
     # Buscar um cliente para teste
     clients = supabase.table("clients").select("id,cliente,conta_anuncio").eq("ativo", True).limit(1).execute()
     
@@ -55,9 +57,8 @@ except Exception as e:
 
 # Testar token Meta
 print("\nTestando token do Meta...")
-import requests
 try:
-    response = requests.get(
+    response = http_get(
         f"https://graph.facebook.com/v21.0/me",
         params={"access_token": META_ACCESS_TOKEN},
         timeout=10
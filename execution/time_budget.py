@@ -0,0 +1,106 @@
+"""
+Prazo da execução (--time-budget).
+
+Antes de cada unidade de trabalho (cliente, campanha, chamada batch) o script
+pergunta se ela cabe no tempo que resta: o custo estimado é a quantidade de
+requisições da unidade x o custo observado por requisição nesta execução
+(o maior entre a latência média das respostas e o tempo total decorrido
+dividido pelas requisições feitas, que inclui esperas do governador e
+gravação). Antes da primeira resposta não há estimativa, e a unidade só
+precisa de tempo além da reserva, que fica no fim para gravar o buffer.
+
+Quando uma unidade não cabe, o prazo é dado como esgotado: nenhuma requisição
+nova é iniciada e o restante é registrado como adiado (por cliente e por
+passada), para o relatório do fim da execução. Como os watermarks só avançam
+para o que foi gravado, a próxima execução busca o que foi adiado.
+"""
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+# Reserva para a gravação final (no máximo 10% do prazo)
+BUDGET_RESERVE_SECONDS = 30.0
+
+
+def parse_duration(value: str) -> float:
+    """Duração em segundos ("900") ou com unidade ("45m", "1h", "90s")"""
+    text = value.strip().lower()
+    units = {"s": 1, "m": 60, "h": 3600}
+    factor = units.get(text[-1:], None)
+    try:
+        seconds = float(text[:-1] if factor else text) * (factor or 1)
+    except ValueError:
+        raise ValueError(f"duracao invalida '{value}' (use segundos ou 45m, 1h)")
+    if seconds <= 0:
+        raise ValueError(f"duracao invalida '{value}' (precisa ser positiva)")
+    return seconds
+
+
+class TimeBudget:
+    def __init__(self, seconds: float, reserve: Optional[float] = None,
+                 clock: Callable[[], float] = time.monotonic):
+        self.seconds = seconds
+        self.reserve = min(BUDGET_RESERVE_SECONDS, seconds * 0.1) if reserve is None else reserve
+        self._clock = clock
+        self.started = clock()
+        self.deadline = self.started + seconds
+
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.latency = 0.0
+        self.exhausted = False
+        self.exhausted_at: Optional[float] = None
+
+        # Passada atual: a prioritária só atualiza os dias mais recentes
+        self.priority_pass = True
+        self.pass_label = ""
+        # {cliente: {passada: campanhas adiadas (0 = cliente inteiro)}}
+        self.deferred: Dict[str, Dict[str, int]] = {}
+
+    def start_pass(self, priority: bool, label: str):
+        self.priority_pass = priority
+        self.pass_label = label
+
+    def observe_request(self, seconds: float):
+        with self._lock:
+            self.requests += 1
+            self.latency += seconds
+
+    def elapsed(self) -> float:
+        return self._clock() - self.started
+
+    def remaining(self) -> float:
+        return self.deadline - self._clock()
+
+    def request_cost(self) -> float:
+        """Segundos estimados por requisição, pelo observado até agora (0 antes da primeira)"""
+        with self._lock:
+            if not self.requests:
+                return 0.0
+            return max(self.latency / self.requests, self.elapsed() / self.requests)
+
+    def allows(self, requests: int = 1) -> bool:
+        """True se a unidade (requests requisições) cabe no prazo; senão o prazo fica esgotado"""
+        if self.exhausted:
+            return False
+        if self.remaining() - self.reserve <= requests * self.request_cost():
+            self.exhausted = True
+            self.exhausted_at = self.elapsed()
+        return not self.exhausted
+
+    def defer(self, client_name: str, campaigns: int = 0):
+        """Registra trabalho adiado do cliente na passada atual (campaigns=0: o cliente inteiro)"""
+        with self._lock:
+            by_pass = self.deferred.setdefault(client_name, {})
+            if by_pass.get(self.pass_label, None) == 0:
+                return
+            by_pass[self.pass_label] = 0 if not campaigns else by_pass.get(self.pass_label, 0) + campaigns
+
+    def report(self) -> List[str]:
+        """Linhas do relatório do que foi adiado"""
+        lines = []
+        for client_name, by_pass in sorted(self.deferred.items()):
+            parts = [f"{label}: {'tudo' if not count else f'{count} campanha(s)'}"
+                     for label, count in by_pass.items()]
+            lines.append(f"{client_name} -> " + "; ".join(parts))
+        return lines
@@ -0,0 +1,192 @@
+"""
+Buffer de escrita que junta linhas de várias campanhas e clientes.
+
+Em vez de um upsert pequeno por campanha, as linhas se acumulam e são
+gravadas de uma vez quando o buffer atinge o limite de linhas, o limite de
+bytes do payload ou a idade máxima. Assim a quantidade de gravações acompanha
+o volume de dados e não a quantidade de campanhas.
+
+Cada grupo de linhas pode trazer um callback (on_written) que só é chamado
+depois que o flush que contém essas linhas terminar com sucesso; é assim que
+os watermarks de sincronização só avançam depois da gravação. flush_fn
+retorna as linhas gravadas, ou (gravadas, recusadas) quando isola linhas que o
+banco recusou (ex: dead-letter): as recusadas não seguram os callbacks nem
+contam como gravadas. Um flush que não resolve todas as linhas conta como falha.
+
+Com key_fn, uma linha nova substitui a pendente de mesma chave (o upsert ON
+CONFLICT não aceita a mesma chave duas vezes no mesmo comando).
+
+Os limites de linhas e bytes são conferidos a cada add(). A idade também é
+conferida por uma thread (iniciada no primeiro add), então linhas pendentes
+são gravadas em até max_age segundos mesmo quando nada novo chega (ex:
+durante a espera de um relatório assíncrono ou do governador de taxa).
+
+O flush troca as linhas pendentes sob o lock e grava fora dele: add() (do
+produtor ou da thread de idade) não espera a requisição ao banco. Os flushes
+em si continuam um de cada vez, na ordem em que as linhas foram trocadas, para
+os callbacks de um grupo nunca rodarem antes da gravação das linhas anteriores.
+
+As latências ficam em uma amostra limitada às últimas LATENCY_SAMPLES gravações
+(p50/p95), com média e máximo acumulados: a memória não cresce no --daemon.
+"""
+import json
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, Hashable, List, Optional, Tuple, Union
+
+# Gravações mais recentes usadas para p50/p95
+LATENCY_SAMPLES = 1000
+
+
+class WriteBuffer:
+    def __init__(self, flush_fn: Callable[[List[Dict]], Union[int, Tuple[int, int]]], max_rows: int = 1000,
+                 max_bytes: int = 1_000_000, max_age: float = 10.0, label: str = "buffer",
+                 key_fn: Optional[Callable[[Dict], Hashable]] = None):
+        self.flush_fn = flush_fn
+        self.key_fn = key_fn
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.label = label
+
+        self._lock = threading.RLock()
+        # Um flush por vez (a gravação acontece fora de _lock)
+        self._flush_lock = threading.RLock()
+        self._rows: Dict[Hashable, Dict] = {}
+        self._callbacks: List[Callable[[], None]] = []
+        self._bytes = 0
+        self._oldest: Optional[float] = None
+        self._age_thread: Optional[threading.Thread] = None
+
+        # Estatísticas
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.rows_written = 0
+        self.rows_rejected = 0
+        self.bytes_written = 0
+        self.latencies: Deque[float] = deque(maxlen=LATENCY_SAMPLES)
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def configure(self, max_rows: Optional[int] = None, max_bytes: Optional[int] = None,
+                  max_age: Optional[float] = None):
+        with self._lock:
+            if max_rows is not None:
+                self.max_rows = max_rows
+            if max_bytes is not None:
+                self.max_bytes = max_bytes
+            if max_age is not None:
+                self.max_age = max_age
+
+    def add(self, rows: List[Dict], on_written: Optional[Callable[[], None]] = None):
+        """Enfileira linhas; grava se algum limite for atingido"""
+        with self._lock:
+            for row in rows:
+                key = self.key_fn(row) if self.key_fn else len(self._rows)
+                previous = self._rows.get(key)
+                if previous is not None:
+                    # Linha substituída: o payload passa a ter o tamanho da nova
+                    self._bytes -= len(json.dumps(previous, default=str))
+                self._bytes += len(json.dumps(row, default=str))
+                self._rows[key] = row
+            if on_written:
+                self._callbacks.append(on_written)
+            if self._oldest is None and (rows or on_written):
+                self._oldest = time.monotonic()
+            if self._age_thread is None and self.max_age > 0:
+                self._age_thread = threading.Thread(target=self._flush_by_age, name=f"{self.label}-age",
+                                                    daemon=True)
+                self._age_thread.start()
+            should_flush = self._should_flush()
+
+        if should_flush:
+            self.flush()
+
+    def _flush_by_age(self):
+        """Thread: grava o que estiver pendente há mais de max_age, mesmo sem add()"""
+        while True:
+            time.sleep(max(0.1, min(self.max_age / 2, 1.0)))
+            with self._lock:
+                expired = self._oldest is not None and time.monotonic() - self._oldest >= self.max_age
+            if expired:
+                self.flush()
+
+    def _should_flush(self) -> bool:
+        if not self._rows and not self._callbacks:
+            return False
+        if len(self._rows) >= self.max_rows or self._bytes >= self.max_bytes:
+            return True
+        return self._oldest is not None and time.monotonic() - self._oldest >= self.max_age
+
+    def flush(self) -> int:
+        """Grava tudo que está pendente; retorna a quantidade de linhas gravadas"""
+        with self._flush_lock:
+            # Só a troca das linhas pendentes acontece sob _lock; a gravação não bloqueia add()
+            with self._lock:
+                rows, callbacks, size = list(self._rows.values()), self._callbacks, self._bytes
+                self._rows, self._callbacks, self._bytes, self._oldest = {}, [], 0, None
+
+            if not rows and not callbacks:
+                return 0
+
+            started = time.monotonic()
+            try:
+                result = self.flush_fn(rows) if rows else 0
+                written, rejected = result if isinstance(result, tuple) else (result, 0)
+            except Exception as e:
+                self.failed_flushes += 1
+                print(f"      ERRO: Falha ao gravar {len(rows)} linha(s) do {self.label}: {str(e)}")
+                return 0
+
+            if rows:
+                latency = time.monotonic() - started
+                self.latencies.append(latency)
+                self.latency_total += latency
+                self.latency_max = max(self.latency_max, latency)
+                self.flushes += 1
+                self.rows_written += written
+                self.rows_rejected += rejected
+                self.bytes_written += size
+
+            if written + rejected < len(rows):
+                # Gravação parcial: as linhas que falharam serão buscadas de novo na próxima execução
+                self.failed_flushes += 1
+                print(f"      ERRO: {len(rows) - written - rejected} de {len(rows)} linha(s) do {self.label} "
+                      f"nao foram gravadas")
+                return written
+
+            for callback in callbacks:
+                try:
+                    callback()
+                except Exception as e:
+                    print(f"      AVISO: Falha no callback pos-gravacao: {str(e)}")
+
+            return written
+
+    def summary(self) -> Dict:
+        """Totais exatos; p50/p95 das últimas LATENCY_SAMPLES gravações"""
+        latencies = sorted(self.latencies)
+
+        def pct(p):
+            return latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000 if latencies else 0.0
+
+        return {
+            "flushes": self.flushes,
+            "failed_flushes": self.failed_flushes,
+            "rows": self.rows_written,
+            "rejected": self.rows_rejected,
+            "bytes": self.bytes_written,
+            "avg_ms": (self.latency_total / self.flushes * 1000) if self.flushes else 0.0,
+            "p50_ms": pct(0.50),
+            "p95_ms": pct(0.95),
+            "max_ms": self.latency_max * 1000,
+        }
+
+    def print_summary(self):
+        s = self.summary()
+        print(f"Gravacoes ({self.label}): {s['flushes']} flush(es), {s['rows']} linha(s), "
+              f"{s['bytes'] / 1024:.0f} KB | latencia media {s['avg_ms']:.0f} ms, "
+              f"p50 {s['p50_ms']:.0f} ms, p95 {s['p95_ms']:.0f} ms, max {s['max_ms']:.0f} ms"
+              + (f" | {s['rejected']} recusada(s)" if s['rejected'] else "")
+              + (f" | {s['failed_flushes']} falha(s)" if s['failed_flushes'] else ""))